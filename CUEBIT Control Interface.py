@@ -20,10 +20,25 @@ import threading
 from tkinter import *
 from tkinter import ttk
 from tkinter import filedialog
+from tkinter import messagebox
+from tkinter import simpledialog
 from PIL import ImageTk, Image
 
 #Import Server Tools
-from data_client import BaseDataClient
+from data_client import BaseDataClient, ColumnarSnapshot, ValueCache
+from timing import FixedRate, CycleStats, PollScheduler
+from interlocks import InterlockWatcher
+from alarms import AlarmEngine, RAISE
+from sequencer import TrapSequencer
+from ramp import RampEngine
+from scan import RasterScan
+from optimizer import BeamOptimizer
+from coalescer import WriteCoalescer
+from variable_table import VariableTable
+from clock_sync import ClockSync
+from exporter import RecordingExporter, parse_time
+from strip_chart import StripChart
+import machine_state
 
 #Import Math Tools
 import matplotlib
@@ -31,7 +46,6 @@ matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
 from matplotlib.figure import Figure
-import matplotlib.animation as animation
 import numpy as np
 import scipy as sp
 import pandas as pd
@@ -55,6 +69,140 @@ except:
 if DEBUG:
     ADDR = ("130.127.188.254", 20002)
 
+# Number of times per second the data reader refreshes the display, and the rates offered in the Tools menu
+READ_RATE = 10
+READ_RATES = (2, 5, 10, 20)
+
+#Power buttons updated by the data reader: (power attribute, button attribute, button variable, server key)
+POWER_BUTTONS = [
+    ('U_cat_power', 'U_cat_button', 'U_cat', 'Cathode_Voltage_Power'),
+    ('I_heat_power', 'I_heat_button', 'I_heat', 'Cathode_Heater_Power'),
+    ('anode_power', 'anode_button', 'anode_power', 'Anode_Voltage_Power'),
+    ('dt_power', 'dt_button', 'dt_power', 'Drift_Tubes_Power'),
+    ('U_ext_power', 'U_ext_button', 'U_ext', 'Extraction_Voltage_Power'),
+    ('U_EL1_power', 'U_EL1_button', 'U_EL1', 'Lens_1_Voltage_Power'),
+    ('U_EL2_power', 'U_EL2_button', 'U_EL2', 'Lens_2_Voltage_Power'),
+    ('U_X1_power', 'U_X1_button', 'U_X1', 'Deflectors_XY1_X_Power'),
+    ('U_Y1_power', 'U_Y1_button', 'U_Y1', 'Deflectors_XY1_Y_Power'),
+    ('U_X2_power', 'U_X2_button', 'U_X2', 'Deflectors_XY2_X_Power'),
+    ('U_Y2_power', 'U_Y2_button', 'U_Y2', 'Deflectors_XY2_Y_Power'),
+]
+
+#Polarity buttons updated by the data reader: (polarity attribute, button attribute, button variable, label attribute, server key)
+CHARGE_BUTTONS = [
+    ('U_EL1_q', 'U_EL1_charge', 'U_EL1_charge', 'U_EL1_label3', 'Lens_1_Polarity'),
+    ('U_EL2_q', 'U_EL2_charge', 'U_EL2_charge', 'U_EL2_label3', 'Lens_2_Polarity'),
+]
+
+#Refresh period (s) and priority of the keys read by the data reader, slow changing values are read less often
+POLL_GROUPS = [
+    (0.1, 2, ['Cathode_Emission', 'Pressure_HV_Source', 'Cathode_Voltage_Read', 'Cathode_Heater_Current_Read',
+              'Anode_Voltage_Read', 'Anode_Current', 'Drift_Tubes_Current']),
+    (0.2, 1, ['Drift_Tubes_U0_Read', 'Drift_Tubes_UA_Read', 'Drift_Tubes_UB', 'Extraction_Voltage_Read',
+              'Lens_1_Voltage_Read', 'Lens_2_Voltage_Read',
+              'Deflectors_XY1_XA', 'Deflectors_XY1_XB', 'Deflectors_XY1_YA', 'Deflectors_XY1_YB',
+              'Deflectors_XY2_XA', 'Deflectors_XY2_XB', 'Deflectors_XY2_YA', 'Deflectors_XY2_YB']),
+    (0.5, 1, [button[-1] for button in POWER_BUTTONS + CHARGE_BUTTONS]),
+    (2.0, 0, ['Drift_Tubes_T_Ion', 'Drift_Tubes_T_Ext']),
+]
+
+#Refresh period (s) of every other key, shown in the Variables tab
+VARIABLES_PERIOD = 2.0
+
+#Traces of the strip chart on the operation tab: (key, label, options)
+STRIP_CHART = [
+    ('Anode_Voltage_Read', 'U_An (V)', {}),
+    ('Anode_Current', 'I_An (μA)', {}),
+    ('Cathode_Emission', 'I_cat (mA)', {}),
+    ('Drift_Tubes_Current', 'I_dt (μA)', {}),
+    ('Pressure_HV_Source', 'P_source (mbar)', {'log': True}),
+]
+#Seconds of history shown by the strip chart
+STRIP_CHART_SPAN = 60.0
+
+#Seconds between estimates of the server clock offset, and the key read for the server's time
+#(the server's hello reply carries no time of its own). ClockSync ignores the key if the server
+#doesn't restamp it on every read, and the strip chart then plots readings when they arrive
+CLOCK_SYNC_PERIOD = 10.0
+CLOCK_PROBE_KEY = 'Cathode_Emission'
+
+#Most keys the data reader requests individually per cycle, and the fraction of
+#all its keys above which a single get_all is cheaper than individual requests
+READ_BATCH = 32
+FULL_READ_FRACTION = 0.75
+
+#Server keys of the status interlocks, watched on their own connection
+INTERLOCK_KEYS = {
+    'water': 'Interlock_Water',
+    'air': 'Interlock_Air',
+    'power_FUG': 'Interlock_Power_FUG',
+    'press_GND': 'Interlock_Pressure_GND',
+    'press_HV': 'Interlock_Pressure_HV',
+    'HV_beamline_relay': 'Interlock_HV_Beamline_Relay',
+    'HV_cabinet': 'Interlock_HV_Cabinet',
+    'GND_cabinet': 'Interlock_GND_Cabinet',
+    'doors': 'Interlock_Doors',
+    'EMO': 'Interlock_EMO',
+}
+#Poll period of the interlock watcher in seconds
+INTERLOCK_PERIOD = 0.02
+
+#Limits checked on every read: key -> (low, high, deadband), these match the ranges accepted by the setpoint entries
+ALARM_LIMITS = {
+    'Cathode_Voltage_Read': (0, 6500, 10),
+    'Cathode_Heater_Current_Read': (0, 10, 0.05),
+    'Anode_Voltage_Read': (0, 20000, 10),
+    'Drift_Tubes_U0_Read': (0, 20000, 10),
+    'Drift_Tubes_UA_Read': (0, 2000, 1),
+    'Extraction_Voltage_Read': (0, 10000, 10),
+    'Lens_1_Voltage_Read': (0, 10000, 10),
+    'Lens_2_Voltage_Read': (0, 10000, 10),
+    'Deflectors_XY1_XA': (-1000, 1000, 1),
+    'Deflectors_XY1_XB': (-1000, 1000, 1),
+    'Deflectors_XY1_YA': (-1000, 1000, 1),
+    'Deflectors_XY1_YB': (-1000, 1000, 1),
+    'Deflectors_XY2_XA': (-1000, 1000, 1),
+    'Deflectors_XY2_XB': (-1000, 1000, 1),
+    'Deflectors_XY2_YA': (-1000, 1000, 1),
+    'Deflectors_XY2_YB': (-1000, 1000, 1),
+}
+
+#Trap potential U_A (V) written at the start of the extraction phase when the drift tube timer is on,
+#the breeding phase writes the U_A set on the server. None asks the operator the first time the timer is started
+DT_EXTRACT_UA = None
+#Server keys the drift tube timer takes its breeding U_A (V), t_ion and t_ext (ms) from
+DT_TIMER_KEYS = ['Drift_Tubes_UA_Set', 'Drift_Tubes_T_Ion', 'Drift_Tubes_T_Ext']
+
+#Setpoints entered for these supplies are ramped to at the given rate (V/s) instead of being written at once
+RAMP_RATES = {
+    'Cathode_Voltage_Set': 500,
+    'Anode_Voltage_Set': 1000,
+    'Drift_Tubes_U0_Set': 1000,
+    'Extraction_Voltage_Set': 1000,
+    'Lens_1_Voltage_Set': 1000,
+    'Lens_2_Voltage_Set': 1000,
+}
+USE_RAMPS = True
+#Power switches of ramped setpoints not named <name>_Power
+RAMP_POWERS = {'Drift_Tubes_U0_Set': 'Drift_Tubes_Power'}
+
+#Server keys of the Faraday cup currents read during deflector scans
+FARADAY_CUP_KEYS = ['FC1_Current', 'FC2_Current']
+
+#Setpoints the beam optimizer can tune: key -> (initial step, low limit, high limit)
+OPTIMIZER_KEYS = {
+    'Extraction_Voltage_Set': (200, 14, 10000),
+    'Lens_1_Voltage_Set': (200, 14, 10000),
+    'Lens_2_Voltage_Set': (200, 14, 10000),
+    'Deflectors_XY1_X_Set': (20, -1000, 1000),
+    'Deflectors_XY1_Y_Set': (20, -1000, 1000),
+    'Deflectors_XY2_X_Set': (20, -1000, 1000),
+    'Deflectors_XY2_Y_Set': (20, -1000, 1000),
+}
+
+# Set true to show the Diagnostics tab with client latency and error statistics
+SHOW_DIAGNOSTICS = True
+
 
 #Defines location of the Desktop as well as font and text size for use in the software
 desktop = os.path.expanduser("~\Desktop")
@@ -71,24 +219,7 @@ def callback(url):
 
 #Sorts all columns of a matrix by a single column
 def orderMatrix(matrix, column):
-    i = 0
-    a = len(matrix)
-    orderedMatrix = []
-    while i < len(matrix):
-        j = 0
-        smallest = True
-        while j < len(matrix) and smallest == True:
-            if matrix[i][column] <= matrix[j][column]:
-                smallest = True
-                j = j + 1
-            else:
-                smallest = False
-        if smallest == True:
-            orderedMatrix.append(matrix.pop(i))
-            i = 0
-        else:
-            i = i + 1
-    return orderedMatrix
+    return sorted(matrix, key=lambda row: row[column])
 
 #Enables multi-threading so that function will not freeze main GUI
 def multiThreading(function):
@@ -106,7 +237,8 @@ class EBIT:
     def __init__(self):
         #Establishes connection to Server
         try:
-            self.client = BaseDataClient(ADDR)
+            #Values read at startup are cached for a second so the reads below share one get_all
+            self.client = BaseDataClient(ADDR, cache=ValueCache(max_age=1.0))
             self.client.select()
         except:
             print('Error: Could not establish connection to server')
@@ -120,11 +252,6 @@ class EBIT:
         self.filename = None
         self.work_dir = None
 
-        #Arrays for plots
-        self.time_array = []
-        self.anode_array = []
-        self.valve_pressure_array = []
-        self.source_pressure_array = []
 
         #Pressure Variables
         self.P_source = None
@@ -222,7 +349,35 @@ class EBIT:
         self.U_EL1_q = 1
         self.U_EL2_q = 1
 
+        #Data reader timing
+        self.read_rate = READ_RATE
+        self.read_schedule = None
+        self.read_stats = None
+        self.read_scheduler = None
+        self.interlocks = None
+        self.clock = ClockSync()
+        self.server_values = {}
+        self.sequencer = None
+        #U_A the timer breeds at, written back when it stops, and the one it extracts at
+        self.sequencer_UA = None
+        self.U_A_extract = DT_EXTRACT_UA
+        self.ramps = None
+        self.ramp_watching = False
+        self.writer = None
+        self.scan = None
+        self.optimizer = None
+        self.exporter = None
+
+        #Alarm limits checked by the data reader
+        self.alarms = AlarmEngine()
+        for key in ALARM_LIMITS:
+            low, high, deadband = ALARM_LIMITS[key]
+            self.alarms.set_limits(key, low, high, deadband)
+
         try:
+            #Fetches everything at once, keys missed here are read individually below
+            self.client.get_all()
+
             #Read Pressure values from server
             self.P_source = self.client.get_float('Pressure_HV_Source')[1]
 
@@ -292,6 +447,10 @@ class EBIT:
             self.U_Y2_A = 0
             self.U_Y2_B = 0
 
+        #The cache only lets the startup reads share one get_all, later reads should always see the live value
+        if getattr(self, 'client', None) is not None:
+            self.client.cache = None
+
         #Currently initializes variables just for testing purposes. Later, we will read in the actual values in the try block above
         if True:
             #Defines global variables
@@ -302,9 +461,6 @@ class EBIT:
             self.filename = None
             self.work_dir = None
             
-            #Arrays for plots
-            self.time_array = []
-            self.anode_array = []
 
             #Cathode Variables
             self.I_heat_set = 0
@@ -361,6 +517,10 @@ class EBIT:
 
     def quitProgram(self):
         print('quit')
+        #Leaves U_A at the breeding potential rather than wherever the timer was
+        self.stop_sequencer()
+        if self.writer is not None:
+            self.writer.close()
         self.root.quit()
         self.root.destroy()
     
@@ -424,12 +584,342 @@ class EBIT:
         t.pack(side=TOP, fill=X)
         v.config(command=t.yview)
 
+    #Saves every setpoint, power and polarity state to a file
+    def save_state(self):
+        filename = filedialog.asksaveasfilename(initialdir=self.work_dir or desktop, title='Save Machine State',
+                                                defaultextension='.json', filetypes=[('Machine State', '*.json')])
+        if not filename:
+            return
+        self.work_dir = os.path.dirname(filename)
+        values = machine_state.capture(self.client)
+        machine_state.save(filename, values)
+        print(f'Saved {len(values)} values to {filename}')
+
+    #Restores a state saved by save_state, then checks that the readbacks match
+    def restore_state(self):
+        filename = filedialog.askopenfilename(initialdir=self.work_dir or desktop, title='Restore Machine State',
+                                              filetypes=[('Machine State', '*.json')])
+        if not filename:
+            return
+        self.work_dir = os.path.dirname(filename)
+        target = machine_state.load(filename)
+        if not messagebox.askyesno('Restore State', f'Write {len(target)} values from {os.path.basename(filename)} to the machine?'):
+            return
+
+        def restore():
+            #Uses its own connection so the readback checks don't hold up the GUI
+            client = BaseDataClient(ADDR)
+            client.select()
+            start = time.time()
+            #Live high voltage supplies are ramped at their usual rates, never set in one jump
+            mismatched = machine_state.restore(client, target, rates=RAMP_RATES if USE_RAMPS else None)
+            client.close()
+            print(f'State restored in {round(time.time()-start,1)} s')
+            for key in mismatched:
+                expected, actual = mismatched[key]
+                print(f'  {key}: expected {expected}, reads {actual}')
+        multiThreading(restore)
+
+    #Opens the Export Recording window, which copies part of a recording to CSV or .npz in the background
+    def ExportRecording(self):
+        t = Toplevel(self.root)
+        t.wm_title("Export Recording")
+        t.geometry("600x300")
+        t.configure(background='grey90')
+        if platform.system() == 'Windows':
+            try:
+                t.iconbitmap("icons/CSA.ico")
+            except TclError:
+                print('Program started remotely by another program...')
+                print('No icons will be used')
+
+        #Entries: (label, rely)
+        fields = [('Recording', 0.08), ('Export to', 0.2), ('Keys', 0.32), ('Start', 0.44), ('End', 0.56)]
+        entries = {}
+        for name, y in fields:
+            Label(t, text=name, font=font_12, bg='grey90').place(relx=0.03, rely=y, anchor=W)
+            entry = Entry(t, font=font_12, width=42)
+            entry.place(relx=0.18, rely=y, anchor=W)
+            entries[name] = entry
+        Label(t, text='comma separated, all if empty', font=('Helvetica', 9), bg='grey90').place(relx=0.18, rely=0.38, anchor=W)
+        Label(t, text='YYYY-MM-DD HH:MM:SS, open ended if empty', font=('Helvetica', 9), bg='grey90').place(relx=0.18, rely=0.62, anchor=W)
+
+        def browse_source():
+            filename = filedialog.askopenfilename(initialdir=self.work_dir or desktop, title='Recording',
+                                                  filetypes=[('Recording', '*.csv')])
+            if filename:
+                entries['Recording'].delete(0, END)
+                entries['Recording'].insert(0, filename)
+
+        def browse_dest():
+            filename = filedialog.asksaveasfilename(initialdir=self.work_dir or desktop, title='Export to', defaultextension='.npz',
+                                                    filetypes=[('NumPy', '*.npz'), ('CSV', '*.csv')])
+            if filename:
+                self.work_dir = os.path.dirname(filename)
+                entries['Export to'].delete(0, END)
+                entries['Export to'].insert(0, filename)
+
+        Button(t, text='Browse', command=browse_source, width=8).place(relx=0.9, rely=0.08, anchor=CENTER)
+        Button(t, text='Browse', command=browse_dest, width=8).place(relx=0.9, rely=0.2, anchor=CENTER)
+
+        progress = ttk.Progressbar(t, orient=HORIZONTAL, length=400, mode='determinate', maximum=1.0)
+        progress.place(relx=0.03, rely=0.75, anchor=W)
+        status = Label(t, text='', font=font_12, bg='grey90')
+        status.place(relx=0.03, rely=0.88, anchor=W)
+
+        def start():
+            if self.exporter is not None and self.exporter.running:
+                return
+            source = entries['Recording'].get().strip()
+            dest = entries['Export to'].get().strip()
+            if not source or not dest:
+                status.config(text='Please choose a recording and a file to export to')
+                return
+            keys = [key.strip() for key in entries['Keys'].get().split(',') if key.strip()] or None
+            try:
+                start_time = parse_time(entries['Start'].get())
+                end_time = parse_time(entries['End'].get())
+            except ValueError:
+                status.config(text='Please enter times as YYYY-MM-DD HH:MM:SS')
+                return
+            self.exporter = RecordingExporter(source, dest, keys, start_time, end_time)
+            self.exporter.start()
+            refresh()
+
+        #Shows the progress of the export without blocking the GUI
+        def refresh():
+            exporter = self.exporter
+            if exporter is None or not t.winfo_exists():
+                return
+            progress['value'] = exporter.progress
+            text = f'{exporter.status}: {exporter.rows} rows'
+            if exporter.skipped:
+                text += f', {exporter.skipped} non-numeric skipped'
+            if exporter.error is not None:
+                text += f' ({exporter.error})'
+            status.config(text=text)
+            if exporter.running:
+                t.after(250, refresh)
+
+        def stop():
+            if self.exporter is not None:
+                self.exporter.stop()
+
+        Button(t, text='Export', command=start, width=8).place(relx=0.8, rely=0.75, anchor=CENTER)
+        Button(t, text='Stop', command=stop, width=8).place(relx=0.8, rely=0.88, anchor=CENTER)
+
+    #Opens the Deflector Scan window, which rasters a deflector pair and plots the Faraday cup current
+    def DeflectorScan(self):
+        t = Toplevel(self.root)
+        t.wm_title("Deflector Scan")
+        t.geometry("700x650")
+        t.configure(background='grey90')
+        if platform.system() == 'Windows':
+            try:
+                t.iconbitmap("icons/CSA.ico")
+            except TclError:
+                print('Program started remotely by another program...')
+                print('No icons will be used')
+
+        deflector = StringVar(t, value='XY1')
+        cup = StringVar(t, value=FARADAY_CUP_KEYS[0])
+        Label(t, text='Deflectors', font=font_12, bg='grey90').place(relx=0.02, rely=0.03, anchor=W)
+        OptionMenu(t, deflector, 'XY1', 'XY2').place(relx=0.17, rely=0.03, anchor=W)
+        Label(t, text='Readout', font=font_12, bg='grey90').place(relx=0.35, rely=0.03, anchor=W)
+        OptionMenu(t, cup, *FARADAY_CUP_KEYS).place(relx=0.47, rely=0.03, anchor=W)
+
+        #Entries for the scan range: (label, default, relx, rely)
+        fields = [('X min', -100, 0.02, 0.09), ('X max', 100, 0.22, 0.09), ('X steps', 21, 0.42, 0.09),
+                  ('Y min', -100, 0.02, 0.15), ('Y max', 100, 0.22, 0.15), ('Y steps', 21, 0.42, 0.15),
+                  ('Settle (ms)', 50, 0.62, 0.09), ('Samples', 1, 0.62, 0.15)]
+        entries = {}
+        for name, default, x, y in fields:
+            Label(t, text=name, font=font_12, bg='grey90').place(relx=x, rely=y, anchor=W)
+            entry = Entry(t, font=font_12, justify=RIGHT, width=6)
+            entry.insert(0, default)
+            entry.place(relx=x+0.11, rely=y, anchor=W)
+            entries[name] = entry
+
+        status = Label(t, text='', font=font_12, bg='grey90')
+        status.place(relx=0.02, rely=0.97, anchor=W)
+
+        fig = Figure(figsize=(6,4.5))
+        ax = fig.add_subplot(111)
+        plot = FigureCanvasTkAgg(fig, t)
+        plot.get_tk_widget().place(relx=0.5, rely=0.57, anchor=CENTER)
+
+        def start():
+            if self.scan is not None:
+                self.scan.stop()
+            try:
+                x_values = np.linspace(float(entries['X min'].get()), float(entries['X max'].get()), int(entries['X steps'].get()))
+                y_values = np.linspace(float(entries['Y min'].get()), float(entries['Y max'].get()), int(entries['Y steps'].get()))
+                settle = float(entries['Settle (ms)'].get())/1000
+                samples = int(entries['Samples'].get())
+            except ValueError:
+                status.config(text='Please enter numbers for the scan range')
+                return
+            if np.max(np.abs(np.concatenate((x_values, y_values)))) > 1000:
+                status.config(text='Maximum deflector voltage is 1000')
+                return
+            pair = deflector.get()
+            #The scan gets its own connection so it can run alongside the GUI, closed when the scan ends
+            client = BaseDataClient(ADDR)
+            client.select()
+            self.scan = RasterScan(client, f'Deflectors_{pair}_X_Set', f'Deflectors_{pair}_Y_Set',
+                                   x_values, y_values, [cup.get()], settle, samples, close=True)
+            self.scan.start()
+            refresh()
+
+        def refresh():
+            scan = self.scan
+            if scan is None or not t.winfo_exists():
+                return
+            ax.clear()
+            dx = (scan.x_values[-1] - scan.x_values[0])/max(len(scan.x_values) - 1, 1)/2
+            dy = (scan.y_values[-1] - scan.y_values[0])/max(len(scan.y_values) - 1, 1)/2
+            extent = (scan.x_values[0] - dx, scan.x_values[-1] + dx, scan.y_values[0] - dy, scan.y_values[-1] + dy)
+            ax.imshow(scan.image(), origin='lower', extent=extent, aspect='auto')
+            ax.set_xlabel(f'{scan.x_key} (V)')
+            ax.set_ylabel(f'{scan.y_key} (V)')
+            text = f'{scan.points}/{scan.data.shape[0]*scan.data.shape[1]} points, {round(scan.rate(),1)} points/s'
+            if not scan.running:
+                centre = scan.centre()
+                if centre is not None:
+                    ax.plot(centre[0], centre[1], 'r+', markersize=15)
+                    text += f', beam centre X = {round(centre[0],1)} V, Y = {round(centre[1],1)} V'
+            status.config(text=text)
+            plot.draw_idle()
+            if scan.running:
+                t.after(250, refresh)
+
+        def stop():
+            if self.scan is not None:
+                self.scan.stop()
+
+        #Moves the deflectors to the fitted beam centre, the scan itself leaves them where they were before it
+        def apply_centre():
+            #finished is only set once the scan has put the deflectors back
+            if self.scan is None or self.scan.finished is None:
+                return
+            centre = self.scan.centre()
+            if centre is not None:
+                self.write(self.scan.x_key, float(round(centre[0],1)))
+                self.write(self.scan.y_key, float(round(centre[1],1)))
+                print('deflectors set to beam centre')
+
+        Button(t, text='Start', command=start, width=8).place(relx=0.85, rely=0.05, anchor=CENTER)
+        Button(t, text='Stop', command=stop, width=8).place(relx=0.85, rely=0.11, anchor=CENTER)
+        Button(t, text='Apply Centre', command=apply_centre, width=10).place(relx=0.85, rely=0.17, anchor=CENTER)
+
+    #Opens the Beam Optimizer window, which tunes lens and deflector setpoints for the most Faraday cup current
+    def BeamOptimizerWindow(self):
+        t = Toplevel(self.root)
+        t.wm_title("Beam Optimizer")
+        t.geometry("700x600")
+        t.configure(background='grey90')
+        if platform.system() == 'Windows':
+            try:
+                t.iconbitmap("icons/CSA.ico")
+            except TclError:
+                print('Program started remotely by another program...')
+                print('No icons will be used')
+
+        selected = {}
+        for i, key in enumerate(OPTIMIZER_KEYS):
+            selected[key] = BooleanVar(t, value=True)
+            Checkbutton(t, text=key, variable=selected[key], font=font_12, bg='grey90').place(relx=0.02, rely=0.04+0.05*i, anchor=W)
+
+        cup = StringVar(t, value=FARADAY_CUP_KEYS[0])
+        Label(t, text='Readout', font=font_12, bg='grey90').place(relx=0.5, rely=0.04, anchor=W)
+        OptionMenu(t, cup, *FARADAY_CUP_KEYS).place(relx=0.65, rely=0.04, anchor=W)
+
+        #Entries for the optimizer settings: (label, default, rely)
+        fields = [('Settle (ms)', 100, 0.10), ('Max evaluations', 100, 0.15)]
+        entries = {}
+        for name, default, y in fields:
+            Label(t, text=name, font=font_12, bg='grey90').place(relx=0.5, rely=y, anchor=W)
+            entry = Entry(t, font=font_12, justify=RIGHT, width=6)
+            entry.insert(0, default)
+            entry.place(relx=0.72, rely=y, anchor=W)
+            entries[name] = entry
+
+        status = Label(t, text='', font=font_12, bg='grey90', justify=LEFT)
+        status.place(relx=0.02, rely=0.95, anchor=W)
+
+        fig = Figure(figsize=(6.5,2.5))
+        ax = fig.add_subplot(111)
+        plot = FigureCanvasTkAgg(fig, t)
+        plot.get_tk_widget().place(relx=0.5, rely=0.68, anchor=CENTER)
+
+        def start():
+            if self.optimizer is not None and self.optimizer.running:
+                return
+            keys = [key for key in OPTIMIZER_KEYS if selected[key].get()]
+            if not keys:
+                status.config(text='Please select at least one setpoint')
+                return
+            try:
+                settle = float(entries['Settle (ms)'].get())/1000
+                evaluations = int(entries['Max evaluations'].get())
+            except ValueError:
+                status.config(text='Please enter numbers for the settings')
+                return
+            #The optimizer gets its own connection so it can run alongside the GUI, closed when it ends
+            client = BaseDataClient(ADDR)
+            client.select()
+            current = client.get_values(keys)
+            missing = [key for key in keys if key not in current]
+            if missing:
+                status.config(text='Could not read ' + ', '.join(missing))
+                client.close()
+                return
+            start_values = [float(current[key][1]) for key in keys]
+            steps = [OPTIMIZER_KEYS[key][0] for key in keys]
+            bounds = [OPTIMIZER_KEYS[key][1:] for key in keys]
+            self.optimizer = BeamOptimizer(client, keys, start_values, steps, bounds, cup.get(), settle,
+                                           max_evaluations=evaluations, close=True)
+            self.optimizer.start()
+            refresh()
+
+        def refresh():
+            optimizer = self.optimizer
+            if optimizer is None or not t.winfo_exists():
+                return
+            history = list(optimizer.history)
+            ax.clear()
+            if history:
+                means = [mean for _, mean, _, _ in history]
+                errors = [sem if np.isfinite(sem) else 0 for _, _, sem, _ in history]
+                ax.errorbar(range(1, len(means)+1), means, yerr=errors, fmt='.')
+                ax.plot(range(1, len(means)+1), np.fmax.accumulate(np.nan_to_num(means, nan=-np.inf)), 'r-')
+            ax.set_xlabel('Evaluation')
+            ax.set_ylabel(optimizer.readout_key)
+            fig.tight_layout()
+            plot.draw_idle()
+            text = f'{optimizer.status}, {len(history)} evaluations'
+            if optimizer.best is not None:
+                text += f', best {round(optimizer.best[1],3)} at ' + ', '.join(f'{key} = {round(value,1)}' for key, value in zip(optimizer.keys, optimizer.best[0]))
+            status.config(text=text, wraplength=680)
+            if optimizer.running:
+                t.after(500, refresh)
+
+        #Stopping puts the setpoints back where they were before the search
+        def stop():
+            if self.optimizer is not None:
+                self.optimizer.stop()
+
+        Button(t, text='Start', command=start, width=8).place(relx=0.6, rely=0.25, anchor=CENTER)
+        Button(t, text='Stop', command=stop, width=8).place(relx=0.8, rely=0.25, anchor=CENTER)
+
     def click_button(self, button, type, variable, text=None):
         if type == 'power':
             self.update_button_var(variable, True)
             button.config(bg='#50E24B', command=lambda: self.declick_button(button, type, variable), activebackground='#50E24B')
 
         elif type == 'timer':
+            if not self.start_sequencer():
+                return
             button.config(bg='#50E24B', text='Timer ON', command=lambda: self.declick_button(button, type, variable), activebackground='#50E24B')
             self.dt_timer = True
 
@@ -450,6 +940,7 @@ class EBIT:
         elif type == 'timer':
             button.config(bg='#1AA5F6', text='Timer OFF', command=lambda: self.click_button(button, type, variable), activebackground='#1AA5F6')
             self.dt_timer = False
+            self.stop_sequencer()
 
         elif type == 'charge':
             self.update_button_var(variable, 1)
@@ -461,70 +952,278 @@ class EBIT:
 
     def update_button_var(self, variable, value):
         if variable == 'U_cat':
-            self.client.set_bool('Cathode_Voltage_Power', value)
+            self.write('Cathode_Voltage_Power', bool(value))
             print('Cathode voltage power button pressed')
         elif variable == 'I_heat':
-            self.client.set_bool('Cathode_Heater_Power', value)
+            self.write('Cathode_Heater_Power', bool(value))
             print('Cathode heater power button pressed')
         elif variable == 'dt_power':
-            self.client.set_bool('Drift_Tubes_Power', value)
+            self.write('Drift_Tubes_Power', bool(value))
             print('Drift tubes power button pressed')
         elif variable == 'anode_power':
-            self.client.set_bool('Anode_Voltage_Power', value)
+            self.write('Anode_Voltage_Power', bool(value))
             print('Anode power button pressed')
         elif variable == 'U_ext':
-            self.client.set_bool('Extraction_Voltage_Power', value)
+            self.write('Extraction_Voltage_Power', bool(value))
             print('Extraction voltage power button pressed')
         elif variable == 'U_EL1':
-            self.client.set_bool('Lens_1_Voltage_Power', value)
+            self.write('Lens_1_Voltage_Power', bool(value))
             print('Lens 1 voltage power button pressed')
         elif variable == 'U_EL1_charge':
-            self.client.set_int('Lens_1_Polarity', value)
+            self.write('Lens_1_Polarity', int(value))
             print('Lens 1 polarity button pressed')
         elif variable == 'U_EL2_charge':
-            self.client.set_int('Lens_2_Polarity', value)
+            self.write('Lens_2_Polarity', int(value))
             print('Lens 2 polarity button pressed')
         elif variable == 'U_EL2':
-            self.client.set_bool('Lens_2_Voltage_Power', value)
+            self.write('Lens_2_Voltage_Power', bool(value))
             print('Lens 2 voltage power button pressed')
         elif variable == 'U_X1':
-            self.client.set_bool('Deflectors_XY1_X_Power', value)
+            self.write('Deflectors_XY1_X_Power', bool(value))
             print('Deflector X1 voltage power button pressed')
         elif variable == 'U_Y1':
-            self.client.set_bool('Deflectors_XY1_Y_Power', value)
+            self.write('Deflectors_XY1_Y_Power', bool(value))
             print('Deflector Y1 voltage power button pressed')
         elif variable == 'U_X2':
-            self.client.set_bool('Deflectors_XY2_X_Power', value)
+            self.write('Deflectors_XY2_X_Power', bool(value))
             print('Deflector X2 voltage power button pressed')
         elif variable == 'U_Y2':
-            self.client.set_bool('Deflectors_XY2_Y_Power', value)
+            self.write('Deflectors_XY2_Y_Power', bool(value))
             print('Deflector Y2 voltage power button pressed')
 
-    def animate(self, i):
-        self.anode_ax.clear()
-        xdata = self.time_array
-        ydata = self.anode_array
-        self.anode_ax.plot(xdata,ydata)
-        #self.anode_ax.set_ylabel('Potential (V)')
-        self.anode_ax.set_ylim(0,12000)
-
-    def pressure_animate(self, i):
-        self.gas_ax.clear()
-        xdata = self.time_array
-        ydata1 = self.valve_pressure_array
-        ydata2 = self.source_pressure_array
-        #self.gas_ax.plot(xdata,ydata1)
-        self.gas_ax.plot(xdata,ydata2)
-        self.gas_ax.axhline(y=self.P_Valve, color='red')
-
+    #Updates a power button to show whether its supply is switched on
+    def show_power(self, button, variable, power):
+        if power:
+            button.config(bg='#50E24B', command=lambda: self.declick_button(button, 'power', variable), activebackground='#50E24B')
+        else:
+            button.config(bg='grey90', command=lambda: self.click_button(button, 'power', variable), activebackground='grey90')
 
+    #Updates a polarity button to show the polarity q of its lens
+    def show_charge(self, button, variable, label, q):
+        if q == -1:
+            button.config(bg='#50E24B', command=lambda: self.declick_button(button, 'charge', variable, label), activebackground='#50E24B')
+        else:
+            button.config(bg='#1AA5F6', command=lambda: self.click_button(button, 'charge', variable, label), activebackground='#1AA5F6')
+
+    #Copies the values read from the server into the instance variables and plot arrays
+    #Returns the attributes of the power and polarity buttons whose state changed
+    def update_model(self, serverValues):
+        changed = []
+        for attribute, button, variable, key in POWER_BUTTONS:
+            power = serverValues[key][1]
+            if getattr(self, attribute) != power:
+                setattr(self, attribute, power)
+                changed.append(attribute)
+        for attribute, button, variable, label, key in CHARGE_BUTTONS:
+            q = serverValues[key][1]
+            if getattr(self, attribute) != q:
+                setattr(self, attribute, q)
+                changed.append(attribute)
+
+        #Read Pressure values from server
+        self.P_source = serverValues['Pressure_HV_Source'][1]
+
+        #Read Cathode variable values from server
+        self.U_cat = serverValues['Cathode_Voltage_Read'][1]
+        self.I_cat = serverValues['Cathode_Emission'][1]
+        self.I_heat = serverValues['Cathode_Heater_Current_Read'][1]
+
+        #Read Anode variable values from server
+        self.U_an = serverValues['Anode_Voltage_Read'][1]
+        self.I_an = serverValues['Anode_Current'][1]
+
+        #Read Drfit Tube variable values from server
+        self.t_ion = serverValues['Drift_Tubes_T_Ion'][1]
+        self.t_ext = serverValues['Drift_Tubes_T_Ext'][1]
+        self.U_0 = serverValues['Drift_Tubes_U0_Read'][1]
+        self.U_A = serverValues['Drift_Tubes_UA_Read'][1]
+        self.U_B = serverValues['Drift_Tubes_UB'][1]
+        self.I_dt = serverValues['Drift_Tubes_Current'][1]
+
+        #Read Lens variable values from server
+        self.U_ext = serverValues['Extraction_Voltage_Read'][1]
+        self.U_EL1 = serverValues['Lens_1_Voltage_Read'][1]
+        self.U_EL2 = serverValues['Lens_2_Voltage_Read'][1]
+
+        #Read Deflector variable values from server
+        self.U_X1_A = serverValues['Deflectors_XY1_XA'][1]
+        self.U_X1_B = serverValues['Deflectors_XY1_XB'][1]
+        self.U_Y1_A = serverValues['Deflectors_XY1_YA'][1]
+        self.U_Y1_B = serverValues['Deflectors_XY1_YB'][1]
+        self.U_X2_A = serverValues['Deflectors_XY2_XA'][1]
+        self.U_X2_B = serverValues['Deflectors_XY2_XB'][1]
+        self.U_Y2_A = serverValues['Deflectors_XY2_YA'][1]
+        self.U_Y2_B = serverValues['Deflectors_XY2_YB'][1]
+
+        return changed
+
+    #Writes the instance variables to the display, `changed` lists the buttons that need updating
+    def update_display(self, changed):
+        for attribute, button, variable, key in POWER_BUTTONS:
+            if attribute in changed:
+                self.show_power(getattr(self, button), variable, getattr(self, attribute))
+        for attribute, button, variable, label, key in CHARGE_BUTTONS:
+            if attribute in changed:
+                self.show_charge(getattr(self, button), variable, getattr(self, label), getattr(self, attribute))
+
+        self.P_source_label4.config(text='%.2E' % Decimal(self.P_source))
+
+        self.U_cat_actual.config(text=f'{int(round(-1*self.U_cat,0))} V')
+        self.I_cat_label.config(text=f'{round(self.I_cat,1)} mA')
+        self.I_heat_actual.config(text=f'{round(self.I_heat,2)} A')
+
+        self.U_an_actual_label4.config(text = f'{int(round(self.U_an,0))}')
+        self.I_an_label4.config(text=f'{round(self.I_an,0)}')
+
+        self.U_0_actual.config(text=f'{int(round(self.U_0,0))} V')
+        self.U_A_actual.config(text="-{:.1f} V".format(self.U_A))
+        self.U_B_actual.config(text="-{:.1f} V".format(self.U_B))
+        self.I_dt_label.config(text=f'{int(round(self.I_dt,0))} μA')
+
+        if self.U_ext > 0:
+            self.U_ext_actual.config(text=f'-{int(round(self.U_ext,0))} V')
+        elif self.U_ext == 0:
+            self.U_ext_actual.config(text=f'{int(round(self.U_ext,0))} V')
+        self.U_EL1_actual.config(text=f'{int(round(self.U_EL1_q*self.U_EL1,0))} V')
+        self.U_EL2_actual.config(text=f'{int(round(self.U_EL2_q*self.U_EL2,0))} V')
+
+        self.U_X1_A_actual.config(text=f'{round(float(self.U_X1_A),1)} V')
+        self.U_X1_B_actual.config(text=f'{round(float(self.U_X1_B),1)} V')
+        self.U_Y1_A_actual.config(text=f'{round(float(self.U_Y1_A),1)} V')
+        self.U_Y1_B_actual.config(text=f'{round(float(self.U_Y1_B),1)} V')
+        self.U_X2_A_actual.config(text=f'{round(float(self.U_X2_A),1)} V')
+        self.U_X2_B_actual.config(text=f'{round(float(self.U_X2_B),1)} V')
+        self.U_Y2_A_actual.config(text=f'{round(float(self.U_Y2_A),1)} V')
+        self.U_Y2_B_actual.config(text=f'{round(float(self.U_Y2_B),1)} V')
+
+    #Called from the interlock watcher whenever an interlock changes state
+    def interlock_changed(self, key, old, new):
+        for attribute in INTERLOCK_KEYS:
+            if INTERLOCK_KEYS[attribute] == key:
+                setattr(self, attribute, new)
+                if old is not None:
+                    print(f'Interlock {attribute} changed from {old} to {new}')
+
+    #Starts watching the interlocks on a separate connection
+    def start_interlocks(self):
+        self.interlocks = InterlockWatcher(INTERLOCK_KEYS.values(), ADDR, INTERLOCK_PERIOD)
+        self.interlocks.add_callback(self.interlock_changed)
+        self.interlocks.start()
+
+    #Starts repeated breeding/extraction cycles using the U_A, t_ion and t_ext (ms) set on the server,
+    #returns False if they could not be read or are out of range
+    def start_sequencer(self):
+        self.stop_sequencer()
+        #The sequencer gets its own connection so its replies don't mix with other requests
+        client = BaseDataClient(ADDR)
+        client.select()
+        values = client.get_values(DT_TIMER_KEYS)
+        missing = [key for key in DT_TIMER_KEYS if key not in values]
+        if missing:
+            client.close()
+            messagebox.showwarning('Drift Tube Timer', f"Could not read {', '.join(missing)} from the server, the timer was not started.")
+            return False
+        U_A, t_ion, t_ext = (float(values[key][1]) for key in DT_TIMER_KEYS)
+        if not (10 <= U_A <= 2000 and 10 <= t_ion <= 10000 and 10 <= t_ext <= 10000):
+            client.close()
+            messagebox.showwarning('Drift Tube Timer', f'U_A {U_A} V, t_ion {t_ion} ms or t_ext {t_ext} ms on the server is out of range, '
+                                   'the timer was not started.')
+            return False
+        if self.U_A_extract is None:
+            self.U_A_extract = simpledialog.askfloat('Drift Tube Timer', 'U_A during extraction (V)', minvalue=0, maxvalue=2000, parent=self.root)
+            if self.U_A_extract is None:
+                client.close()
+                return False
+        self.U_A_set, self.t_ion_set, self.t_ext_set = U_A, t_ion, t_ext
+        self.sequencer_UA = U_A
+        phases = [
+            ('ion', t_ion/1000, {'Drift_Tubes_UA_Set': U_A}),
+            ('extract', t_ext/1000, {'Drift_Tubes_UA_Set': float(self.U_A_extract)}),
+        ]
+        self.sequencer = TrapSequencer(client, phases)
+        self.sequencer.start()
+        print(f'drift tube timer started: U_A {U_A} V for {t_ion} ms, {self.U_A_extract} V for {t_ext} ms')
+        return True
+
+    #Stops the timer and puts U_A back at the breeding potential
+    def stop_sequencer(self):
+        if self.sequencer is not None:
+            self.sequencer.stop()
+            if self.sequencer.client.set_values({'Drift_Tubes_UA_Set': self.sequencer_UA}) < 1:
+                messagebox.showwarning('Drift Tube Timer', f'Could not restore U_A to {self.sequencer_UA} V, please set it again.')
+            self.sequencer.client.close()
+            stats = self.sequencer.stats()
+            print(f"drift tube timer stopped after {stats['cycles']} cycles, jitter max {round(stats['jitter']['max'],2)} ms")
+            self.sequencer = None
+
+    #Writes a setpoint, ramping to it if the supply has a ramp rate
+    def write_setpoint(self, key, value):
+        if not USE_RAMPS or key not in RAMP_RATES:
+            return self.write(key, float(value))
+        if self.ramps is None:
+            #The ramp engine gets its own connection so it can run alongside the GUI
+            client = BaseDataClient(ADDR)
+            client.select()
+            self.ramps = RampEngine(client, powers=RAMP_POWERS)
+        try:
+            self.ramps.set_target(key, float(value), RAMP_RATES[key])
+        except ValueError as err:
+            print(f'Could not ramp: {err}')
+            messagebox.showwarning('Ramp', f'Could not ramp: {err}')
+            return False
+        self.ramps.start()
+        if not self.ramp_watching:
+            self.ramp_watching = True
+            self.root.after(250, self.watch_ramp)
+        return True
+
+    #Checks on the ramp from the main thread until it ends, an abort is shown to the operator
+    def watch_ramp(self):
+        if self.ramps.running:
+            self.root.after(250, self.watch_ramp)
+            return
+        self.ramp_watching = False
+        if self.ramps.status == 'aborted':
+            messagebox.showwarning('Ramp Aborted', f'{self.ramps.abort_reason}\n\nEvery supply was held at its last setpoint, '
+                                   'the rest of the ramp was not written.')
+
+    #Queues a write, only the latest value per key is sent and repeats of the last acknowledged value are skipped
+    def write(self, key, value):
+        if self.writer is None:
+            #The coalescer sends from its own thread, so it gets its own connection
+            client = BaseDataClient(ADDR)
+            client.select()
+            self.writer = WriteCoalescer(client)
+            #A restarted server may not hold what was last written, so nothing counts as already sent
+            client.on_resume(lambda client: self.writer.forget())
+        self.writer.submit(key, value)
+        return True
+
+    #Changes how many times per second the data reader refreshes the display
+    def set_read_rate(self, rate):
+        self.read_rate = rate
+        if self.read_schedule is not None:
+            self.read_schedule.set_period(1.0/rate)
+            self.read_stats.period = 1.0/rate
+
+    #Runs on the data reader thread once read_client has a new session after losing the server,
+    #everything is read again and the server clock measured again in case it was restarted
+    def reader_resumed(self, client):
+        self.clock.samples.clear()
+        self.clock.probe(client, CLOCK_PROBE_KEY)
+        values = client.get_all()
+        self.server_values.update(values)
+        self.variables.update(values)
 
     #This function is run in a separate thread and runs continuously
     #It reads values of all PLC variables and updates them in the display
+    #Each cycle is started on a fixed schedule of read_rate times per second, and the time
+    #spent fetching, decoding, updating variables and updating the display is recorded
     def data_reader(self):
-        t0 = time.time()
-        self.read_client = BaseDataClient(ADDR)
+        #Timestamps stay as epoch seconds, only the few that are shown get converted
+        self.read_client = BaseDataClient(ADDR, raw_time=True)
         self.read_client.select()
+        self.read_client.on_resume(self.reader_resumed)
         serverValues = {}
         
         #This queries the server for all values 20 times to populate all variables
@@ -537,201 +1236,76 @@ class EBIT:
                 serverValues[key] = readValues[key]
             i = i + 1
 
+        #Each key is only requested again once its refresh period has passed
+        self.read_scheduler = PollScheduler()
+        for period, priority, keys in POLL_GROUPS:
+            self.read_scheduler.add_group(keys, period, priority)
+        #Keys not shown on the operation tab are still refreshed slowly for the Variables tab
+        others = [key for key in serverValues if key not in self.read_scheduler.period]
+        self.read_scheduler.add_group(others, VARIABLES_PERIOD, -1)
+        self.read_scheduler.mark(serverValues)
+        self.variables.update(serverValues)
+        n_keys = len(self.read_scheduler.keys())
+
+        self.server_values = serverValues
+        self.clock.probe(self.read_client, CLOCK_PROBE_KEY)
+        last_sync = time.monotonic()
+
+        self.read_schedule = FixedRate(1.0/self.read_rate)
+        self.read_stats = CycleStats(self.read_schedule.period)
+        last_warning = 0
         while True:
-            #Returns all server values as a dictionary
-            readValues = self.read_client.get_all()
+            late = self.read_schedule.wait()
+            if time.monotonic() - last_sync > CLOCK_SYNC_PERIOD:
+                self.clock.probe(self.read_client, CLOCK_PROBE_KEY)
+                last_sync = time.monotonic()
+            start = time.perf_counter()
+
+            #Requests the keys that are due, or everything if most of them are
+            due = self.read_scheduler.due(limit=READ_BATCH)
+            if len(due) >= FULL_READ_FRACTION*n_keys:
+                readValues = self.read_client.get_all()
+            elif due:
+                readValues = self.read_client.get_values(due)
+            else:
+                readValues = {}
+                self.read_client.decode_time = 0
+            self.read_scheduler.mark(readValues)
+            fetched = time.perf_counter()
             for key in readValues:
-                serverValues[key] = readValues[key]            
-
-            #Read Pressure values from server
-            self.P_source = serverValues['Pressure_HV_Source'][1]
-            self.P_source_label4.config(text='%.2E' % Decimal(self.P_source))
-
-            #Read Cathode variable values from server
-            U_cat_power = serverValues['Cathode_Voltage_Power'][1]
-            if self.U_cat_power != U_cat_power:
-                self.U_cat_power = U_cat_power
-                if self.U_cat_power:
-                    self.U_cat_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_cat_button, 'power', 'U_cat'), activebackground='#50E24B')
-                else:
-                    self.U_cat_button.config(bg='grey90', command=lambda: self.click_button(self.U_cat_button, 'power', 'U_cat'), activebackground='grey90')
-                
-            self.U_cat = serverValues['Cathode_Voltage_Read'][1]
-            self.U_cat_actual.config(text=f'{int(round(-1*self.U_cat,0))} V')
-
-            I_heat_power = serverValues['Cathode_Heater_Power'][1]
-            if self.I_heat_power != I_heat_power:
-                self.I_heat_power = I_heat_power
-                if self.I_heat_power:
-                    self.I_heat_button.config(bg='#50E24B', command=lambda: self.declick_button(self.I_heat_button, 'power', 'I_heat'), activebackground='#50E24B')
-                else:
-                    self.I_heat_button.config(bg='grey90', command=lambda: self.click_button(self.I_heat_button, 'power', 'I_heat'), activebackground='grey90')
-                
-            self.I_cat = serverValues['Cathode_Emission'][1]
-            self.I_cat_label.config(text=f'{round(self.I_cat,1)} mA')
-
-            self.I_heat = serverValues['Cathode_Heater_Current_Read'][1]
-            self.I_heat_actual.config(text=f'{round(self.I_heat,2)} A')
-
-
-            #Read Anode variable values from server
-            anode_power = serverValues['Anode_Voltage_Power'][1]
-            if self.anode_power != anode_power:
-                self.anode_power = anode_power
-                if self.anode_power:
-                    self.anode_button.config(bg='#50E24B', command=lambda: self.declick_button(self.anode_button, 'power', 'anode_power'), activebackground='#50E24B')
-                else:
-                    self.anode_button.config(bg='grey90', command=lambda: self.click_button(self.anode_button, 'power', 'anode_power'), activebackground='grey90')
-                
-            self.U_an = serverValues['Anode_Voltage_Read'][1]
-            self.U_an_actual_label4.config(text = f'{int(round(self.U_an,0))}')
-
-            self.I_an = serverValues['Anode_Current'][1]
-            self.I_an_label4.config(text=f'{round(self.I_an,0)}')
-
-            if len(self.anode_array) > 30:
-                self.anode_array.pop(0)
-                self.time_array.pop(0)
-                self.source_pressure_array.pop(0)
-            self.anode_array.append(self.U_an)
-            self.time_array.append(time.time()-t0)
-            self.source_pressure_array.append(self.P_source)
-
-
-            #Read Drfit Tube variable values from server
-            dt_power = serverValues['Drift_Tubes_Power'][1]
-            if self.dt_power != dt_power:
-                self.dt_power = dt_power
-                if self.dt_power:
-                    self.dt_button.config(bg='#50E24B', command=lambda: self.declick_button(self.dt_button, 'power', 'dt_power'), activebackground='#50E24B')
-                else:
-                    self.dt_button.config(bg='grey90', command=lambda: self.click_button(self.dt_button, 'power', 'dt_power'), activebackground='grey90')
-                
-            self.t_ion = serverValues['Drift_Tubes_T_Ion'][1]
-            self.t_ext = serverValues['Drift_Tubes_T_Ext'][1]
-
-            self.U_0 = serverValues['Drift_Tubes_U0_Read'][1]
-            self.U_0_actual.config(text=f'{int(round(self.U_0,0))} V')
-
-            self.U_A = serverValues['Drift_Tubes_UA_Read'][1]
-            self.U_A_actual.config(text="-{:.1f} V".format(self.U_A))
-
-            self.U_B = serverValues['Drift_Tubes_UB'][1]
-            self.U_B_actual.config(text="-{:.1f} V".format(self.U_B))
-
-            self.I_dt = serverValues['Drift_Tubes_Current'][1]
-            self.I_dt_label.config(text=f'{int(round(self.I_dt,0))} μA')
-            
-
-            #Read Lens variable values from server
-            U_ext_power = serverValues['Extraction_Voltage_Power'][1]
-            if self.U_ext_power != U_ext_power:
-                self.U_ext_power = U_ext_power
-                if self.U_ext_power:
-                    self.U_ext_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_ext_button, 'power', 'U_ext'), activebackground='#50E24B')
-                else:
-                    self.U_ext_button.config(bg='grey90', command=lambda: self.click_button(self.U_ext_button, 'power', 'U_ext'), activebackground='grey90')
-                
-            self.U_ext = serverValues['Extraction_Voltage_Read'][1]
-            if self.U_ext > 0:
-                self.U_ext_actual.config(text=f'-{int(round(self.U_ext,0))} V')
-            elif self.U_ext == 0:
-                self.U_ext_actual.config(text=f'{int(round(self.U_ext,0))} V')
-
-            U_EL1_power = serverValues['Lens_1_Voltage_Power'][1]
-            if self.U_EL1_power != U_EL1_power:
-                self.U_EL1_power = U_EL1_power
-                if self.U_EL1_power:
-                    self.U_EL1_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_EL1_button, 'power', 'U_EL1'), activebackground='#50E24B')
-                else:
-                    self.U_EL1_button.config(bg='grey90', command=lambda: self.click_button(self.U_EL1_button, 'power', 'U_EL1'), activebackground='grey90')
-            
-            U_EL1_q = serverValues['Lens_1_Polarity'][1]
-            if self.U_EL1_q != U_EL1_q:
-                self.U_EL1_q = U_EL1_q
-                if self.U_EL1_q == -1:
-                    self.U_EL1_charge.config(bg='#50E24B', command=lambda: self.declick_button(self.U_EL1_charge, 'charge', 'U_EL1_charge', self.U_EL1_label3), activebackground='#50E24B')
-                else:
-                    self.U_EL1_charge.config(bg='#1AA5F6', command=lambda: self.click_button(self.U_EL1_charge, 'charge', 'U_EL1_charge', self.U_EL1_label3), activebackground='#1AA5F6')
-
-            self.U_EL1 = serverValues['Lens_1_Voltage_Read'][1]
-            self.U_EL1_actual.config(text=f'{int(round(self.U_EL1_q*self.U_EL1,0))} V')
-
-            U_EL2_power = serverValues['Lens_2_Voltage_Power'][1]
-            if self.U_EL2_power != U_EL2_power:
-                self.U_EL2_power = U_EL2_power
-                if self.U_EL2_power:
-                    self.U_EL2_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_EL2_button, 'power', 'U_EL2'), activebackground='#50E24B')
-                else:
-                    self.U_EL2_button.config(bg='grey90', command=lambda: self.click_button(self.U_EL2_button, 'power', 'U_EL2'), activebackground='grey90')
-
-            U_EL2_q = serverValues['Lens_2_Polarity'][1]
-            if self.U_EL2_q != U_EL2_q:
-                self.U_EL2_q = U_EL2_q
-                if self.U_EL2_q == -1:
-                    self.U_EL2_charge.config(bg='#50E24B', command=lambda: self.declick_button(self.U_EL2_charge, 'charge', 'U_EL2_charge', self.U_EL2_label3), activebackground='#50E24B')
-                else:
-                    self.U_EL2_charge.config(bg='#1AA5F6', command=lambda: self.click_button(self.U_EL2_charge, 'charge', 'U_EL2_charge', self.U_EL2_label3), activebackground='#1AA5F6')
-            
-            self.U_EL2 = serverValues['Lens_2_Voltage_Read'][1]
-            self.U_EL2_actual.config(text=f'{int(round(self.U_EL2_q*self.U_EL2,0))} V')
-
-
-            #Read Deflector variable values from server
-            U_X1_power = serverValues['Deflectors_XY1_X_Power'][1]
-            if self.U_X1_power != U_X1_power:
-                self.U_X1_power = U_X1_power
-                if self.U_X1_power:
-                    self.U_X1_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_X1_button, 'power', 'U_X1'), activebackground='#50E24B')
-                else:
-                    self.U_X1_button.config(bg='grey90', command=lambda: self.click_button(self.U_X1_button, 'power', 'U_X1'), activebackground='grey90')
-
-            self.U_X1_A = serverValues['Deflectors_XY1_XA'][1]
-            self.U_X1_A_actual.config(text=f'{round(float(self.U_X1_A),1)} V')
-            self.U_X1_B = serverValues['Deflectors_XY1_XB'][1]
-            self.U_X1_B_actual.config(text=f'{round(float(self.U_X1_B),1)} V')
-
-            U_Y1_power = serverValues['Deflectors_XY1_Y_Power'][1]
-            if self.U_Y1_power != U_Y1_power:
-                self.U_Y1_power = U_Y1_power
-                if self.U_Y1_power:
-                    self.U_Y1_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_Y1_button, 'power', 'U_Y1'), activebackground='#50E24B')
-                else:
-                    self.U_Y1_button.config(bg='grey90', command=lambda: self.click_button(self.U_Y1_button, 'power', 'U_Y1'), activebackground='grey90')
-
-            self.U_Y1_A = serverValues['Deflectors_XY1_YA'][1]
-            self.U_Y1_A_actual.config(text=f'{round(float(self.U_Y1_A),1)} V')
-            self.U_Y1_B = serverValues['Deflectors_XY1_YB'][1]
-            self.U_Y1_B_actual.config(text=f'{round(float(self.U_Y1_B),1)} V')
-
-            U_X2_power = serverValues['Deflectors_XY2_X_Power'][1]
-            if self.U_X2_power != U_X2_power:
-                self.U_X2_power = U_X2_power
-                if self.U_X2_power:
-                    self.U_X2_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_X2_button, 'power', 'U_X2'), activebackground='#50E24B')
-                else:
-                    self.U_X2_button.config(bg='grey90', command=lambda: self.click_button(self.U_X2_button, 'power', 'U_X2'), activebackground='grey90')
-
-            self.U_X2_A = serverValues['Deflectors_XY2_XA'][1]
-            self.U_X2_A_actual.config(text=f'{round(float(self.U_X2_A),1)} V')
-            self.U_X2_B = serverValues['Deflectors_XY2_XB'][1]
-            self.U_X2_B_actual.config(text=f'{round(float(self.U_X2_B),1)} V')
-
-            U_Y2_power = serverValues['Deflectors_XY2_Y_Power'][1]
-            if self.U_Y2_power != U_Y2_power:
-                self.U_Y2_power = U_Y2_power
-                if self.U_Y2_power:
-                    self.U_Y2_button.config(bg='#50E24B', command=lambda: self.declick_button(self.U_Y2_button, 'power', 'U_Y2'), activebackground='#50E24B')
+                serverValues[key] = readValues[key]
+            self.variables.update(readValues)
+            #Plot against when the server took each reading, moved onto our clock
+            now = time.time()
+            for key, label, options in STRIP_CHART:
+                if key in readValues:
+                    stamp, value = readValues[key]
+                    self.chart.add(key, self.clock.to_client(stamp) if self.clock.samples else now, value)
+
+            changed = self.update_model(serverValues)
+            updated = time.perf_counter()
+
+            #Only the values read this cycle are checked, so rates of change use fresh readings.
+            #As columns the alarm engine takes them without looking up every watched key
+            snapshot = ColumnarSnapshot.from_values(readValues, self.read_client.key_names, self.read_client.key_index)
+            for event in self.alarms.evaluate(snapshot):
+                if event.action == RAISE:
+                    print(f'Alarm: {event.key} {event.kind} limit {event.limit} exceeded ({event.value})')
                 else:
-                    self.U_Y2_button.config(bg='grey90', command=lambda: self.click_button(self.U_Y2_button, 'power', 'U_Y2'), activebackground='grey90')
-
-            self.U_Y2_A = serverValues['Deflectors_XY2_YA'][1]
-            self.U_Y2_A_actual.config(text=f'{round(float(self.U_Y2_A),1)} V')
-            self.U_Y2_B = serverValues['Deflectors_XY2_YB'][1]
-            self.U_Y2_B_actual.config(text=f'{round(float(self.U_Y2_B),1)} V')
-
-
-            time.sleep(0.1)
+                    print(f'Alarm cleared: {event.key} {event.kind} ({event.value})')
+            checked = time.perf_counter()
+
+            self.update_display(changed)
+            end = time.perf_counter()
+
+            decode = self.read_client.decode_time
+            phases = {'fetch': fetched - start - decode, 'decode': decode, 'model': updated - fetched, 'alarms': checked - updated, 'gui': end - checked}
+            if self.read_stats.add(late, end - start, phases):
+                #Only warn every 10 s so a slow link does not flood the console
+                if end - last_warning > 10:
+                    last_warning = end
+                    print(f'Data reader overran its {round(1000*self.read_schedule.period)} ms period: '
+                          + ', '.join(f'{name} {round(1000*phases[name],1)} ms' for name in phases))
     
     def update_U_cat(self):
         self.U_cat_set = float(self.U_cat_entry.get())
@@ -740,7 +1314,7 @@ class EBIT:
         
         #Write Cathode variable values to server
         if self.U_cat_set >= 0 and self.U_cat_set <= 6500:
-            self.client.set_float('Cathode_Voltage_Set', self.U_cat_set)
+            self.write_setpoint('Cathode_Voltage_Set', self.U_cat_set)
             print('cathode potential set')
         elif self.U_cat_set < 0:
             self.U_cat_set = self.U_cat
@@ -764,7 +1338,7 @@ class EBIT:
 
         #Write Anode variable values to server
         if self.U_an_set >= 0 and self.U_an_set <= 20000:
-            self.client.set_float('Anode_Voltage_Set', self.U_an_set)
+            self.write_setpoint('Anode_Voltage_Set', self.U_an_set)
             print('anode potential set')
         elif self.U_an_set < 0:
             self.U_an_set = self.U_an
@@ -787,7 +1361,7 @@ class EBIT:
         self.I_heat_entry.insert(0, "{:.2f}".format(self.I_heat_set))
         
         if self.I_heat_set >= 0 and self.I_heat_set <=10:
-            self.client.set_float('Cathode_Heater_Current_Set', self.I_heat_set)
+            self.write('Cathode_Heater_Current_Set', float(self.I_heat_set))
             print('cathode heater current set')
         elif self.I_heat_set < 0:
             self.I_heat_set = self.I_heat
@@ -809,7 +1383,7 @@ class EBIT:
         self.t_ion_entry.delete(0, END)
         self.t_ion_entry.insert(0, int(round(self.t_ion_set,0)))
         if self.t_ion_set >= 10 and self.t_ion_set <= 10000:
-            self.client.set_float('Drift_Tubes_T_Ion', self.t_ion_set)
+            self.write('Drift_Tubes_T_Ion', float(self.t_ion_set))
             print('ion bake time set')
 
     def update_t_ext(self):
@@ -817,7 +1391,7 @@ class EBIT:
         self.t_ext_entry.delete(0, END)
         self.t_ext_entry.insert(0, int(round(self.t_ext_set,0)))
         if self.t_ext_set >= 10 and self.t_ext_set <= 10000:
-            self.client.set_float('Drift_Tubes_T_Ext', self.t_ext_set)
+            self.write('Drift_Tubes_T_Ext', float(self.t_ext_set))
             print('ion extract time')
 
     def update_U_0(self):
@@ -825,7 +1399,7 @@ class EBIT:
         self.U_0_entry.delete(0, END)
         self.U_0_entry.insert(0, int(round(self.U_0_set,0)))
         if self.U_0_set >= 0 and self.U_0_set <= 20000:
-            self.client.set_float('Drift_Tubes_U0_Set', self.U_0_set)
+            self.write_setpoint('Drift_Tubes_U0_Set', self.U_0_set)
             print('drift tube potential set')
 
     def update_U_A(self):
@@ -833,7 +1407,7 @@ class EBIT:
         self.U_A_entry.delete(0, END)
         self.U_A_entry.insert(0, round(self.U_A_set,1))
         if self.U_A_set >= 10 and self.U_A_set <= 2000:
-            self.client.set_float('Drift_Tubes_UA_Set', self.U_A_set)
+            self.write('Drift_Tubes_UA_Set', float(self.U_A_set))
             print('drift tube trapping potential')
     
     def update_U_ext(self):
@@ -843,7 +1417,7 @@ class EBIT:
 
         #Write Lens variable values to server
         if self.U_ext_set >= 14 and self.U_ext_set <=10000:
-            self.client.set_float('Extraction_Voltage_Set', self.U_ext_set)
+            self.write_setpoint('Extraction_Voltage_Set', self.U_ext_set)
             print('extraction lens potential set')
         elif self.U_ext_set < 14:
             self.U_ext_set = self.U_ext
@@ -865,7 +1439,7 @@ class EBIT:
         self.U_EL1_entry.delete(0, END)
         self.U_EL1_entry.insert(0, int(round(self.U_EL1_set,0)))
         if self.U_EL1_set >= 14 and self.U_EL1_set <= 10000:
-            self.client.set_float('Lens_1_Voltage_Set', self.U_EL1_set)
+            self.write_setpoint('Lens_1_Voltage_Set', self.U_EL1_set)
             print('einzel lens 1 potential set')
         elif self.U_EL1_set < 14:
             self.U_EL1_set = self.U_EL1
@@ -887,7 +1461,7 @@ class EBIT:
         self.U_EL2_entry.delete(0, END)
         self.U_EL2_entry.insert(0, int(round(self.U_EL2_set,0)))
         if self.U_EL2_set >= 14 and self.U_EL2_set <= 10000:
-            self.client.set_float('Lens_2_Voltage_Set', self.U_EL2_set)
+            self.write_setpoint('Lens_2_Voltage_Set', self.U_EL2_set)
             print('einzel lens 2 potential set')
         elif self.U_EL2_set < 14:
             self.U_EL2_set = self.U_EL2
@@ -909,7 +1483,7 @@ class EBIT:
         self.U_X1_entry.delete(0, END)
         self.U_X1_entry.insert(0, round(self.U_X1_set,1))
         if abs(self.U_X1_set) <= 1000:
-            self.client.set_float('Deflectors_XY1_X_Set', self.U_X1_set)
+            self.write('Deflectors_XY1_X_Set', float(self.U_X1_set))
             print('X1 deflector potential set')
 
     def update_U_Y1(self):
@@ -917,7 +1491,7 @@ class EBIT:
         self.U_Y1_entry.delete(0, END)
         self.U_Y1_entry.insert(0, round(self.U_Y1_set,1))
         if abs(self.U_Y1_set) <= 1000:
-            self.client.set_float('Deflectors_XY1_Y_Set', self.U_Y1_set)
+            self.write('Deflectors_XY1_Y_Set', float(self.U_Y1_set))
             print('Y1 deflector potential set')
 
     def update_U_X2(self):
@@ -925,7 +1499,7 @@ class EBIT:
         self.U_X2_entry.delete(0, END)
         self.U_X2_entry.insert(0, round(self.U_X2_set,1))
         if abs(self.U_X2_set) <= 1000:
-            self.client.set_float('Deflectors_XY2_X_Set', self.U_X2_set)
+            self.write('Deflectors_XY2_X_Set', float(self.U_X2_set))
             print('X2 deflector potential set')
 
     def update_U_Y2(self):
@@ -933,14 +1507,14 @@ class EBIT:
         self.U_Y2_entry.delete(0, END)
         self.U_Y2_entry.insert(0, round(self.U_Y2_set,1))
         if abs(self.U_Y2_set) <= 1000:
-            self.client.set_float('Deflectors_XY2_Y_Set', self.U_Y2_set)
+            self.write('Deflectors_XY2_Y_Set', float(self.U_Y2_set))
             print('Y2 deflector potential set')
 
     def update_P_Valve(self):
         self.P_Valve = float(self.P_valve_entry.get())
         self.P_valve_entry.delete(0, END)
         self.P_valve_entry.insert(0,'%.2E' % Decimal(self.P_Valve))
-        self.client.set_float('Pressure_Gas_Valve_Set', self.P_Valve)
+        self.write('Pressure_Gas_Valve_Set', float(self.P_Valve))
         print('Gas valve pressure set')
 
 
@@ -954,10 +1528,25 @@ class EBIT:
         #filemenu.add_command(label="Save", command=lambda: CSA.saveGraph(), accelerator="Ctrl+S")
         #filemenu.add_command(label='Settings', command=lambda: self.Settings())
         #filemenu.add_command(label='Calibrate', command=lambda: self.calibration())
+        self.filemenu.add_command(label='Save State', command=lambda: self.save_state())
+        self.filemenu.add_command(label='Restore State', command=lambda: self.restore_state())
+        self.filemenu.add_command(label='Export Recording', command=lambda: self.ExportRecording())
         self.filemenu.add_separator()
         self.filemenu.add_command(label='New Window', command=lambda: startProgram(Toplevel(self.root)))
         self.filemenu.add_command(label='Exit', command=lambda: self.quitProgram())
 
+        #Creates Tools menu
+        self.toolsmenu = Menu(menu, tearoff=0)
+        menu.add_cascade(label='Tools', menu=self.toolsmenu)
+        self.toolsmenu.add_command(label='Deflector Scan', command=lambda: self.DeflectorScan())
+        self.toolsmenu.add_command(label='Beam Optimizer', command=lambda: self.BeamOptimizerWindow())
+        self.ratemenu = Menu(self.toolsmenu, tearoff=0)
+        self.toolsmenu.add_cascade(label='Read Rate', menu=self.ratemenu)
+        self.read_rate_var = IntVar(self.root, value=self.read_rate)
+        for rate in READ_RATES:
+            self.ratemenu.add_radiobutton(label=f'{rate} Hz', variable=self.read_rate_var, value=rate,
+                                          command=lambda rate=rate: self.set_read_rate(rate))
+
         #Creates Help menu
         self.helpmenu = Menu(menu, tearoff=0)
         menu.add_cascade(label='Help', menu=self.helpmenu)
@@ -978,6 +1567,11 @@ class EBIT:
         self.tabControl.add(self.operation_tab, text='Operation')
         self.tabControl.add(self.source_tab, text='Source')
         self.tabControl.add(self.slit_tab, text='Slit')
+        self.variables_tab = ttk.Frame(self.tabControl)
+        self.tabControl.add(self.variables_tab, text='Variables')
+        if SHOW_DIAGNOSTICS:
+            self.diagnostics_tab = ttk.Frame(self.tabControl)
+            self.tabControl.add(self.diagnostics_tab, text='Diagnostics')
         self.tabControl.pack(expand=1, fill='both')
         #self.tabControl.place(relx=0.5, rely=0, anchor=N)
 
@@ -1106,18 +1700,6 @@ class EBIT:
         I_an_label5.place(relx=0.43, rely=0.85, anchor=CENTER)
 
 
-        self.anode_fig = Figure(figsize=(2,1.9))
-        self.anode_ax = self.anode_fig.add_subplot(111)
-        freqPlot = FigureCanvasTkAgg(self.anode_fig, self.anode)
-        freqPlot.get_tk_widget().place(relx=0.99, rely=0.98, anchor=SE)
-        self.anode_fig.patch.set_facecolor("#E5E5E5")
-        self.anode_ax.axes.set_facecolor(color='#E5E5E5')
-        self.anode_ax.axes.xaxis.set_visible(False)
-        self.anode_ax.set_ylim(0,10000)
-        self.anode_fig.tight_layout()
-        self.anode_ani = animation.FuncAnimation(self.anode_fig, self.animate, interval = 500)
-
-
     #Creates the Drift Tube Controls in a frame that is placed at the coordinates (x, y)
     def drift_tube_controls(self, x, y):
         self.dt = Frame(self.operation_tab, width = 400, height = 200, background = 'grey90', highlightbackground = 'black', highlightcolor = 'black', highlightthickness = 1)
@@ -1504,17 +2086,96 @@ class EBIT:
         P_source_label5 = Label(self.gas, text='mbar', font=font_14, bg = 'grey90', fg = 'black')
         P_source_label5.place(relx=0.49, rely=0.67, anchor=CENTER)
 
-
-        self.gas_fig = Figure(figsize=(1.7,1.9))
-        self.gas_ax = self.gas_fig.add_subplot(111)
-        pressurePlot = FigureCanvasTkAgg(self.gas_fig, self.gas)
-        pressurePlot.get_tk_widget().place(relx=0.99, rely=0.98, anchor=SE)
-        self.gas_fig.patch.set_facecolor("#E5E5E5")
-        self.gas_ax.axes.set_facecolor(color='#E5E5E5')
-        self.gas_ax.axes.xaxis.set_visible(False)
-        #self.gas_ax.set_ylim(0,10000)
-        self.gas_fig.tight_layout()
-        self.gas_ani = animation.FuncAnimation(self.gas_fig, self.pressure_animate, interval = 500)
+    #Creates the strip chart of the values in STRIP_CHART, centred at the coordinates (x, y)
+    def strip_chart(self, x, y):
+        channels = []
+        for key, label, options in STRIP_CHART:
+            options = dict(options)
+            #The gas valve setpoint is shown against the source pressure
+            if key == 'Pressure_HV_Source':
+                options['reference'] = lambda: self.P_Valve
+            channels.append((key, label, options))
+        self.chart = StripChart(self.operation_tab, channels, span=STRIP_CHART_SPAN)
+        self.chart.widget.place(relx=x, rely=y, anchor=CENTER)
+
+    #Creates the Diagnostics panel showing the statistics of the server connections
+    def diagnostics_panel(self):
+        self.diagnostics_text = Text(self.diagnostics_tab, font=('Courier', 12), bg='white', wrap=NONE)
+        self.diagnostics_text.pack(expand=1, fill='both')
+        self.update_diagnostics()
+
+    #Formats the statistics of a client as lines of text
+    def format_stats(self, name, client):
+        stats = client.stats()
+        lines = [f"{name} ({client.addr[0]}:{client.addr[1]}), receive buffer {stats['rcvbuf']//1024} kB"]
+        lines.append(f"{'operation':<12}{'calls':>8}{'failed':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for op in client.diagnostics.OPS:
+            s = stats[op]
+            lines.append(f"{op:<12}{s['calls']:>8}{s['failed']:>8}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}")
+        counters = stats['counters']
+        lines.append('  '.join(f'{key}: {counters[key]}' for key in counters))
+        return lines
+
+    #Formats the cycle timing of the data reader as lines of text
+    def format_read_stats(self):
+        stats = self.read_stats.summary()
+        lines = [f"data reader: {self.read_rate} Hz, {stats['cycles']} cycles, {stats['overruns']} overruns, {self.read_schedule.skipped} skipped"]
+        lines.append(f"{'phase':<12}{'mean ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        timings = [('jitter', stats['jitter']), ('cycle', stats['duration'])] + list(stats['phases'].items())
+        for name, s in timings:
+            lines.append(f"{name:<12}{s['mean']:>10.2f}{s['p99']:>10.2f}{s['max']:>10.2f}")
+        return lines
+
+    #Refreshes the Diagnostics panel once a second
+    def update_diagnostics(self):
+        lines = []
+        for name in ('client', 'read_client'):
+            client = getattr(self, name, None)
+            if client is not None:
+                lines += self.format_stats(name, client) + ['']
+        if self.read_stats is not None:
+            lines += self.format_read_stats() + ['']
+        if self.writer is not None:
+            stats = self.writer.stats()
+            lines.append(f"writes: {stats['submitted']} submitted, {stats['sent']} sent, {stats['saved']} saved "
+                         f"({stats['superseded']} superseded, {stats['unchanged']} unchanged), {stats['failed']} failed")
+            lines.append('')
+        if self.ramps is not None:
+            lines.append(f'ramps: {self.ramps.status}' + (f' ({self.ramps.abort_reason})' if self.ramps.abort_reason else ''))
+            lines.append('')
+        if self.sequencer is not None:
+            stats = self.sequencer.stats()
+            jitter = stats['jitter']
+            lines.append(f"drift tube timer: {stats['cycles']} cycles, {stats['missed_acks']} missed acks, "
+                         f"send jitter mean {jitter['mean']:.2f} p99 {jitter['p99']:.2f} max {jitter['max']:.2f} ms")
+            lines.append('')
+        if self.clock.samples:
+            clock = self.clock.summary()
+            lines.append(f"server clock: offset {clock['offset_ms']:+.1f} ms, drift {clock['drift_ppm']:+.1f} ppm, "
+                         f"one-way delay {clock['one_way_ms']:.2f} ms ({clock['mode']} timestamps, {clock['samples']} samples, {clock['rejected']} rejected)")
+            now = time.time()
+            ages = []
+            for key in POLL_GROUPS[0][2]:
+                if key in self.server_values:
+                    ages.append((self.clock.age(self.server_values[key][0], now), key))
+            if ages:
+                age, key = max(ages)
+                lines.append(f'fast values: mean age {1000*sum(a for a, k in ages)/len(ages):.0f} ms, oldest {key} {1000*age:.0f} ms')
+            lines.append('')
+        active = self.alarms.active()
+        lines.append('active alarms: ' + (', '.join(f'{key} {kind}' for key, kind in active) if active else 'none'))
+        lines.append('')
+        if self.interlocks is not None:
+            stats = self.interlocks.stats()
+            bound = stats['detection_bound']
+            lines.append(f"interlocks: {stats['polls']} polls, {stats['edges']} changes, worst-case detection {stats['worst_case_ms']:.1f} ms "
+                         f"(mean {bound['mean']:.1f}, p99 {bound['p99']:.1f} ms)")
+            stale = self.interlocks.stale()
+            if stale:
+                lines.append('not read recently: ' + ', '.join(stale))
+        self.diagnostics_text.delete('1.0', END)
+        self.diagnostics_text.insert(END, '\n'.join(lines))
+        self.root.after(1000, self.update_diagnostics)
 
     def makeGui(self, root=None):
         if root == None:
@@ -1554,7 +2215,12 @@ class EBIT:
         self.lens_controls(0.35, 0.35)
         self.deflector_controls(0.12, 0.58)
         self.gas_valve(0.35, 0.58)
+        self.strip_chart(0.72, 0.35)
+        self.variables = VariableTable(self.variables_tab)
+        if SHOW_DIAGNOSTICS:
+            self.diagnostics_panel()
 
+        self.start_interlocks()
         multiThreading(self.data_reader)
         self.root.mainloop()
 
@@ -0,0 +1,144 @@
+import time
+import numpy as np
+
+# Kinds of alarm a key can raise
+LOW = 'low'
+HIGH = 'high'
+RATE = 'rate'
+
+# Event actions
+RAISE = 'raise'
+CLEAR = 'clear'
+
+class AlarmEvent:
+    '''A limit being crossed (RAISE) or recovered from (CLEAR)'''
+    def __init__(self, key, kind, action, value, limit, time) -> None:
+        self.key = key
+        self.kind = kind
+        self.action = action
+        self.value = value
+        self.limit = limit
+        self.time = time
+
+    def __repr__(self):
+        return f'AlarmEvent({self.key}, {self.kind}, {self.action}, {self.value}, limit={self.limit})'
+
+class AlarmEngine:
+    '''Checks snapshots against per-key limits, all keys at once with NumPy.
+    Each key can have a low and high limit and a maximum rate of change (units per second).
+    An alarm raises when its limit is crossed and only clears once the value is back
+    inside by more than the deadband, so noise on the limit doesn't make it flicker.'''
+    def __init__(self) -> None:
+        self.keys = []
+        self.index = {}
+        self.low = np.empty(0)
+        self.high = np.empty(0)
+        self.deadband = np.empty(0)
+        self.rate = np.empty(0)
+        self.rate_deadband = np.empty(0)
+        self.low_active = np.empty(0, dtype=bool)
+        self.high_active = np.empty(0, dtype=bool)
+        self.rate_active = np.empty(0, dtype=bool)
+        self.last_value = np.empty(0)
+        self.last_time = np.empty(0)
+        # Indices of the keys in the names of the last ColumnarSnapshot, and how many names it had
+        self.positions = None
+        self.names = None
+        self.names_len = 0
+
+    def _add_key(self, key):
+        self.index[key] = len(self.keys)
+        self.keys.append(key)
+        self.low = np.append(self.low, np.nan)
+        self.high = np.append(self.high, np.nan)
+        self.deadband = np.append(self.deadband, 0.0)
+        self.rate = np.append(self.rate, np.nan)
+        self.rate_deadband = np.append(self.rate_deadband, 0.0)
+        self.low_active = np.append(self.low_active, False)
+        self.high_active = np.append(self.high_active, False)
+        self.rate_active = np.append(self.rate_active, False)
+        self.last_value = np.append(self.last_value, np.nan)
+        self.last_time = np.append(self.last_time, np.nan)
+        self.positions = None
+
+    def set_limits(self, key, low=None, high=None, deadband=0.0, rate=None, rate_deadband=0.0):
+        '''Sets the limits of `key`, None leaves that check disabled'''
+        if key not in self.index:
+            self._add_key(key)
+        i = self.index[key]
+        self.low[i] = np.nan if low is None else low
+        self.high[i] = np.nan if high is None else high
+        self.deadband[i] = deadband
+        self.rate[i] = np.nan if rate is None else rate
+        self.rate_deadband[i] = rate_deadband
+
+    def vector(self, values):
+        '''Converts a get_all style map of key -> (datetime, value) into an array in key order, NaN where missing'''
+        def number(key):
+            entry = values.get(key)
+            if entry is None:
+                return np.nan
+            try:
+                return float(entry[1])
+            except (TypeError, ValueError):
+                return np.nan
+        return np.fromiter((number(key) for key in self.keys), dtype=float, count=len(self.keys))
+
+    def snapshot_vector(self, snapshot):
+        '''Converts a ColumnarSnapshot into an array in key order, NaN where missing.
+        The keys are only looked up again when the snapshot's names have grown.'''
+        if self.positions is None or snapshot.names is not self.names or len(snapshot.names) != self.names_len:
+            self.positions = snapshot.positions(self.keys)
+            self.names = snapshot.names
+            self.names_len = len(snapshot.names)
+        return snapshot.values_for(self.keys, self.positions)
+
+    def evaluate(self, values, now=None):
+        '''Checks a snapshot, either a ColumnarSnapshot, an array in key order or a get_all map, returns the list of AlarmEvents.
+        A map has to be looked up key by key, the other two are converted without a Python loop.'''
+        if now is None:
+            now = time.monotonic()
+        if isinstance(values, dict):
+            values = self.vector(values)
+        elif hasattr(values, 'values_for'):
+            values = self.snapshot_vector(values)
+        v = values
+        valid = ~np.isnan(v)
+
+        # Comparisons against NaN limits are False, so disabled checks never raise
+        with np.errstate(invalid='ignore'):
+            high_raise = valid & ~self.high_active & (v > self.high)
+            high_clear = valid & self.high_active & (v < self.high - self.deadband)
+            low_raise = valid & ~self.low_active & (v < self.low)
+            low_clear = valid & self.low_active & (v > self.low + self.deadband)
+
+            dt = now - self.last_time
+            slope = np.abs(v - self.last_value) / np.where(dt > 0, dt, np.nan)
+            has_slope = valid & ~np.isnan(slope)
+            rate_raise = has_slope & ~self.rate_active & (slope > self.rate)
+            rate_clear = has_slope & self.rate_active & (slope < self.rate - self.rate_deadband)
+
+        self.high_active = (self.high_active | high_raise) & ~high_clear
+        self.low_active = (self.low_active | low_raise) & ~low_clear
+        self.rate_active = (self.rate_active | rate_raise) & ~rate_clear
+        self.last_value = np.where(valid, v, self.last_value)
+        self.last_time = np.where(valid, now, self.last_time)
+
+        # Only build event objects for what changed, usually nothing
+        events = []
+        checks = ((HIGH, high_raise, high_clear, self.high, v),
+                  (LOW, low_raise, low_clear, self.low, v),
+                  (RATE, rate_raise, rate_clear, self.rate, slope))
+        for kind, raised, cleared, limit, measured in checks:
+            for action, mask in ((RAISE, raised), (CLEAR, cleared)):
+                for i in np.flatnonzero(mask):
+                    events.append(AlarmEvent(self.keys[i], kind, action, float(measured[i]), float(limit[i]), now))
+        return events
+
+    def active(self):
+        '''Returns a list of (key, kind) for every alarm currently raised'''
+        active = []
+        for kind, mask in ((HIGH, self.high_active), (LOW, self.low_active), (RATE, self.rate_active)):
+            for i in np.flatnonzero(mask):
+                active.append((self.keys[i], kind))
+        return active
@@ -0,0 +1,132 @@
+import time
+from collections import deque
+
+def epoch(timestamp):
+    '''Epoch seconds of a datetime or a number'''
+    if hasattr(timestamp, 'timestamp'):
+        return timestamp.timestamp()
+    return float(timestamp)
+
+class ClockSync:
+    '''Estimates the offset (server clock - client clock) and drift of the server clock, NTP style.
+    Every probe is a short burst of exchanges timed on the client (t0 sent, t3 received):
+
+    - If the server puts its time in the hello reply, each exchange gives
+      offset = server time - (t0 + t3)/2, and the burst keeps the one with the smallest round trip.
+    - Otherwise (dummy_server only echoes hello, the real server may not answer it at all) the server
+      time is the timestamp of a value read with get, timed the same way. A value is stamped before it
+      is sent, so timestamp - t3 + rtt/2 underestimates the offset by how stale the value was, and the
+      burst keeps the largest. This only works for a key the server restamps on every read: a timestamp
+      seen before in the burst or the last probe is not used, a burst needs two new ones, and one below the
+      current estimate by more than `tolerance` is rejected, so a stale key leaves the clock unsynced
+      rather than wrong.
+
+    Drift is the slope of a least squares line through the best offsets of the last `window` probes.'''
+    def __init__(self, window=32, tolerance=0.05) -> None:
+        # (client time, offset, round trip) of the best exchange of each probe
+        self.samples = deque(maxlen=window)
+        self.mode = None
+        self.tolerance = tolerance
+        # Value timestamps of the last probe, and the probes rejected as stale
+        self.stamps = set()
+        self.rejected = 0
+
+    def probe(self, client, key=None, count=5):
+        '''Runs one burst of `count` exchanges with `client`, returns False if nothing came back.
+        `key` is read for its timestamp when hello replies carry no server time.'''
+        best = None
+        stamps = set()
+        read = False
+        for _ in range(count):
+            # Once hello is known to carry no time, only values are read
+            if self.mode != 'value' and client.hello_supported is not False:
+                t0, t3, server_time = client.hello()
+                if server_time is not None:
+                    self.mode = 'hello'
+                    rtt = t3 - t0
+                    offset = server_time - (t0 + t3)/2
+                    if best is None or rtt < best[2]:
+                        best = ((t0 + t3)/2, offset, rtt)
+                    continue
+            if key is None:
+                continue
+            t0 = time.time()
+            value = client.get_value(key)
+            t3 = time.time()
+            if value is None:
+                continue
+            self.mode = 'value'
+            read = True
+            stamp = epoch(value[0])
+            if stamp in stamps or stamp in self.stamps:
+                # Not restamped for this read, it says nothing about the server's time now
+                continue
+            stamps.add(stamp)
+            rtt = t3 - t0
+            offset = stamp - t3 + rtt/2
+            if best is None or offset > best[1]:
+                best = (t3, offset, rtt)
+        if self.mode == 'value':
+            self.stamps = stamps
+        if best is None:
+            self.rejected += read
+            return False
+        # A value key has to show new timestamps within the burst, and agree with the estimate so far
+        if self.mode == 'value' and (len(stamps) < 2 or
+                                     len(self.samples) >= 3 and best[1] < self.offset(best[0]) - self.tolerance):
+            self.rejected += 1
+            return False
+        self.samples.append(best)
+        return True
+
+    def fit(self):
+        '''Returns (reference client time, offset at it, drift in s/s)'''
+        n = len(self.samples)
+        if n == 0:
+            return time.time(), 0.0, 0.0
+        t_ref = sum(s[0] for s in self.samples)/n
+        o_mean = sum(s[1] for s in self.samples)/n
+        if n < 3:
+            return t_ref, o_mean, 0.0
+        var = sum((s[0] - t_ref)**2 for s in self.samples)
+        if var <= 0:
+            return t_ref, o_mean, 0.0
+        drift = sum((s[0] - t_ref)*(s[1] - o_mean) for s in self.samples)/var
+        return t_ref, o_mean, drift
+
+    def offset(self, at=None):
+        '''Server clock - client clock in seconds at client time `at` (now by default)'''
+        if at is None:
+            at = time.time()
+        t_ref, o_ref, drift = self.fit()
+        return o_ref + drift*(at - t_ref)
+
+    def to_client(self, timestamp):
+        '''Converts a server timestamp (datetime or epoch seconds) to client epoch seconds'''
+        ts = epoch(timestamp)
+        # The offset barely changes over the gap between the two clocks, so one correction is enough
+        return ts - self.offset(ts - self.offset(ts))
+
+    def age(self, timestamp, now=None):
+        '''Seconds since a value stamped `timestamp` by the server, on the client clock'''
+        if now is None:
+            now = time.time()
+        return now - self.to_client(timestamp)
+
+    def one_way_delay(self):
+        '''Half of the smallest round trip seen recently, in seconds'''
+        if not self.samples:
+            return None
+        return min(s[2] for s in self.samples)/2
+
+    def summary(self):
+        t_ref, offset, drift = self.fit()
+        return {
+            'mode': self.mode,
+            'samples': len(self.samples),
+            'rejected': self.rejected,
+            'offset_ms': 1000*self.offset(),
+            'drift_ppm': 1e6*drift,
+            'one_way_ms': 1000*self.one_way_delay() if self.samples else None,
+            'rtt_ms': 1000*self.samples[-1][2] if self.samples else None,
+        }
@@ -0,0 +1,132 @@
+import threading
+import time
+
+# Keys always sent even if unchanged: switching a supply on again after it tripped has to reach it
+ALWAYS_SEND = ('_Power', '_Polarity')
+
+class WriteCoalescer:
+    '''Sends setpoint writes from a background thread, keeping only the latest pending value per key.
+    A value submitted while an older one for the same key is still waiting replaces it, and a value
+    equal to the last one the server acknowledged within `max_age` seconds is not sent at all,
+    unless the key ends with one of `always` (power and polarity switches by default).
+    Pending writes go out together in one batched set_values.'''
+    def __init__(self, client, max_age=2.0, retries=1, always=ALWAYS_SEND) -> None:
+        self.client = client
+        self.max_age = max_age
+        self.always = tuple(always)
+        self.retries = retries
+        # key -> value, in the order keys were first submitted
+        self.pending = {}
+        self.attempts = {}
+        # key -> (value, time.monotonic() when acknowledged)
+        self.last_acked = {}
+        self.busy = False
+        self.condition = threading.Condition()
+        self.running = True
+
+        self.submitted = 0
+        self.superseded = 0
+        self.unchanged = 0
+        self.sent = 0
+        self.failed = 0
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, key, value):
+        '''Queues `value` to be written to `key`'''
+        with self.condition:
+            self.submitted += 1
+            if key in self.pending:
+                self.superseded += 1
+            self.pending[key] = value
+            self.attempts[key] = 0
+            self.condition.notify()
+
+    def forget(self, key=None):
+        '''Forgets the last acknowledged value of `key` (or all keys), e.g. after it was changed elsewhere'''
+        with self.condition:
+            if key is None:
+                self.last_acked.clear()
+            else:
+                self.last_acked.pop(key, None)
+
+    def unchanged_value(self, key, value, now):
+        if key.endswith(self.always):
+            return False
+        acked = self.last_acked.get(key)
+        if acked is None or now - acked[1] > self.max_age:
+            return False
+        return acked[0] == value and type(acked[0]) == type(value)
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                now = time.monotonic()
+                batch = {}
+                for key in self.pending:
+                    value = self.pending[key]
+                    if self.unchanged_value(key, value, now):
+                        self.unchanged += 1
+                    else:
+                        batch[key] = value
+                self.pending = {}
+                self.busy = True
+
+            acked = self.client.set_values(batch) if batch else 0
+            now = time.monotonic()
+
+            with self.condition:
+                self.sent += len(batch)
+                if acked == len(batch):
+                    for key in batch:
+                        self.last_acked[key] = (batch[key], now)
+                else:
+                    # Replies don't say which write was lost, so send the batch again
+                    # unless a newer value is already waiting
+                    for key in batch:
+                        self.last_acked.pop(key, None)
+                        if key in self.pending:
+                            continue
+                        self.attempts[key] = self.attempts.get(key, 0) + 1
+                        if self.attempts[key] <= self.retries:
+                            self.pending[key] = batch[key]
+                        else:
+                            self.failed += 1
+                            print(f'Failed to write {key}')
+                self.busy = False
+                self.condition.notify_all()
+
+    def flush(self, timeout=1.0):
+        '''Waits until every pending write has been sent, returns False on timeout'''
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join(1.0)
+
+    def stats(self):
+        '''Returns the write counts, saved is the number of writes that never had to be sent'''
+        return {
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'superseded': self.superseded,
+            'unchanged': self.unchanged,
+            'failed': self.failed,
+            'saved': self.superseded + self.unchanged,
+        }
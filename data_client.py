@@ -1,7 +1,12 @@
 import socket
+import sys
 from datetime import datetime
+from collections import OrderedDict
+from bisect import bisect_left
 import pickle
 import struct
+import time
+import numpy as np
 
 ADDR = ("192.168.0.10", 20002)
 
@@ -129,6 +134,7 @@ DALIM = b'_::_'
 GET = b'get'
 SET = b'set'
 ALL = b'all'
+PREFIX = b'prefix'
 CLEAR = b'clear'
 OPEN = b'open'
 CLOSE = b'close'
@@ -139,6 +145,21 @@ UNPACK_ERR = b'unpack_err'
 SUCCESS = b'success!'
 FILLER = b"??"
 BUFSIZE = 1024
+# Receive buffer asked for on every connection, so a get_all burst fits while we drain it.
+# The kernel may cap it (net.core.rmem_max on Linux), BaseDataClient.rcvbuf is what was granted.
+RCVBUF = 4*1024*1024
+# A client pings the server once it has heard nothing for this many seconds,
+# and starts a new session after this many pings in a row go unanswered.
+# The ping is a hello, which only dummy_server is known to answer (the server's hello handling was
+# commented out here before), so a server that doesn't answer it is pinged with a get instead.
+HEARTBEAT_PERIOD = 0.2
+HEARTBEAT_MISSES = 3
+# Seconds between attempts to start a new session, doubling from the first to the second
+RESUME_BACKOFF = (0.05, 2.0)
+# Datagrams get_all drains from the socket before decoding them
+BURST_SLOTS = 512
+# Linux can report the socket's drop count with each datagram, elsewhere only missing keys are counted
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
 
 # Server -> client messages
 SETSUCCESS = SUCCESS + DALIM + SET
@@ -151,7 +172,7 @@ CLOSED = SUCCESS + DALIM + CLOSE
 # Client -> server messages
 _open_cmd = OPEN + DELIM + FILLER + OPEN
 _close_cmd = CLOSE + DELIM + FILLER + CLOSE
-# _hello = HELLO + DELIM + HELLO
+_hello = HELLO + DELIM + HELLO
 all_request = ALL + DELIM + FILLER + ALL
 
 def pack_value(timestamp, value):
@@ -162,8 +183,9 @@ def pack_value(timestamp, value):
         return packed
     return pickle.dumps(pack)
 
-def unpack_value(bytes):
-    '''Unpacks a value from the bytes, returns if it did unpack, the key, and what unpacked'''
+def unpack_value(bytes, raw_time=False):
+    '''Unpacks a value from the bytes, returns if it did unpack, the key, and what unpacked.
+    With raw_time the timestamp is left as epoch seconds instead of being converted to a datetime.'''
     # messages from server are split by DALIM
     args = bytes.split(DALIM)
     # If it said success, that means it wasn't a value response!
@@ -198,8 +220,10 @@ def unpack_value(bytes):
         except Exception:
             # Not a pickle thing, lets try custom values
             unpacked = unpack_data(data)
-            timestamp = datetime.fromtimestamp(unpacked.time)
-            value = (timestamp, unpacked.value)
+            if raw_time:
+                value = (unpacked.time, unpacked.value)
+            else:
+                value = (datetime.fromtimestamp(unpacked.time), unpacked.value)
         return True, key, value
     except Exception as err:
         # Otherwise print error and return unpack error
@@ -216,20 +240,350 @@ def set_msg(key, timestamp, value):
     return msg
 
 
+class PreparedSet:
+    '''A set message encoded ahead of time, only the timestamp is filled in when it is sent'''
+    def __init__(self, key, value) -> None:
+        if pack_data(datetime.now(), value) is None:
+            raise ValueError(f'{key}: only standard value types can be prepared')
+        self.key = key
+        self.value = value
+        self.msg = bytearray(set_msg(key, datetime.now(), value))
+        # Offset of the timestamp: command, delimiter, 2 size bytes, key, delimiter then the type id
+        self.time_offset = len(SET + DELIM) + 2 + len(str.encode(key)) + len(DALIM) + 1
+
+    def encode(self, timestamp):
+        '''Returns the message with `timestamp` (epoch seconds) filled in'''
+        struct.pack_into("<d", self.msg, self.time_offset, timestamp)
+        return self.msg
+
+def to_datetime64(values, keys=None):
+    '''Converts the timestamps of a map of key -> (timestamp, value) to one numpy.datetime64[us] array
+    in the order of `keys` (all keys by default), NaT where a key is missing.
+    Works on epoch second timestamps from a raw_time client and on datetimes. The result is in UTC.'''
+    if keys is None:
+        keys = list(values)
+    def seconds(key):
+        entry = values.get(key)
+        if entry is None:
+            return np.nan
+        t = entry[0]
+        return t if isinstance(t, float) else t.timestamp()
+    times = np.fromiter((seconds(key) for key in keys), dtype=float, count=len(keys))
+    result = np.full(len(keys), np.datetime64('NaT'), dtype='datetime64[us]')
+    valid = ~np.isnan(times)
+    result[valid] = np.round(times[valid]*1e6).astype('int64').astype('datetime64[us]')
+    return result
+
+# Record layout of the numeric values in a ColumnarSnapshot
+SNAPSHOT_DTYPE = np.dtype([('key', 'i4'), ('time', 'f8'), ('value', 'f8')])
+
+class ColumnarSnapshot:
+    '''A get_all result stored as columns rather than a map.
+    `records` is a SNAPSHOT_DTYPE structured array of every numeric value (bools and ints as floats),
+    sorted by key index. A key index points into `names` (`index` maps the other way), which only
+    ever grow, so snapshots built with the same names line up. Strings and pickled values go in
+    `other` as key -> (time, value).'''
+    def __init__(self, names, index, records, other) -> None:
+        self.names = names
+        self.index = index
+        self.records = records
+        self.other = other
+
+    @classmethod
+    def from_values(cls, values, names, index):
+        '''Builds a snapshot from a map of key -> (timestamp, value).
+        `names` and `index` (key -> position in names) are extended with keys not seen before.'''
+        keys = []
+        times = []
+        numbers = []
+        other = {}
+        for key in values:
+            timestamp, value = values[key]
+            if isinstance(value, (int, float)):
+                i = index.get(key)
+                if i is None:
+                    i = index[key] = len(names)
+                    names.append(key)
+                keys.append(i)
+                times.append(timestamp if isinstance(timestamp, float) else timestamp.timestamp())
+                numbers.append(value)
+            else:
+                other[key] = values[key]
+        records = np.empty(len(keys), dtype=SNAPSHOT_DTYPE)
+        records['key'] = keys
+        records['time'] = times
+        records['value'] = numbers
+        records.sort(order='key')
+        return cls(names, index, records, other)
+
+    def __len__(self):
+        return len(self.records) + len(self.other)
+
+    def rows(self):
+        '''Array mapping every key index to its row in records, -1 where the key is missing'''
+        rows = np.full(len(self.names), -1, dtype=np.intp)
+        rows[self.records['key']] = np.arange(len(self.records))
+        return rows
+
+    def positions(self, keys):
+        '''Key indices of `keys` as an array, -1 for keys not in names yet.
+        They stay valid for later snapshots until names grows, so callers can keep them.'''
+        return np.fromiter((self.index.get(key, -1) for key in keys), dtype=np.intp, count=len(keys))
+
+    def values_for(self, keys, positions=None):
+        '''Values of `keys` as a float array in the same order, NaN where missing or not a number.
+        `positions` are the keys' indices from positions(), to skip looking every key up.'''
+        # An extra -1 at the end of rows makes unknown keys land on "missing"
+        rows = np.append(self.rows(), -1)
+        if positions is None:
+            positions = self.positions(keys)
+        row = rows[positions]
+        result = np.full(len(keys), np.nan)
+        have = row >= 0
+        result[have] = self.records['value'][row[have]]
+        return result
+
+    def get(self, key):
+        '''Returns (epoch seconds, value) of `key`, or None'''
+        if key in self.other:
+            return self.other[key]
+        i = self.index.get(key)
+        if i is None:
+            return None
+        row = np.searchsorted(self.records['key'], i)
+        if row < len(self.records) and self.records['key'][row] == i:
+            return float(self.records['time'][row]), float(self.records['value'][row])
+        return None
+
+    def frame(self):
+        '''pandas DataFrame of the numeric values indexed by key name.
+        The time and value columns are views of records, not copies.'''
+        import pandas as pd
+        index = pd.Index(np.asarray(self.names, dtype=object)[self.records['key']], name='key')
+        return pd.DataFrame({'time': self.records['time'], 'value': self.records['value']}, index=index, copy=False)
+
 def get_msg(key):
     '''Packs key for a get query'''
     # Server doesn't presently use the size bytes here, hence FILLER
     return GET + DELIM + FILLER + str.encode(key)
 
+def prefix_msg(prefix):
+    '''Packs prefix for a get_prefix query, the server replies like get_all but only with keys starting with it'''
+    return PREFIX + DELIM + FILLER + str.encode(prefix)
+
+class PrefixIndex:
+    '''Sorted set of key names, finds the keys of a subsystem such as "Deflectors_XY1_"
+    in O(log n + matches) by bisecting for the prefix'''
+    def __init__(self, keys=()) -> None:
+        self.known = set(keys)
+        self.keys = sorted(self.known)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.known
+
+    def add(self, keys):
+        '''Adds new key names, the sorted list is only rebuilt if there were any'''
+        if not self.known.issuperset(keys):
+            self.known.update(keys)
+            self.keys = sorted(self.known)
+
+    def find(self, prefix):
+        '''Returns the sorted keys starting with `prefix`'''
+        start = bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return self.keys[start:end]
+
+class ValueCache:
+    '''Bounded LRU cache of values read from the server, each key has a max age in seconds'''
+    def __init__(self, max_age=0.1, max_size=1024, ages=None) -> None:
+        '''max_age is the default age limit, ages maps keys to their own limits'''
+        self.max_age = max_age
+        self.max_size = max_size
+        self.ages = {} if ages is None else dict(ages)
+        # key -> (time.monotonic() when stored, value)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def set_max_age(self, key, max_age):
+        '''Sets the max age for `key`, 0 disables caching it'''
+        self.ages[key] = max_age
+
+    def get(self, key):
+        '''Returns the cached value for `key` if it is fresh enough, otherwise None'''
+        entry = self.entries.get(key)
+        if entry is not None:
+            stored, value = entry
+            if time.monotonic() - stored <= self.ages.get(key, self.max_age):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            # Stale, so drop it now rather than waiting for eviction
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value, now=None):
+        '''Stores `value` for `key`, evicting the least recently used keys if full'''
+        if now is None:
+            now = time.monotonic()
+        self.entries[key] = (now, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def update(self, values):
+        '''Stores every value in the `values` map with a single timestamp'''
+        now = time.monotonic()
+        for key in values:
+            self.put(key, values[key], now)
+
+    def invalidate(self, key=None):
+        '''Removes `key` from the cache, or everything if key is None'''
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+# Upper edges of the latency histogram buckets in ms, the last bucket catches everything above
+LATENCY_BUCKETS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+class OpStats:
+    '''Call counts and latency histogram of one client operation'''
+    def __init__(self) -> None:
+        self.calls = 0
+        self.ok = 0
+        self.failed = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, ok):
+        '''Records a call which took `seconds` and succeeded if `ok`'''
+        self.calls += 1
+        if ok:
+            self.ok += 1
+        else:
+            self.failed += 1
+        ms = seconds * 1e3
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+        self.histogram[bisect_left(LATENCY_BUCKETS, ms)] += 1
+
+    def percentile(self, fraction):
+        '''Upper bucket edge below which `fraction` of the calls completed, in ms'''
+        if self.calls == 0:
+            return 0.0
+        target = fraction * self.calls
+        count = 0
+        for i, n in enumerate(self.histogram):
+            count += n
+            if count >= target:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'ok': self.ok,
+            'failed': self.failed,
+            'mean_ms': self.total / self.calls if self.calls else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max,
+            'histogram': list(self.histogram),
+        }
+
+class ClientStats:
+    '''Counters and per operation latency statistics for a BaseDataClient'''
+    OPS = ('get_value', 'get_values', 'set_value', 'get_all', 'get_prefix', 'select', 'hello', 'ping')
+    COUNTERS = ('retries', 'timeouts', 'out_of_order', 'unpack_errors', 'key_errors',
+                'reconnects', 'cache_hits', 'read_hits', 'values_received', 'socket_drops', 'values_missing',
+                'heartbeat_misses', 'resumes', 'offline')
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        self.ops = {op: OpStats() for op in self.OPS}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add(self, op, seconds, ok):
+        self.ops[op].add(seconds, ok)
+
+    def summary(self):
+        summary = {op: self.ops[op].summary() for op in self.ops}
+        summary['counters'] = dict(self.counters)
+        summary['buckets_ms'] = list(LATENCY_BUCKETS)
+        return summary
+
 class BaseDataClient:
     '''Python client implementation'''
-    def __init__(self, addr=ADDR, custom_port=False) -> None:
-        '''addr is address/port tuple, custom_port would call select() if true'''
+    def __init__(self, addr=ADDR, custom_port=False, cache=None, timeout=0.1, raw_time=False, rcvbuf=RCVBUF,
+                 heartbeat=HEARTBEAT_PERIOD, misses=HEARTBEAT_MISSES) -> None:
+        '''addr is address/port tuple, custom_port would call select() if true,
+        cache is an optional ValueCache used to skip repeated reads of fresh values,
+        timeout is how long to wait for each reply in seconds,
+        raw_time returns timestamps as epoch seconds rather than datetimes (see to_datetime64),
+        rcvbuf is the socket receive buffer to ask for in bytes, 0 keeps the system default,
+        heartbeat and misses control how a lost server is detected (see keep_alive), a heartbeat of 0 turns it off'''
         self.connection = None
+        self.timeout = timeout
+        self.raw_time = raw_time
+        self.requested_rcvbuf = rcvbuf
+        # Receive buffer the kernel actually granted
+        self.rcvbuf = 0
+        # get_all drains bursts into these slots, BUFSIZE bytes each, and decodes them afterwards
+        self.burst = bytearray(BURST_SLOTS*BUFSIZE)
+        view = memoryview(self.burst)
+        self.burst_slots = [view[i*BUFSIZE:(i + 1)*BUFSIZE] for i in range(BURST_SLOTS)]
+        self.burst_sizes = [0]*BURST_SLOTS
+        # Drop count of the socket as last reported by the kernel, None if it can't be tracked
+        self.kernel_drops = None
+        # Every key seen so far, to count the ones missing from later bulk reads and to find subsystems
+        self.prefix_index = PrefixIndex()
+        # Whether the server answers get_prefix and hello, None until it has been tried
+        self.prefix_supported = None
+        self.hello_supported = None
         self.addr = addr
         self.root_port = addr[1]
         self.reads = {}
         self.values = {}
+        self.cache = cache
+        self.diagnostics = ClientStats()
+        # Time spent unpacking values during the last get_all
+        self.decode_time = 0.0
+        self.all_started = 0.0
+        self.all_drops = None
+        # Datagrams received for the bulk read in progress, and whether the server refused the request
+        self.all_replies = 0
+        self.all_refused = False
+        # Key names and their indices in columnar snapshots, stable for the life of the client
+        self.key_names = []
+        self.key_index = {}
+        self.heartbeat = heartbeat
+        self.misses = misses
+        # time.monotonic() of the last datagram from the server, and requests gone unanswered since
+        self.last_reply = time.monotonic()
+        self.silent = 0
+        # Whether the server is answering, and if not when to try a new session next
+        self.online = True
+        self.selected = False
+        self.next_resume = 0.0
+        self.backoff = RESUME_BACKOFF[0]
+        # Called with the client after every new session started by keep_alive
+        self.resume_callbacks = []
+        # Keys the server answered with a key error, each is only reported the first time
+        self.unknown_keys = set()
         self.init_connection()
         if custom_port:
             self.select()
@@ -245,7 +599,20 @@ class BaseDataClient:
         if self.connection is not None:
             self.close()
         self.connection = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.connection.settimeout(0.1)
+        self.connection.settimeout(self.timeout)
+        if self.requested_rcvbuf:
+            try:
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.requested_rcvbuf)
+            except OSError as err:
+                print(f'error setting receive buffer? {err}')
+        self.rcvbuf = self.connection.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.kernel_drops = None
+        if SO_RXQ_OVFL is not None and hasattr(self.connection, 'recvmsg_into'):
+            try:
+                self.connection.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.kernel_drops = 0
+            except OSError:
+                pass
 
     def close(self):
         if self.connection is not None:
@@ -257,72 +624,318 @@ class BaseDataClient:
                 print('error closing?')
                 pass
 
+    def stats(self):
+        '''Returns a map of the latency and error statistics gathered so far'''
+        summary = self.diagnostics.summary()
+        summary['rcvbuf'] = self.rcvbuf
+        return summary
+
     def select(self):
         '''This is the Python equivalent of the "connect" function in C++ version, it also ensures a new port'''
+        start = time.perf_counter()
         try:
             # ensure we are in the initial port
             # this also closes the connection if it existed
             self.change_port(self.root_port)
             self.connection.sendto(_open_cmd, self.addr)
-            msgFromServer = self.connection.recvfrom(BUFSIZE)
+            msgFromServer = self.receive()
             new_port = int(msgFromServer[0].decode("utf-8").replace("open:__:", "").replace("open_::_", ""))
             self.change_port(new_port)
+            self.selected = True
+            self.diagnostics.add('select', time.perf_counter() - start, True)
             return True
         except Exception as err:
+            if isinstance(err, socket.timeout):
+                self.timed_out()
             print(f'error selecting? {err}')
             pass
+        self.diagnostics.add('select', time.perf_counter() - start, False)
+        return False
+
+    def unknown_key(self, key):
+        '''Notes a key the server doesn't know, printing it only the first time so polling it doesn't flood the console'''
+        if key not in self.unknown_keys:
+            self.unknown_keys.add(key)
+            print(f"Error getting {key}")
+
+    def receive(self):
+        '''Receives one datagram, which also shows the server is alive'''
+        msg = self.connection.recvfrom(BUFSIZE)
+        self.last_reply = time.monotonic()
+        self.silent = 0
+        return msg
+
+    def timed_out(self):
+        '''Counts a request that got no reply, `misses` of them in a row and the server is taken as lost'''
+        self.diagnostics.count('timeouts')
+        self.silent += 1
+
+    def on_resume(self, callback):
+        '''Registers `callback(client)` to be replayed after keep_alive starts a new session,
+        to restore whatever was set up on the old one'''
+        self.resume_callbacks.append(callback)
+
+    def keep_alive(self):
+        '''Heartbeat, run before each request. Once nothing has been heard from the server for `heartbeat` seconds
+        it is pinged, and when `misses` requests or pings in a row go unanswered the session is taken as lost.
+        A new one is then started with select(), retrying with a doubling backoff, and the on_resume callbacks
+        are replayed. Returns False while the server can't be reached, so requests fail straight away.'''
+        if not self.heartbeat:
+            return True
+        if self.online:
+            while self.silent < self.misses:
+                if time.monotonic() - self.last_reply < self.heartbeat or self.ping():
+                    return True
+                self.diagnostics.count('heartbeat_misses')
+            print(f'Lost the server at {self.addr[0]}:{self.root_port}, reconnecting')
+            self.online = False
+            self.backoff = RESUME_BACKOFF[0]
+            self.next_resume = 0.0
+        if time.monotonic() >= self.next_resume:
+            if self.resume():
+                return True
+            self.next_resume = time.monotonic() + self.backoff
+            self.backoff = min(2*self.backoff, RESUME_BACKOFF[1])
+        self.diagnostics.count('offline')
         return False
 
+    def resume(self):
+        '''Starts a new session after the server was lost, returns True once it answers'''
+        if self.selected:
+            if not self.select():
+                return False
+        elif not self.ping():
+            return False
+        self.online = True
+        # Anything from the old session is out of date, and the server may have changed
+        self.reads = {}
+        self.prefix_supported = None
+        self.hello_supported = None
+        self.diagnostics.count('resumes')
+        print(f'Server at {self.addr[0]}:{self.root_port} is back')
+        for callback in list(self.resume_callbacks):
+            try:
+                callback(self)
+            except Exception as err:
+                print(f'Error resuming session! {err}')
+        return True
+
+    def ping(self):
+        '''Checks that the server answers, returns True if it did. Servers that answer hello are pinged with it,
+        the others with a get of a key seen before (or of no key at all, a key error still counts as an answer).
+        Until it is known which kind the server is, a ping that goes unanswered is tried both ways.'''
+        silent = self.silent
+        if self.hello_supported is not False:
+            if self.hello()[1] is not None:
+                self.hello_supported = True
+                return True
+            # Unanswered, both tries count as a single miss
+            self.silent = silent
+        start = time.perf_counter()
+        key = self.prefix_index.keys[0] if len(self.prefix_index) else HELLO.decode()
+        try:
+            self.connection.sendto(get_msg(key), self.addr)
+            self.receive()
+        except Exception as err:
+            if isinstance(err, socket.timeout):
+                self.timed_out()
+            self.diagnostics.add('ping', time.perf_counter() - start, False)
+            return False
+        self.diagnostics.add('ping', time.perf_counter() - start, True)
+        if self.hello_supported is None:
+            self.hello_supported = False
+            print(f'Server at {self.addr[0]}:{self.root_port} does not answer hello, pinging it with get')
+        return True
+
+    def hello(self):
+        '''Pings the server, returns (time sent, time received, server time) in epoch seconds.
+        Time received is None if there was no reply, server time is None unless the reply carries one.'''
+        start = time.perf_counter()
+        t_send = time.time()
+        try:
+            self.connection.sendto(_hello, self.addr)
+            while True:
+                msgFromServer = self.receive()
+                t_recv = time.time()
+                args = msgFromServer[0].split(DALIM, 1)
+                # Skip late replies to earlier requests
+                if args[0] == HELLO:
+                    break
+        except Exception as err:
+            if isinstance(err, socket.timeout):
+                self.timed_out()
+            self.diagnostics.add('hello', time.perf_counter() - start, False)
+            return t_send, None, None
+        self.diagnostics.add('hello', time.perf_counter() - start, True)
+        server_time = None
+        if len(args) > 1 and args[1] != HELLO:
+            try:
+                server_time = unpack_data(args[1]).time
+            except Exception:
+                pass
+        return t_send, t_recv, server_time
+
     def get_value(self, key):
         '''Requests the value associated with `key` from the server'''
 
         _key = key
         # If we had already read it in error before, return that
         if _key in self.reads:
+            self.diagnostics.count('read_hits')
             return self.reads.pop(_key) 
 
+        # Then check if we read it recently enough to not ask again
+        if self.cache is not None:
+            cached = self.cache.get(_key)
+            if cached is not None:
+                self.diagnostics.count('cache_hits')
+                return cached
+
+        if not self.keep_alive():
+            return None
+        start = time.perf_counter()
         bytesToSend = get_msg(key)
         n = 0
         unpacked = ''
 
         # Otherwise try a few times at reading, we can fail for UDP reasons
         while n < 10:
+            if n > 0:
+                self.diagnostics.count('retries')
             n += 1
             # Send to server using created UDP socket
             try:
                 self.connection.sendto(bytesToSend, self.addr)
-                msgFromServer = self.connection.recvfrom(BUFSIZE)
-                success, _key2, unpacked = unpack_value(msgFromServer[0])
+                msgFromServer = self.receive()
+                success, _key2, unpacked = unpack_value(msgFromServer[0], self.raw_time)
 
                 if unpacked == KEY_ERR:
-                    print(f"Error getting {key}")
+                    self.diagnostics.count('key_errors')
+                    self.diagnostics.add('get_value', time.perf_counter() - start, False)
+                    self.unknown_key(key)
                     return None
                 # If we request too fast, things get out of order.
                 # This allows caching the wrong reads for later
                 if _key2 != _key:
                     n-=1
+                    self.diagnostics.count('out_of_order')
                     self.reads[_key2] = unpacked
+                    if success and self.cache is not None:
+                        self.cache.put(_key2, unpacked)
                     continue
                 if success:
+                    if self.cache is not None:
+                        self.cache.put(_key, unpacked)
+                    self.diagnostics.add('get_value', time.perf_counter() - start, True)
                     return unpacked
                 # Try to reset connection if we failed to unpack
                 if unpacked == UNPACK_ERR:
+                    self.diagnostics.count('unpack_errors')
+                    self.diagnostics.count('reconnects')
                     print('resetting connection')
                     self.init_connection()
             except Exception as err:
                 msg = f'Error getting value for {key}! {err}'
                 # Timeouts can happen, so only print ones that did not
-                if not 'timed out' in msg:
+                if isinstance(err, socket.timeout):
+                    self.timed_out()
+                    # Stop retrying once the server looks lost, keep_alive takes over
+                    if self.silent >= self.misses:
+                        break
+                else:
                     print(msg)
                 pass
+        self.diagnostics.add('get_value', time.perf_counter() - start, False)
         print(f'failed to get! {key} {unpacked}')
         return None
 
+    def get_values(self, keys, attempts=3):
+        '''Requests the values of several keys, sending all the requests before reading any replies.
+        Missing values are requested again up to `attempts` times, returns a map of the values found,
+        which may be incomplete due to lost packets.'''
+        found = {}
+        pending = []
+        for key in keys:
+            if key in self.reads:
+                self.diagnostics.count('read_hits')
+                found[key] = self.reads.pop(key)
+                continue
+            if self.cache is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    self.diagnostics.count('cache_hits')
+                    found[key] = cached
+                    continue
+            pending.append(key)
+        if pending and not self.keep_alive():
+            return found
+
+        start = time.perf_counter()
+        decode_time = 0.0
+        n = 0
+        while pending and n < attempts:
+            if n > 0:
+                self.diagnostics.count('retries', len(pending))
+            n += 1
+            try:
+                for key in pending:
+                    self.connection.sendto(get_msg(key), self.addr)
+            except Exception as err:
+                print(f'Error requesting values! {err}')
+                break
+            waiting = set(pending)
+            # Every request gets one reply, even if it is a key error
+            replies = len(pending)
+            while replies > 0:
+                try:
+                    msgFromServer = self.receive()
+                except Exception as err:
+                    if isinstance(err, socket.timeout):
+                        self.timed_out()
+                    else:
+                        print(f'Error getting values! {err}')
+                    break
+                decode_start = time.perf_counter()
+                success, _key, unpacked = unpack_value(msgFromServer[0], self.raw_time)
+                decode_time += time.perf_counter() - decode_start
+                if unpacked == KEY_ERR:
+                    self.diagnostics.count('key_errors')
+                    replies -= 1
+                    continue
+                if not success:
+                    if unpacked == UNPACK_ERR and _key != SUCCESS:
+                        self.diagnostics.count('unpack_errors')
+                    continue
+                if _key in waiting:
+                    waiting.discard(_key)
+                    found[_key] = unpacked
+                    replies -= 1
+                else:
+                    # Reply to an earlier request, keep it for later like get_value does
+                    self.diagnostics.count('out_of_order')
+                    self.reads[_key] = unpacked
+            if replies == 0:
+                # Everything was answered, so whatever is left got key errors
+                for key in waiting:
+                    self.unknown_key(key)
+                pending = []
+            else:
+                pending = [key for key in pending if key not in found]
+
+        self.decode_time = decode_time
+        if self.unknown_keys:
+            self.unknown_keys.difference_update(found)
+        self.diagnostics.count('values_received', len(found))
+        self.diagnostics.add('get_values', time.perf_counter() - start, not pending)
+        if self.cache is not None:
+            self.cache.update(found)
+        return found
+
     def get_var(self, key, default=0):
         '''Attempts to get value from server, if not present, returns default and now'''
         resp = self.get_value(key)
         if resp is None:
-            return datetime.now(), default
+            return (time.time() if self.raw_time else datetime.now()), default
         return resp[0], resp[1]
 
     def get_int(self, key, default=0):
@@ -347,7 +960,7 @@ class BaseDataClient:
         if data == SUCCESS:
             return True
         # Otherwise might be a get value return
-        _, _key2, unpacked = unpack_value(bytes[0])
+        _, _key2, unpacked = unpack_value(bytes[0], self.raw_time)
         if _key2 in self.reads:
             print('error, duplate return!')
             return False
@@ -378,42 +991,226 @@ class BaseDataClient:
         if(len(bytesToSend) > BUFSIZE):
             print('too long!')
             return False
+        if not self.keep_alive():
+            return False
+        start = time.perf_counter()
         try:
             # If so, try to sent to server
             self.connection.sendto(bytesToSend, self.addr)
-            msgFromServer = self.connection.recvfrom(BUFSIZE)
+            msgFromServer = self.receive()
             # And see if the server responded appropriately
             if self.check_set(key, msgFromServer[0]):
+                # Cached value is now out of date
+                if self.cache is not None:
+                    self.cache.invalidate(key)
+                self.diagnostics.add('set_value', time.perf_counter() - start, True)
                 return True
-        except:
-            pass
+        except Exception as err:
+            if isinstance(err, socket.timeout):
+                self.timed_out()
+        self.diagnostics.add('set_value', time.perf_counter() - start, False)
         return False
 
+    def set_values(self, values, timestamp = None):
+        '''Sends every `key`, `value` pair in the `values` map back to back, then reads the replies.
+        Returns the number of sets the server acknowledged.'''
+        if timestamp is None:
+            timestamp = datetime.now()
+        if not self.keep_alive():
+            return 0
+        start = time.perf_counter()
+        sent = 0
+        try:
+            for key in values:
+                bytesToSend = set_msg(key, timestamp, values[key])
+                if(len(bytesToSend) > BUFSIZE):
+                    print(f'too long! {key}')
+                    continue
+                self.connection.sendto(bytesToSend, self.addr)
+                sent += 1
+        except Exception as err:
+            print(f'Error setting values! {err}')
+        acked = 0
+        for _ in range(sent):
+            try:
+                msgFromServer = self.receive()
+                if msgFromServer[0].split(DALIM)[0] == SUCCESS:
+                    acked += 1
+            except Exception as err:
+                if isinstance(err, socket.timeout):
+                    self.timed_out()
+                break
+        elapsed = time.perf_counter() - start
+        for key in values:
+            self.diagnostics.add('set_value', elapsed, acked == len(values))
+            if self.cache is not None:
+                self.cache.invalidate(key)
+        return acked
+
+    def send_prepared(self, prepared, timestamp=None):
+        '''Sends a list of PreparedSets back to back, then reads their replies.
+        Returns the time.monotonic() just before each send and the number acknowledged.
+        There is no heartbeat here so a ping never delays timed sends, the caller runs keep_alive while idle.'''
+        if timestamp is None:
+            timestamp = time.time()
+        start = time.perf_counter()
+        sent = []
+        try:
+            for item in prepared:
+                msg = item.encode(timestamp)
+                sent.append(time.monotonic())
+                self.connection.sendto(msg, self.addr)
+        except Exception as err:
+            print(f'Error sending prepared values! {err}')
+        acked = 0
+        for _ in sent:
+            try:
+                msgFromServer = self.receive()
+                if msgFromServer[0].split(DALIM)[0] == SUCCESS:
+                    acked += 1
+            except Exception as err:
+                if isinstance(err, socket.timeout):
+                    self.timed_out()
+                break
+        elapsed = time.perf_counter() - start
+        for item in prepared:
+            self.diagnostics.add('set_value', elapsed, acked == len(prepared))
+            if self.cache is not None:
+                self.cache.invalidate(item.key)
+        return sent, acked
+
+    def get_all_columnar(self):
+        '''get_all, returned as a ColumnarSnapshot whose key indices stay the same between calls'''
+        return ColumnarSnapshot.from_values(self.get_all(), self.key_names, self.key_index)
+
+    def receive_into(self, slot):
+        '''Receives one datagram into burst slot `slot`, keeping track of the kernel's drop count'''
+        if self.kernel_drops is None:
+            size, _ = self.connection.recvfrom_into(self.burst_slots[slot])
+            self.last_reply = time.monotonic()
+            self.silent = 0
+        else:
+            size, ancdata, _, _ = self.connection.recvmsg_into([self.burst_slots[slot]], socket.CMSG_SPACE(4))
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                    self.kernel_drops = struct.unpack('I', data[:4])[0]
+            self.last_reply = time.monotonic()
+            self.silent = 0
+        self.burst_sizes[slot] = size
+
+    def receive_burst(self):
+        '''Waits up to the timeout for a datagram, then takes everything already queued without blocking,
+        up to BURST_SLOTS. Returns how many slots were filled.'''
+        self.receive_into(0)
+        count = 1
+        self.connection.setblocking(False)
+        try:
+            while count < BURST_SLOTS:
+                self.receive_into(count)
+                count += 1
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.connection.settimeout(self.timeout)
+        return count
+
     def get_all(self):
-        '''Requests all values from server, returns a map of all found values. This map may be incomplete due to lost packets.'''
-        self.values = {}
-        self.connection.sendto(all_request, self.addr)
-        done = False
-        while not done:
+        '''Requests all values from server, returns a map of all found values. This map may be incomplete due to lost packets.
+        The burst of replies is drained from the socket as it arrives and decoded in between,
+        so the receive buffer doesn't overflow while values are being unpacked.'''
+        return self.read_bulk(all_request, 'get_all')
+
+    def get_prefix(self, prefix):
+        '''Requests the values of every key starting with `prefix`, e.g. "Deflectors_XY1_", returns a map of the values found.
+        A server without the prefix request is read with get_values instead, for the keys seen in earlier reads.'''
+        if not self.keep_alive():
+            return {}
+        expected = self.prefix_index.find(prefix)
+        if self.prefix_supported is not False:
+            values = self.read_bulk(prefix_msg(prefix), 'get_prefix', expected)
+            if not self.all_refused and (self.all_replies > 0 or self.prefix_supported):
+                self.prefix_supported = True
+                return values
+            print(f'Server at {self.addr} does not answer get_prefix, reading keys one by one')
+            self.prefix_supported = False
+        if not self.prefix_index:
+            self.get_all()
+            expected = self.prefix_index.find(prefix)
+        return self.get_values(expected)
+
+    def read_bulk(self, request, op, expected=None):
+        '''Sends `request` and reads its burst of replies until the end of all message or a timeout'''
+        if not self.keep_alive():
+            self.values = {}
+            return self.values
+        self.request_all(request)
+        complete = False
+        while not complete:
             try:
-                msg = self.connection.recvfrom(BUFSIZE)
-                sucess, key, unpacked = unpack_value(msg[0])
-                if unpacked == UNPACK_ERR:
-                    continue
-                elif key == '':
-                    continue
-                elif sucess:
-                    self.values[key] = unpacked
-                elif unpacked == ALL:
-                    # end of all send recieved
-                    done = True
+                complete = self.read_all_burst()
             except KeyboardInterrupt:
-                pass
+                continue
             except Exception as err:
                 msg = f'Error getting value! {err}'
                 if 'timed out' in msg:
-                    done = True
+                    # Ending on a timeout means the end of all message was lost
+                    self.timed_out()
                     break
-                else:
-                    print(msg)
+                print(msg)
+        return self.finish_all(complete, op, expected)
+
+    def request_all(self, request=all_request):
+        '''Sends the all request (or a prefix request), the replies are then read with read_all_burst()
+        and collected with finish_all()'''
+        self.values = {}
+        self.decode_time = 0.0
+        self.all_replies = 0
+        self.all_refused = False
+        self.all_started = time.perf_counter()
+        self.all_drops = self.kernel_drops
+        self.connection.sendto(request, self.addr)
+
+    def read_all_burst(self):
+        '''Receives and decodes the next burst of get_all replies into self.values,
+        returns True once the end of all message has arrived'''
+        count = self.receive_burst()
+        self.all_replies += count
+        decode_start = time.perf_counter()
+        done = False
+        for i in range(count):
+            sucess, key, unpacked = unpack_value(bytes(self.burst_slots[i][:self.burst_sizes[i]]), self.raw_time)
+            if unpacked == UNPACK_ERR:
+                # A stray set response also comes back as UNPACK_ERR
+                if key != SUCCESS:
+                    self.diagnostics.count('unpack_errors')
+                continue
+            elif key == '':
+                continue
+            elif sucess:
+                self.values[key] = unpacked
+            elif unpacked == ALL:
+                # end of all send recieved, anything after it in the burst is a late reply
+                done = True
+                break
+            elif unpacked == MODE_ERR:
+                # The server doesn't know the request
+                self.all_refused = True
+                done = True
+                break
+        self.decode_time += time.perf_counter() - decode_start
+        return done
+
+    def finish_all(self, complete, op='get_all', expected=None):
+        '''Records the statistics of a get_all started with request_all(), returns the values received.
+        `expected` are the keys the reply should have held, every key seen so far if None.'''
+        if self.all_drops is not None and self.kernel_drops is not None:
+            self.diagnostics.count('socket_drops', self.kernel_drops - self.all_drops)
+        if complete:
+            expected = self.prefix_index.keys if expected is None else expected
+            self.diagnostics.count('values_missing', sum(1 for key in expected if key not in self.values))
+        self.prefix_index.add(self.values)
+        self.diagnostics.count('values_received', len(self.values))
+        self.diagnostics.add(op, time.perf_counter() - self.all_started, complete and not self.all_refused)
+        if self.cache is not None:
+            self.cache.update(self.values)
         return self.values
\ No newline at end of file
@@ -0,0 +1,155 @@
+#Stand-in for the CUEBIT data server, for trying out the client tools without the machine.
+#It speaks the same UDP protocol as the real server: "open" hands out a new port
+#served by its own thread, get/set/all/prefix work on an in-memory table of values.
+
+import argparse
+import socket
+import struct
+import threading
+from datetime import datetime
+
+import data_client as dc
+
+#Values the server starts with, a small subset of the real keys
+DEFAULT_VALUES = {
+    'Cathode_Voltage_Set': 0.0, 'Cathode_Voltage_Read': 0.0, 'Cathode_Voltage_Power': False,
+    'Cathode_Heater_Current_Set': 0.0, 'Cathode_Heater_Current_Read': 0.0, 'Cathode_Heater_Power': False,
+    'Cathode_Emission': 0.0, 'Anode_Voltage_Set': 0.0, 'Anode_Voltage_Read': 0.0,
+    'Anode_Voltage_Power': False, 'Anode_Current': 0.0,
+    'Drift_Tubes_U0_Set': 0.0, 'Drift_Tubes_U0_Read': 0.0, 'Drift_Tubes_UA_Set': 0.0,
+    'Drift_Tubes_UA_Read': 0.0, 'Drift_Tubes_UB': 0.0, 'Drift_Tubes_Power': False,
+    'Drift_Tubes_Current': 0.0, 'Drift_Tubes_T_Ion': 1000.0, 'Drift_Tubes_T_Ext': 100.0,
+    'Extraction_Voltage_Set': 0.0, 'Extraction_Voltage_Read': 0.0, 'Extraction_Voltage_Power': False,
+    'Lens_1_Voltage_Set': 0.0, 'Lens_1_Voltage_Read': 0.0, 'Lens_1_Voltage_Power': False, 'Lens_1_Polarity': 1,
+    'Lens_2_Voltage_Set': 0.0, 'Lens_2_Voltage_Read': 0.0, 'Lens_2_Voltage_Power': False, 'Lens_2_Polarity': 1,
+    'Pressure_HV_Source': 1e-9, 'Pressure_Gas_Valve_Set': 0.0,
+    'Interlock_Water': True, 'Interlock_Air': True, 'Interlock_Doors': True, 'Interlock_EMO': False,
+}
+
+class DummyServer:
+    '''Serves `values` on `addr` until stop() is called.
+    Readback keys (<name>_Read) follow their <name>_Set key when it is written.'''
+    def __init__(self, addr=('127.0.0.1', 20002), values=None) -> None:
+        self.addr = addr
+        self.values = dict(DEFAULT_VALUES if values is None else values)
+        # Key names in order, so prefix requests only visit the keys they return
+        self.index = dc.PrefixIndex(self.values)
+        self.lock = threading.Lock()
+        self.sockets = []
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        root = self.open_socket(self.addr)
+        # Port 0 picks a free port, report the one we got
+        self.addr = root.getsockname()
+        return self.addr
+
+    def stop(self):
+        '''Stops serving and waits until every port is released, so the server can be started again straight away'''
+        self.running = False
+        for thread in self.threads:
+            thread.join(1.0)
+        self.threads = []
+        self.sockets = []
+
+    def open_socket(self, addr):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(addr)
+        # Wakes up now and then to notice stop()
+        sock.settimeout(0.1)
+        self.sockets.append(sock)
+        thread = threading.Thread(target=self.serve, args=(sock,))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        return sock
+
+    def reply(self, key):
+        with self.lock:
+            value = self.values[key]
+        body = key.encode() + dc.DALIM + dc.pack_value(datetime.now(), value)
+        return struct.pack('<bb', len(body) & 31, len(body) >> 5) + body
+
+    def handle(self, data, sock, addr):
+        cmd, _, rest = data.partition(dc.DELIM)
+        if cmd == dc.GET:
+            key = rest[2:].decode()
+            if key in self.values:
+                sock.sendto(self.reply(key), addr)
+            else:
+                sock.sendto(b'\0\0' + dc.KEY_ERR_MSG, addr)
+        elif cmd == dc.SET:
+            key, _, packed = rest[2:].partition(dc.DALIM)
+            key = key.decode()
+            try:
+                value = dc.unpack_data(packed)
+            except Exception:
+                sock.sendto(b'\0\0' + dc.UNPACK_ERR + dc.DALIM + dc.UNPACK_ERR, addr)
+                return
+            with self.lock:
+                self.values[key] = value.value
+                if key.endswith('_Set'):
+                    self.values[key[:-len('_Set')] + '_Read'] = value.value
+                if key not in self.index:
+                    self.index.add([key])
+            sock.sendto(dc.SETSUCCESS, addr)
+        elif cmd == dc.ALL:
+            with self.lock:
+                keys = list(self.values)
+            for key in keys:
+                sock.sendto(self.reply(key), addr)
+            sock.sendto(dc.SUCCESS + dc.DALIM + dc.ALL, addr)
+        elif cmd == dc.PREFIX:
+            with self.lock:
+                keys = self.index.find(rest[2:].decode())
+            for key in keys:
+                sock.sendto(self.reply(key), addr)
+            # Ends like a get_all, so the client reads both the same way
+            sock.sendto(dc.SUCCESS + dc.DALIM + dc.ALL, addr)
+        elif cmd == dc.HELLO:
+            sock.sendto(dc.HELLO_FROM_SERVER, addr)
+        elif cmd == dc.OPEN:
+            new = self.open_socket((self.addr[0], 0))
+            sock.sendto(b'open_::_' + str(new.getsockname()[1]).encode(), addr)
+        elif cmd == dc.CLOSE:
+            # Ports handed out by open are only used by one client, the root port stays
+            if sock is not self.sockets[0]:
+                self.sockets.remove(sock)
+                # Tells serve() to stop and close the port
+                return False
+
+    def serve(self, sock):
+        try:
+            while self.running:
+                try:
+                    data, addr = sock.recvfrom(dc.BUFSIZE)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                try:
+                    if self.handle(data, sock, addr) is False:
+                        return
+                except Exception as err:
+                    print(f'Error handling {data[:40]}: {err}')
+        finally:
+            sock.close()
+
+
+def main(argv=None):
+    from server_connection import parse_addr
+    parser = argparse.ArgumentParser(description='Stand-in CUEBIT data server')
+    parser.add_argument('--addr', type=parse_addr, default=('127.0.0.1', 20002), help='address to serve on as host:port')
+    args = parser.parse_args(argv)
+    server = DummyServer(args.addr)
+    print(f'serving on {server.start()}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+#Exports part of a recording made by recorder.SnapshotRecorder (CSV rows of time,key,stamp,value)
+#to CSV or NumPy .npz, reading and writing in chunks so memory use stays flat whatever the size.
+
+import argparse
+import csv
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+
+import numpy as np
+
+# Rows are in order of their poll time apart from this many seconds, in case the clock was set back
+TIME_SLACK = 1.0
+# Older recordings have no poll time, only the server's timestamp of each value, which can be
+# out of order by a lot more. A value unchanged for longer than this is missed by a time range.
+LEGACY_TIME_SLACK = 60.0
+
+def parse_row(line, fields=4):
+    '''Splits a recording line (bytes) into (time, key, value text, server timestamp), None for the header or bad lines.
+    `fields` is 3 for older recordings without the poll time, their time is the server's timestamp.'''
+    if b'"' in line:
+        # Quoted by the csv writer, e.g. a string value with a comma
+        row = next(csv.reader([line.decode()]))
+    else:
+        row = line.rstrip(b'\r\n').decode().split(',', fields - 1)
+    if len(row) != fields:
+        return None
+    try:
+        if fields == 3:
+            time = float(row[0])
+            return time, row[1], row[2], time
+        return float(row[0]), row[1], row[3], float(row[2])
+    except ValueError:
+        return None
+
+def read_header(path):
+    '''Returns the header line of a recording (bytes) and how many fields its rows have'''
+    with open(path, 'rb') as file:
+        header = file.readline()
+    fields = len(next(csv.reader([header.decode()]), []))
+    if fields not in (3, 4):
+        raise ValueError(f'{path} is not a recording')
+    return header, fields
+
+def number(text):
+    '''Value text as a float, bools as 1/0, None if it is not a number'''
+    if text == 'True':
+        return 1.0
+    if text == 'False':
+        return 0.0
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def seek_time(file, start, size, fields=4, slack=TIME_SLACK):
+    '''Moves `file` (binary) to a line boundary shortly before the first row at `start`, by bisection'''
+    low, high = 0, size
+    while high - low > 65536:
+        middle = (low + high)//2
+        file.seek(middle)
+        file.readline()
+        row = None
+        while row is None:
+            line = file.readline()
+            if not line:
+                break
+            row = parse_row(line, fields)
+        if row is not None and row[0] < start - slack:
+            low = middle
+        else:
+            high = middle
+    file.seek(low)
+    if low > 0:
+        file.readline()
+    return file.tell()
+
+class RecordingExporter:
+    '''Copies the rows of `keys` (all keys if None) between `start` and `end` (epoch seconds, None for open ended)
+    from the recording `source` to `dest`. The format follows the extension of dest:
+    .csv keeps the recording's rows, .npz stores the numeric values as the columns
+    time, key (index into keys), stamp and value, plus the array of key names.
+    Rows are selected by the time they were polled, not by the server's timestamp of the value.
+    Runs in a background thread, `progress` goes from 0 to 1.'''
+    def __init__(self, source, dest, keys=None, start=None, end=None, chunk_rows=50000) -> None:
+        self.source = source
+        self.dest = dest
+        self.keys = None if keys is None else list(keys)
+        self.start_time = start
+        self.end_time = end
+        self.chunk_rows = chunk_rows
+        self.format = 'npz' if dest.lower().endswith('.npz') else 'csv'
+        # Header of the source and the number of fields of its rows, set by run()
+        self.header = None
+        self.fields = 4
+
+        self.progress = 0.0
+        self.rows = 0
+        self.skipped = 0
+        self.status = 'idle'
+        self.error = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.status = 'running'
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(2.0)
+        self.thread = None
+
+    def chunks(self):
+        '''Yields lists of (line, time, key, value text, stamp) in the time range, at most chunk_rows each'''
+        wanted = None if self.keys is None else set(self.keys)
+        size = os.path.getsize(self.source)
+        slack = TIME_SLACK if self.fields == 4 else LEGACY_TIME_SLACK
+        with open(self.source, 'rb') as file:
+            first = 0
+            if self.start_time is not None:
+                first = seek_time(file, self.start_time, size, self.fields, slack)
+            position = first
+            chunk = []
+            for line in file:
+                position += len(line)
+                if not self.running:
+                    return
+                row = parse_row(line, self.fields)
+                if row is None:
+                    continue
+                time, key, value, stamp = row
+                if self.end_time is not None and time > self.end_time:
+                    if time > self.end_time + slack:
+                        break
+                    continue
+                if (self.start_time is not None and time < self.start_time) or (wanted is not None and key not in wanted):
+                    continue
+                chunk.append((line, time, key, value, stamp))
+                if len(chunk) >= self.chunk_rows:
+                    yield chunk
+                    chunk = []
+                    self.progress = (position - first)/max(1, size - first)
+            if chunk:
+                yield chunk
+
+    def run(self):
+        try:
+            self.header, self.fields = read_header(self.source)
+            if self.format == 'npz':
+                self.export_npz()
+            else:
+                self.export_csv()
+            self.status = 'done' if self.running else 'stopped'
+            if self.running:
+                self.progress = 1.0
+        except Exception as err:
+            print(f'Export failed: {err}')
+            self.error = err
+            self.status = 'failed'
+        finally:
+            self.running = False
+
+    def export_csv(self):
+        with open(self.dest, 'wb') as out:
+            out.write(self.header if self.header.endswith(b'\n') else self.header + b'\n')
+            for chunk in self.chunks():
+                out.write(b''.join(row[0] if row[0].endswith(b'\n') else row[0] + b'\n' for row in chunk))
+                self.rows += len(chunk)
+
+    def export_npz(self):
+        '''Spools each column to a temporary file, then streams them into the .npz archive'''
+        names = [] if self.keys is None else list(self.keys)
+        index = {key: i for i, key in enumerate(names)}
+        columns = {'time': np.float64, 'key': np.int32, 'stamp': np.float64, 'value': np.float64}
+        with tempfile.TemporaryDirectory() as tmp:
+            spools = {name: open(os.path.join(tmp, name), 'wb') for name in columns}
+            try:
+                for chunk in self.chunks():
+                    times, keys, stamps, values = [], [], [], []
+                    for _, time, key, text, stamp in chunk:
+                        value = number(text)
+                        if value is None:
+                            self.skipped += 1
+                            continue
+                        i = index.get(key)
+                        if i is None:
+                            i = index[key] = len(names)
+                            names.append(key)
+                        times.append(time)
+                        keys.append(i)
+                        stamps.append(stamp)
+                        values.append(value)
+                    for name, data in (('time', times), ('key', keys), ('stamp', stamps), ('value', values)):
+                        np.asarray(data, dtype=columns[name]).tofile(spools[name])
+                    self.rows += len(times)
+            finally:
+                for spool in spools.values():
+                    spool.close()
+
+            with zipfile.ZipFile(self.dest, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+                for name, dtype in columns.items():
+                    path = os.path.join(tmp, name)
+                    count = os.path.getsize(path)//np.dtype(dtype).itemsize
+                    with archive.open(name + '.npy', 'w', force_zip64=True) as entry, open(path, 'rb') as spool:
+                        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (count,)}
+                        np.lib.format.write_array_header_1_0(entry, header)
+                        while True:
+                            block = spool.read(1 << 20)
+                            if not block:
+                                break
+                            entry.write(block)
+                with archive.open('keys.npy', 'w') as entry:
+                    np.lib.format.write_array(entry, np.array(names, dtype=str))
+
+
+def parse_time(text):
+    '''Parses "YYYY-MM-DD HH:MM:SS" (local time) or epoch seconds, None for an empty string'''
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export part of a CUEBIT recording to CSV or .npz')
+    parser.add_argument('source', help='recording made with server_connection.py --record')
+    parser.add_argument('dest', help='output file, .csv or .npz')
+    parser.add_argument('--keys', default='', help='comma separated keys, all if empty')
+    parser.add_argument('--start', type=parse_time, default=None, help='first poll time to export, "YYYY-MM-DD HH:MM:SS" or epoch seconds')
+    parser.add_argument('--end', type=parse_time, default=None, help='last poll time to export')
+    args = parser.parse_args(argv)
+
+    keys = [key.strip() for key in args.keys.split(',') if key.strip()] or None
+    exporter = RecordingExporter(args.source, args.dest, keys, args.start, args.end)
+    exporter.start()
+    while exporter.running:
+        exporter.thread.join(1.0)
+        print(f'{100*exporter.progress:.0f}%, {exporter.rows} rows', end='\r')
+    print(f'{exporter.status}: {exporter.rows} rows written to {args.dest}' + (f', {exporter.skipped} non-numeric skipped' if exporter.skipped else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#Client for several data servers at once (source, slits, detectors...), each server's keys
+#appear under a prefix of its own so they can live in one namespace.
+
+import selectors
+import socket
+import time
+
+import data_client as dc
+
+class FederatedClient:
+    '''Talks to several data servers as if they were one. `servers` maps a key prefix to a server address,
+    a key `k` of the server under prefix 'Slits_' is seen as 'Slits_k'. One prefix may be '' for the main server.
+    Every server gets its own BaseDataClient session. get_all sends the request to all of them at once
+    and drains the replies from one selector as they arrive, so a refresh takes as long as the slowest
+    server rather than the sum of them.'''
+    def __init__(self, servers, custom_port=False, timeout=0.1, raw_time=False, rcvbuf=dc.RCVBUF) -> None:
+        # Longest prefix first, so a key goes to the most specific server
+        self.sessions = {prefix: dc.BaseDataClient(addr, timeout=timeout, raw_time=raw_time, rcvbuf=rcvbuf)
+                         for prefix, addr in sorted(servers.items(), key=lambda item: -len(item[0]))}
+        self.selector = selectors.DefaultSelector()
+        self.values = {}
+        # Seconds the last get_all took for each server, and for all of them together
+        self.durations = {}
+        self.elapsed = 0.0
+        self.decode_time = 0.0
+        # Key names and their indices in columnar snapshots, stable for the life of the client
+        self.key_names = []
+        self.key_index = {}
+        if custom_port:
+            self.select()
+
+    @property
+    def addr(self):
+        '''Address of the main server, the one under the shortest prefix'''
+        return list(self.sessions.values())[-1].addr
+
+    def select(self):
+        '''Selects a new port on every server, returns True if all of them answered'''
+        return all([session.select() for session in self.sessions.values()])
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.selector.close()
+
+    def route(self, key):
+        '''Returns (prefix, session, key on that server) for a federated key, session is None if no prefix matches'''
+        for prefix, session in self.sessions.items():
+            if key.startswith(prefix):
+                return prefix, session, key[len(prefix):]
+        return None, None, key
+
+    def group(self, keys):
+        '''Splits federated keys by server: prefix -> list of keys on that server'''
+        groups = {}
+        for key in keys:
+            prefix, session, local = self.route(key)
+            if session is not None:
+                groups.setdefault(prefix, []).append(local)
+        return groups
+
+    def get_value(self, key):
+        prefix, session, local = self.route(key)
+        if session is None:
+            return None
+        return session.get_value(local)
+
+    def get_values(self, keys, attempts=3):
+        '''BaseDataClient.get_values, for each server in turn'''
+        found = {}
+        for prefix, local_keys in self.group(keys).items():
+            values = self.sessions[prefix].get_values(local_keys, attempts)
+            found.update((prefix + key, value) for key, value in values.items())
+        return found
+
+    def set_value(self, key, value, timestamp=None):
+        prefix, session, local = self.route(key)
+        if session is None:
+            return False
+        return session.set_value(local, value, timestamp)
+
+    def set_values(self, values, timestamp=None):
+        '''BaseDataClient.set_values, for each server in turn, returns the number acknowledged'''
+        acked = 0
+        for prefix, local_keys in self.group(values).items():
+            session = self.sessions[prefix]
+            acked += session.set_values({key: values[prefix + key] for key in local_keys}, timestamp)
+        return acked
+
+    def get_prefix(self, prefix):
+        '''BaseDataClient.get_prefix on the server the prefix belongs to'''
+        session_prefix, session, local = self.route(prefix)
+        if session is None:
+            return {}
+        values = session.get_prefix(local)
+        if not session_prefix:
+            return values
+        return {session_prefix + key: value for key, value in values.items()}
+
+    def get_all(self):
+        '''Requests all values from every server at once, returns the merged map of values found.
+        A server that stays quiet for its timeout only loses its own part of the map.'''
+        start = time.perf_counter()
+        # prefix -> when the server was last heard from
+        pending = {}
+        results = {}
+        for prefix, session in self.sessions.items():
+            # A lost server is left out until keep_alive has a new session with it
+            if not session.keep_alive():
+                results[prefix] = {}
+                continue
+            try:
+                session.request_all()
+            except OSError as err:
+                print(f'Error requesting values from {session.addr}! {err}')
+                continue
+            self.selector.register(session.connection, selectors.EVENT_READ, prefix)
+            pending[prefix] = start
+
+        def finish(prefix, complete):
+            session = self.sessions[prefix]
+            self.selector.unregister(session.connection)
+            del pending[prefix]
+            results[prefix] = session.finish_all(complete)
+            self.durations[prefix] = time.perf_counter() - start
+
+        while pending:
+            now = time.perf_counter()
+            for prefix in [p for p in pending if now - pending[p] >= self.sessions[p].timeout]:
+                # Nothing for a whole timeout, the end of all message was lost
+                self.sessions[prefix].timed_out()
+                finish(prefix, False)
+            if not pending:
+                break
+            wait = min(pending[p] + self.sessions[p].timeout for p in pending) - now
+            for key, _ in self.selector.select(max(0.0, wait)):
+                prefix = key.data
+                try:
+                    done = self.sessions[prefix].read_all_burst()
+                except (socket.timeout, BlockingIOError):
+                    continue
+                except OSError as err:
+                    print(f'Error getting values from {self.sessions[prefix].addr}! {err}')
+                    finish(prefix, False)
+                    continue
+                pending[prefix] = time.perf_counter()
+                if done:
+                    finish(prefix, True)
+
+        self.values = {}
+        for prefix, values in results.items():
+            if prefix:
+                self.values.update((prefix + key, value) for key, value in values.items())
+            else:
+                self.values.update(values)
+        self.elapsed = time.perf_counter() - start
+        self.decode_time = sum(session.decode_time for session in self.sessions.values())
+        return self.values
+
+    def get_all_columnar(self):
+        '''get_all, returned as a ColumnarSnapshot whose key indices stay the same between calls'''
+        return dc.ColumnarSnapshot.from_values(self.get_all(), self.key_names, self.key_index)
+
+    def stats(self):
+        '''Returns the statistics of each session by prefix'''
+        return {prefix: session.stats() for prefix, session in self.sessions.items()}
@@ -0,0 +1,282 @@
+#UDP proxy that sits between BaseDataClient and a data server and makes the link worse on purpose,
+#so the client's retries, out-of-order handling and get_all timeouts can be tried without the lab network.
+
+import argparse
+import heapq
+import random
+import selectors
+import socket
+import threading
+import time
+
+import data_client as dc
+from timing import describe
+
+class Impairment:
+    '''How badly one direction of the link behaves.
+    loss, reorder and duplicate are probabilities per packet, delay and jitter are in seconds.
+    A reordered packet is held back an extra `reorder_delay` so the packets after it overtake it.'''
+    def __init__(self, loss=0.0, delay=0.0, jitter=0.0, reorder=0.0, duplicate=0.0, reorder_delay=None) -> None:
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.reorder_delay = reorder_delay if reorder_delay is not None else max(0.002, delay + 2*jitter)
+
+    def __repr__(self):
+        return (f'Impairment(loss={self.loss}, delay={self.delay}, jitter={self.jitter}, '
+                f'reorder={self.reorder}, duplicate={self.duplicate})')
+
+class ImpairmentProxy:
+    '''Forwards datagrams from clients on `listen` to the server at `server`, impairing both directions.
+    When the server hands out a new port with "open", the proxy opens a port of its own in front
+    of it and rewrites the reply, so clients keep talking through the proxy after select().
+    `up` applies to client -> server packets, `down` to server -> client packets.'''
+    def __init__(self, server, listen=('127.0.0.1', 0), up=None, down=None, seed=None) -> None:
+        self.server = server
+        self.listen = listen
+        self.up = up if up is not None else Impairment()
+        self.down = down if down is not None else Impairment()
+        self.random = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        # Packets waiting to be sent: (due time, sequence, socket, data, destination)
+        self.queue = []
+        self.sequence = 0
+        # (front socket, client address) -> upstream socket
+        self.upstream = {}
+        self.sockets = []
+        self.running = False
+        self.thread = None
+        self.counts = {'forwarded': 0, 'dropped': 0, 'duplicated': 0, 'reordered': 0}
+
+    def start(self):
+        '''Starts forwarding, returns the address clients should connect to'''
+        front = self.open_front(self.listen, self.server[1])
+        self.listen = front.getsockname()
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.listen
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1.0)
+        for sock in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+        self.sockets = []
+        self.upstream = {}
+
+    def open_front(self, addr, server_port):
+        '''Opens a client facing port that forwards to `server_port`'''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(addr)
+        self.sockets.append(sock)
+        self.selector.register(sock, selectors.EVENT_READ, ('front', server_port))
+        return sock
+
+    def open_upstream(self, front, client):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((self.listen[0], 0))
+        self.sockets.append(sock)
+        self.selector.register(sock, selectors.EVENT_READ, ('upstream', front, client))
+        self.upstream[(front, client)] = sock
+        return sock
+
+    def schedule(self, impairment, sock, data, dest, now):
+        '''Queues a packet for sending, dropping, delaying, reordering or duplicating it on the way'''
+        rand = self.random.random
+        if rand() < impairment.loss:
+            self.counts['dropped'] += 1
+            return
+        copies = 1
+        if rand() < impairment.duplicate:
+            copies = 2
+            self.counts['duplicated'] += 1
+        for _ in range(copies):
+            delay = impairment.delay
+            if impairment.jitter > 0:
+                delay += self.random.uniform(-impairment.jitter, impairment.jitter)
+            if rand() < impairment.reorder:
+                delay += impairment.reorder_delay
+                self.counts['reordered'] += 1
+            self.sequence += 1
+            heapq.heappush(self.queue, (now + max(0.0, delay), self.sequence, sock, data, dest))
+
+    def received(self, sock, role, now):
+        try:
+            data, addr = sock.recvfrom(dc.BUFSIZE)
+        except OSError:
+            return
+        if role[0] == 'front':
+            server_port = role[1]
+            upstream = self.upstream.get((sock, addr))
+            if upstream is None:
+                upstream = self.open_upstream(sock, addr)
+            self.schedule(self.up, upstream, data, (self.server[0], server_port), now)
+        else:
+            _, front, client = role
+            if data.startswith(b'open_::_') or data.startswith(b'open:__:'):
+                # Put a port of our own in front of the one the server opened
+                port = int(data[len(b'open_::_'):])
+                new_front = self.open_front((self.listen[0], 0), port)
+                data = b'open_::_' + str(new_front.getsockname()[1]).encode()
+            self.schedule(self.down, front, data, client, now)
+
+    def run(self):
+        while self.running:
+            now = time.monotonic()
+            # Send everything that is due
+            while self.queue and self.queue[0][0] <= now:
+                _, _, sock, data, dest = heapq.heappop(self.queue)
+                try:
+                    sock.sendto(data, dest)
+                    self.counts['forwarded'] += 1
+                except OSError:
+                    pass
+            timeout = 0.05
+            if self.queue:
+                timeout = min(timeout, max(0.0, self.queue[0][0] - now))
+            for key, _ in self.selector.select(timeout):
+                self.received(key.fileobj, key.data, time.monotonic())
+
+    def stats(self):
+        return dict(self.counts)
+
+
+def measure(addr, duration=2.0, keys=None, write=False):
+    '''Runs a client against `addr` for about `duration` seconds of get_value calls plus a few get_all,
+    returns a map of throughput, latency and completeness figures.
+    With `write` every *_Set key is also written back with the value read at the start, which would
+    overwrite any change made meanwhile, so only use it against a dummy server.'''
+    client = dc.BaseDataClient(addr)
+    # The open handshake can be lost too
+    for _ in range(3):
+        if client.select():
+            break
+    reference = {}
+    for _ in range(3):
+        reference.update(client.get_all())
+    if keys is None:
+        keys = sorted(reference)
+    result = {'keys': len(reference)}
+
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+    i = 0
+    while time.perf_counter() - start < duration:
+        key = keys[i % len(keys)]
+        i += 1
+        t = time.perf_counter()
+        value = client.get_value(key)
+        latencies.append(time.perf_counter() - t)
+        if value is None:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    result['get_rate'] = len(latencies)/elapsed
+    result['get_failed'] = failed
+    result['get_ms'] = describe(latencies, 1000)
+
+    completeness = []
+    all_times = []
+    for _ in range(5):
+        t = time.perf_counter()
+        values = client.get_all()
+        all_times.append(time.perf_counter() - t)
+        completeness.append(len(values)/max(1, len(reference)))
+    result['all_complete'] = sum(completeness)/len(completeness)
+    result['all_ms'] = describe(all_times, 1000)
+
+    result['set_acked'] = None
+    if write:
+        setpoints = {key: reference[key][1] for key in keys if key.endswith('_Set')}
+        acked = 0
+        for _ in range(5):
+            acked += client.set_values(setpoints)
+        result['set_acked'] = acked/max(1, 5*len(setpoints))
+
+    result['counters'] = client.stats()['counters']
+    client.close()
+    return result
+
+#Profiles run by --report: name -> Impairment applied in both directions
+PROFILES = [
+    ('direct', None),
+    ('clean proxy', Impairment()),
+    ('lab link', Impairment(delay=0.0005, jitter=0.0003, loss=0.001)),
+    ('1% loss', Impairment(loss=0.01)),
+    ('5% loss', Impairment(loss=0.05)),
+    ('2 ms jitter', Impairment(delay=0.002, jitter=0.002)),
+    ('5% reorder', Impairment(delay=0.001, reorder=0.05)),
+    ('5% duplicate', Impairment(duplicate=0.05)),
+    ('bad', Impairment(delay=0.002, jitter=0.002, loss=0.05, reorder=0.05, duplicate=0.02)),
+]
+
+def report(server, duration=2.0, profiles=PROFILES, seed=1, write=False):
+    '''Measures the client through each impairment profile and prints how it degrades'''
+    print('get_value rate and latency, get_all completeness and duration, set_values acknowledged, client counters')
+    print(f"{'profile':<14}{'get/s':>8}{'failed':>8}{'mean ms':>8}{'p99 ms':>8}{'max ms':>8}"
+          f"{'all %':>8}{'all ms':>8}{'set %':>8}{'retries':>9}{'timeouts':>9}{'ooo':>6}")
+    for name, impairment in profiles:
+        proxy = None
+        addr = server
+        if impairment is not None:
+            proxy = ImpairmentProxy(server, up=impairment, down=impairment, seed=seed)
+            addr = proxy.start()
+        try:
+            r = measure(addr, duration, write=write)
+        finally:
+            if proxy is not None:
+                proxy.stop()
+        c = r['counters']
+        g = r['get_ms']
+        set_acked = '-' if r['set_acked'] is None else f"{100*r['set_acked']:.1f}"
+        print(f"{name:<14}{r['get_rate']:>8.0f}{r['get_failed']:>8}{g['mean']:>8.2f}{g['p99']:>8.2f}{g['max']:>8.1f}"
+              f"{100*r['all_complete']:>8.1f}{r['all_ms']['mean']:>8.1f}{set_acked:>8}"
+              f"{c['retries']:>9}{c['timeouts']:>9}{c['out_of_order']:>6}")
+
+
+def main(argv=None):
+    from server_connection import parse_addr
+    parser = argparse.ArgumentParser(description='UDP proxy that impairs the link to the CUEBIT data server')
+    parser.add_argument('--server', type=parse_addr, default=('127.0.0.1', 20002),
+                        help='server address as host:port, a local dummy_server by default')
+    parser.add_argument('--listen', type=parse_addr, default=('127.0.0.1', 20003), help='address clients connect to')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a packet is dropped')
+    parser.add_argument('--delay', type=float, default=0.0, help='one-way delay in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='delay varies uniformly by this many ms')
+    parser.add_argument('--reorder', type=float, default=0.0, help='probability a packet is held back and overtaken')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='probability a packet is sent twice')
+    parser.add_argument('--seed', type=int, default=None, help='random seed, for repeatable runs')
+    parser.add_argument('--report', action='store_true', help='measure the client through a set of profiles and exit')
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds of get_value calls per profile in --report')
+    parser.add_argument('--dummy', action='store_true', help='start a dummy_server on --server first')
+    parser.add_argument('--write', action='store_true',
+                        help='--report also writes every *_Set key back, never use this against the real machine')
+    args = parser.parse_args(argv)
+
+    if args.dummy:
+        from dummy_server import DummyServer
+        args.server = DummyServer(args.server).start()
+
+    if args.report:
+        report(args.server, args.duration, seed=args.seed, write=args.write)
+        return
+
+    impairment = Impairment(args.loss, args.delay/1000, args.jitter/1000, args.reorder, args.duplicate)
+    proxy = ImpairmentProxy(args.server, args.listen, impairment, impairment, args.seed)
+    print(f'forwarding {proxy.start()} -> {args.server} with {impairment}')
+    try:
+        while True:
+            time.sleep(10)
+            print(proxy.stats())
+    except KeyboardInterrupt:
+        proxy.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+
+from data_client import BaseDataClient, ADDR
+from timing import FixedRate, describe
+
+class InterlockWatcher:
+    '''Watches the interlock keys on a dedicated server session with a short poll period.
+    Callbacks are called as callback(key, old, new) from the watcher thread whenever
+    a value changes, old is None for the first value read.
+    Keys the server doesn't know are dropped from the poll and reported by stale().'''
+    def __init__(self, keys, addr=ADDR, period=0.02, timeout=0.02, history=1000) -> None:
+        self.keys = list(keys)
+        # Keys the server answered with a key error
+        self.unknown = []
+        self.addr = addr
+        self.period = period
+        self.timeout = timeout
+        self.callbacks = []
+        self.values = {}
+        # Time the request of the last successful read of each key was sent
+        self.last_read = {}
+        self.client = None
+        self.thread = None
+        self.running = False
+
+        self.polls = 0
+        self.edges = 0
+        # Gaps between consecutive reads of a key, a trip can go unseen for at most this long
+        self.gaps = deque(maxlen=history)
+        self.worst_gap = 0.0
+        # Worst-case detection latency of each edge that was seen
+        self.edge_latency = deque(maxlen=history)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def start(self):
+        '''Starts watching in a daemon thread'''
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1.0)
+            self.thread = None
+
+    def poll(self):
+        '''Reads every interlock key once and fires callbacks for any changes'''
+        sent = time.monotonic()
+        values = self.client.get_values(self.keys, attempts=1)
+        now = time.monotonic()
+        self.polls += 1
+        unknown = [key for key in self.keys if key in self.client.unknown_keys]
+        if unknown:
+            print(f"Interlock keys not on the server, no longer watched: {', '.join(unknown)}")
+            self.unknown += unknown
+            self.keys = [key for key in self.keys if key not in unknown]
+        for key in values:
+            value = values[key][1]
+            # A trip just after the previous request for this key went out is only seen now
+            previous = self.last_read.get(key)
+            self.last_read[key] = sent
+            bound = None
+            if previous is not None:
+                bound = now - previous
+                self.gaps.append(bound)
+                if bound > self.worst_gap:
+                    self.worst_gap = bound
+            old = self.values.get(key)
+            if key in self.values and old == value:
+                continue
+            self.values[key] = value
+            if bound is not None:
+                self.edges += 1
+                self.edge_latency.append(bound)
+            for callback in self.callbacks:
+                try:
+                    callback(key, old, value)
+                except Exception as err:
+                    print(f'Error in interlock callback for {key}: {err}')
+
+    def run(self):
+        self.client = BaseDataClient(self.addr, timeout=self.timeout)
+        self.client.select()
+        schedule = FixedRate(self.period)
+        try:
+            while self.running:
+                schedule.wait()
+                self.poll()
+        finally:
+            self.client.close()
+
+    def stale(self, max_age=None):
+        '''Returns the keys not read within max_age seconds (default 5 poll periods), including unknown keys'''
+        if max_age is None:
+            max_age = 5*self.period
+        now = time.monotonic()
+        return [key for key in self.keys if now - self.last_read.get(key, -max_age) > max_age] + self.unknown
+
+    def stats(self):
+        '''Returns a map of the poll and detection latency statistics, times in ms'''
+        return {
+            'polls': self.polls,
+            'edges': self.edges,
+            'worst_case_ms': self.worst_gap * 1e3,
+            'detection_bound': describe(self.gaps, 1e3),
+            'edge_latency': describe(self.edge_latency, 1e3),
+        }
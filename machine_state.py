@@ -0,0 +1,143 @@
+import json
+import time
+from datetime import datetime
+
+from ramp import RampEngine, readback_key
+
+# Suffixes of the keys that make up the machine state
+STATE_SUFFIXES = ('_Set', '_Power', '_Polarity')
+# Other keys that are setpoints despite their names
+STATE_KEYS = ('Drift_Tubes_T_Ion', 'Drift_Tubes_T_Ext')
+
+# Power keys of setpoints that don't follow the <name>_Set -> <name>_Power pattern
+POWER_KEYS = {
+    'Cathode_Heater_Current_Set': 'Cathode_Heater_Power',
+    'Drift_Tubes_U0_Set': 'Drift_Tubes_Power',
+    'Drift_Tubes_UA_Set': 'Drift_Tubes_Power',
+}
+
+def power_of(key):
+    '''Power key of a setpoint, Anode_Voltage_Set -> Anode_Voltage_Power'''
+    return POWER_KEYS.get(key, key[:-len('_Set')] + '_Power')
+
+def is_state_key(key):
+    return key.endswith(STATE_SUFFIXES) or key in STATE_KEYS
+
+def polarity_power_key(key):
+    '''Power key of the supply a polarity key belongs to, Lens_1_Polarity -> Lens_1_Voltage_Power'''
+    return key[:-len('_Polarity')] + '_Voltage_Power'
+
+def capture(client, attempts=2):
+    '''Reads the current machine state, returns a map of key -> value.
+    get_all is repeated `attempts` times to fill in values lost in transit.'''
+    values = {}
+    for _ in range(attempts):
+        snapshot = client.get_all()
+        for key in snapshot:
+            if is_state_key(key):
+                values[key] = snapshot[key][1]
+    return values
+
+def save(path, values):
+    '''Writes a captured state to a JSON file'''
+    with open(path, 'w') as file:
+        json.dump({'saved': datetime.now().isoformat(), 'values': values}, file, indent=1, sort_keys=True)
+
+def load(path):
+    '''Reads a state saved by save(), returns the map of key -> value'''
+    with open(path, 'r') as file:
+        return json.load(file)['values']
+
+def restore_plan(target, current):
+    '''Splits the writes needed to go from `current` to `target` into stages applied in order:
+    supplies switching off (and supplies whose polarity changes), polarities, setpoints, then
+    supplies switching on. Keys already at their target value are left out.'''
+    changed = {key: target[key] for key in target if current.get(key) != target[key]}
+    off = {}
+    on = {}
+    polarities = {}
+    setpoints = {}
+    for key in changed:
+        value = changed[key]
+        if key.endswith('_Power'):
+            if value:
+                on[key] = value
+            else:
+                off[key] = value
+        elif key.endswith('_Polarity'):
+            polarities[key] = value
+            # Never flip the polarity of a live supply
+            power = polarity_power_key(key)
+            if current.get(power):
+                off[power] = False
+                if target.get(power, True):
+                    on[power] = True
+        else:
+            setpoints[key] = value
+    return [('off', off), ('polarity', polarities), ('setpoints', setpoints), ('on', on)]
+
+def restore(client, target, settle=5.0, tolerance=None, default_tolerance=10.0, poll=0.5, rates=None):
+    '''Brings the machine to the `target` state with one batched write per stage, then checks
+    the readbacks with a single get_all per poll until they match or `settle` seconds pass.
+    Setpoints in `rates` (units per second) of supplies that are on during the setpoints stage are
+    ramped with a RampEngine instead, and the supplies are only switched on once the ramps are done.
+    If a ramp aborts, nothing more is written.
+    Returns a map of key -> (expected, actual) for whatever did not match.'''
+    tolerance = {} if tolerance is None else tolerance
+    rates = {} if rates is None else rates
+    current = capture(client, attempts=1)
+    switched_off = set()
+    for stage, values in restore_plan(target, current):
+        if stage == 'off':
+            switched_off.update(values)
+        ramps = {}
+        if stage == 'setpoints':
+            ramps = {key: values[key] for key in values if key in rates
+                     and current.get(power_of(key)) and power_of(key) not in switched_off}
+            values = {key: values[key] for key in values if key not in ramps}
+        if values:
+            acked = client.set_values(values)
+            if acked < len(values):
+                print(f'Restore: {stage} stage, only {acked} of {len(values)} writes acknowledged')
+        if ramps and not ramp(client, ramps, rates, current):
+            break
+
+    deadline = time.monotonic() + settle
+    while True:
+        values = client.get_all()
+        mismatched = {}
+        for key in target:
+            expected = target[key]
+            if key in values and values[key][1] != expected:
+                mismatched[key] = (expected, values[key][1])
+            # Supplies that are on should read back close to their setpoint
+            read = readback_key(key)
+            if read in values and isinstance(expected, (int, float)) and not isinstance(expected, bool):
+                power = POWER_KEYS.get(key, key[:-len('_Set')] + '_Power')
+                if target.get(power, True):
+                    allowed = tolerance.get(key, default_tolerance)
+                    actual = values[read][1]
+                    if abs(float(actual) - expected) > allowed:
+                        mismatched[read] = (expected, actual)
+        if not mismatched or time.monotonic() > deadline:
+            return mismatched
+        time.sleep(poll)
+
+def ramp(client, targets, rates, current, period=0.1):
+    '''Ramps the setpoints of live supplies to `targets`, from their values in `current`, and waits for
+    the ramps to end. Returns False if a readback did not follow and the ramp was aborted.'''
+    engine = RampEngine(client, period=period, powers=POWER_KEYS)
+    for key in targets:
+        try:
+            start = float(current[key]) if key in current else None
+            engine.set_target(key, float(targets[key]), rates[key], start)
+        except (TypeError, ValueError) as err:
+            print(f'Restore: could not ramp {key}! {err}')
+            return False
+    engine.start()
+    while engine.running:
+        time.sleep(period)
+    if engine.status == 'aborted':
+        print(f'Restore: ramp aborted, the rest of the state was not written ({engine.abort_reason})')
+        return False
+    return True
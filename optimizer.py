@@ -0,0 +1,151 @@
+import threading
+import time
+import numpy as np
+from scipy.optimize import minimize
+
+class Stopped(Exception):
+    '''Raised inside the objective to end the optimization early'''
+
+class BeamOptimizer:
+    '''Maximizes a readout (e.g. a Faraday cup current) over several setpoints with Nelder-Mead.
+    Every evaluation writes all setpoints in one batch, waits `settle` seconds and averages
+    the readout, taking more samples (up to `max_samples`) while its standard error is above
+    `rel_error` of the mean, so noise does not steer the simplex.
+    Setpoints are scaled by their `steps`, which also set the size of the initial simplex.
+    The search ends once the simplex readouts agree within `noise_factor` times the noise measured
+    at the start point, readouts closer than that can't be told apart anyway.
+    A search that ends by itself leaves the setpoints at the best point found, one that is stopped
+    or fails puts them back at the start. The client is closed at the end if `close` is true.'''
+    def __init__(self, client, keys, start, steps, bounds, readout_key, settle=0.1,
+                 samples=3, max_samples=12, rel_error=0.02, max_evaluations=100, noise_factor=3.0, close=False) -> None:
+        self.client = client
+        self.keys = list(keys)
+        self.start_values = np.asarray(start, dtype=float)
+        self.steps = np.asarray(steps, dtype=float)
+        self.bounds = [tuple(b) for b in bounds]
+        self.readout_key = readout_key
+        self.settle = settle
+        self.samples = samples
+        self.max_samples = max_samples
+        self.rel_error = rel_error
+        self.max_evaluations = max_evaluations
+        self.noise_factor = noise_factor
+        self.close = close
+
+        # (setpoints, mean readout, standard error, samples) of every evaluation
+        self.history = []
+        self.best = None
+        self.running = False
+        self.thread = None
+        self.status = 'idle'
+        self.result = None
+        # Tolerance on the readout the search stopped at, and the start point's objective already measured
+        self.fatol = 0.0
+        self.measured = None
+
+    def to_setpoints(self, z):
+        return self.start_values + np.asarray(z)*self.steps
+
+    def read(self, n):
+        '''Reads the readout n times, returns the values that arrived'''
+        readings = []
+        for _ in range(n):
+            values = self.client.get_values([self.readout_key])
+            if self.readout_key in values:
+                readings.append(float(values[self.readout_key][1]))
+        return readings
+
+    def evaluate(self, setpoints):
+        '''Writes the setpoints, returns (mean, standard error, samples) of the readout'''
+        if not self.running:
+            raise Stopped()
+        written = time.monotonic()
+        self.client.set_values({key: float(value) for key, value in zip(self.keys, setpoints)})
+        remaining = written + self.settle - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        readings = self.read(self.samples)
+        while True:
+            n = len(readings)
+            if n == 0:
+                return np.nan, np.inf, 0
+            mean = float(np.mean(readings))
+            sem = float(np.std(readings, ddof=1)/np.sqrt(n)) if n > 1 else np.inf
+            if n >= self.max_samples or sem <= self.rel_error*abs(mean):
+                return mean, sem, n
+            readings += self.read(min(n, self.max_samples - n))
+
+    def objective(self, z):
+        if self.measured is not None and np.array_equal(z, self.measured[0]):
+            # minimize starts at the point run() already evaluated to measure the noise
+            value = self.measured[1]
+            self.measured = None
+            return value
+        setpoints = self.to_setpoints(z)
+        mean, sem, n = self.evaluate(setpoints)
+        self.history.append((setpoints, mean, sem, n))
+        if not np.isnan(mean) and (self.best is None or mean > self.best[1]):
+            self.best = (setpoints, mean, sem)
+        if np.isnan(mean):
+            # Nothing was read, treat the point as bad rather than failing the search
+            return np.inf
+        return -mean
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.status = 'running'
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(2*self.settle + 1)
+        self.thread = None
+
+    def noise_tolerance(self):
+        '''Readout difference the noise of the start point allows, 0 if nothing was read there'''
+        if not self.history:
+            return 0.0
+        _, mean, sem, _ = self.history[-1]
+        if np.isnan(mean):
+            return 0.0
+        # The standard error of the mean is only below rel_error once enough samples were averaged
+        noise = self.rel_error*abs(mean)
+        if np.isfinite(sem):
+            noise = max(noise, sem)
+        return self.noise_factor*noise
+
+    def run(self):
+        n = len(self.keys)
+        # Scaled bounds, in units of steps from the start
+        bounds = [((low - x0)/step, (high - x0)/step) for (low, high), x0, step in zip(self.bounds, self.start_values, self.steps)]
+        simplex = np.vstack([np.zeros(n), np.eye(n)])
+        try:
+            # A tolerance of 0 is never met by noisy readouts, take it from the noise at the start point
+            self.measured = (np.zeros(n), self.objective(np.zeros(n)))
+            self.fatol = self.noise_tolerance()
+            self.result = minimize(self.objective, np.zeros(n), method='Nelder-Mead', bounds=bounds,
+                                   options={'initial_simplex': simplex, 'maxfev': max(1, self.max_evaluations - 1),
+                                            'xatol': 0.05, 'fatol': self.fatol})
+            self.status = 'done'
+        except Stopped:
+            self.status = 'stopped'
+        except Exception as err:
+            print(f'Beam optimizer failed: {err}')
+            self.status = 'failed'
+        finally:
+            self.running = False
+            self.measured = None
+            try:
+                # Only a finished search has a best point worth keeping
+                final = self.best[0] if self.status == 'done' and self.best is not None else self.start_values
+                values = {key: float(value) for key, value in zip(self.keys, final)}
+                if self.client.set_values(values) < len(values):
+                    print(f'Beam optimizer: could not set {", ".join(values)}, please check them')
+            finally:
+                if self.close:
+                    self.client.close()
@@ -0,0 +1,203 @@
+import threading
+
+from timing import FixedRate
+
+def readback_key(key):
+    '''Default readback of a setpoint, Cathode_Voltage_Set -> Cathode_Voltage_Read'''
+    if key.endswith('_Set'):
+        return key[:-4] + '_Read'
+    return None
+
+def power_key(key):
+    '''Default power switch of a setpoint, Cathode_Voltage_Set -> Cathode_Voltage_Power'''
+    if key.endswith('_Set'):
+        return key[:-4] + '_Power'
+    return None
+
+class RampEngine:
+    '''Ramps any number of setpoints towards their targets at their own rates (units per second).
+    All the setpoints are written together every `period` seconds, and after each step the
+    readbacks are fetched in one batch. If a readback stays further from its setpoint than the
+    tolerance plus `lag` steps of ramping for `max_violations` steps in a row, the whole ramp is
+    aborted and every supply is held at its last setpoint.
+    A supply whose power switch reads off can't follow its setpoint, so its readback isn't checked,
+    and a readback that can't be read counts against the ramp like one that is off (map it to None to not check it).
+    Targets can be added from another thread while ramping, the client is only used by one thread at a time.'''
+    def __init__(self, client, period=0.1, tolerance=None, default_tolerance=10.0, lag=3,
+                 max_violations=3, readbacks=None, powers=None) -> None:
+        self.client = client
+        self.period = period
+        self.tolerance = {} if tolerance is None else dict(tolerance)
+        self.default_tolerance = default_tolerance
+        self.lag = lag
+        self.max_violations = max_violations
+        self.readbacks = {} if readbacks is None else dict(readbacks)
+        self.powers = {} if powers is None else dict(powers)
+
+        self.targets = {}
+        self.rates = {}
+        self.setpoints = {}
+        self.violations = {}
+        self.lock = threading.Lock()
+        # Held for every request, the ramp thread and set_target share the client
+        self.io_lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.status = 'idle'
+        self.abort_reason = None
+        self.steps = 0
+
+    def readback(self, key):
+        if key in self.readbacks:
+            return self.readbacks[key]
+        return readback_key(key)
+
+    def power(self, key):
+        if key in self.powers:
+            return self.powers[key]
+        return power_key(key)
+
+    def set_target(self, key, target, rate, start=None):
+        '''Adds or changes the target of `key`. A key already ramping carries on from its
+        current setpoint, otherwise the ramp begins from `start`, or from the setpoint
+        on the server if not given'''
+        with self.lock:
+            if key in self.targets:
+                start = self.setpoints[key]
+        if start is None:
+            with self.io_lock:
+                resp = self.client.get_value(key)
+            if resp is None:
+                raise ValueError(f'could not read the current value of {key}')
+            start = float(resp[1])
+        with self.lock:
+            self.setpoints[key] = start
+            self.targets[key] = target
+            self.rates[key] = abs(rate)
+            self.violations[key] = 0
+
+    def ramp(self, targets, rates):
+        '''Starts ramping each key in `targets` at the matching rate in `rates`'''
+        for key in targets:
+            self.set_target(key, targets[key], rates[key])
+        self.start()
+
+    def start(self):
+        # Under the lock so a ramp thread that is just finishing either sees the new targets or has already stopped
+        with self.lock:
+            if self.running and self.thread is not None and self.thread.is_alive():
+                return
+            self.running = True
+            self.status = 'ramping'
+            self.abort_reason = None
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        '''Stops ramping, leaving every supply at its current setpoint'''
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(1.0)
+        self.thread = None
+        with self.lock:
+            self.targets = {}
+
+    def abort(self, reason):
+        print(f'Ramp aborted: {reason}')
+        self.abort_reason = reason
+        self.status = 'aborted'
+        self.running = False
+        with self.lock:
+            self.targets = {}
+
+    def next_setpoints(self):
+        '''Moves every active setpoint one step towards its target, returns the ones that changed'''
+        changed = {}
+        with self.lock:
+            for key in self.targets:
+                current = self.setpoints[key]
+                target = self.targets[key]
+                step = self.rates[key]*self.period
+                if abs(target - current) <= step:
+                    new = target
+                elif target > current:
+                    new = current + step
+                else:
+                    new = current - step
+                if new != current:
+                    self.setpoints[key] = new
+                    changed[key] = new
+        return changed
+
+    def check_readbacks(self):
+        '''Compares the readbacks with the setpoints, returns False if the ramp was aborted'''
+        with self.lock:
+            keys = {self.readback(key): key for key in self.targets if self.readback(key) is not None}
+            powers = {key: self.power(key) for key in keys.values() if self.power(key) is not None}
+        if not keys:
+            return True
+        with self.io_lock:
+            values = self.client.get_values(list(keys) + list(set(powers.values())))
+        for read_key in keys:
+            key = keys[read_key]
+            power = values.get(powers.get(key))
+            if power is not None and not power[1]:
+                # Switched off, the readback stays at 0 whatever the setpoint
+                self.violations[key] = 0
+                continue
+            try:
+                read = float(values[read_key][1])
+            except (KeyError, TypeError, ValueError):
+                # Nothing to check the supply against
+                read = None
+            # A supply still moving lags its setpoint by a few steps
+            allowed = self.tolerance.get(key, self.default_tolerance)
+            if self.setpoints[key] != self.targets.get(key):
+                allowed += self.lag*self.rates[key]*self.period
+            if read is None or abs(read - self.setpoints[key]) > allowed:
+                self.violations[key] += 1
+                if self.violations[key] >= self.max_violations:
+                    if read is None:
+                        self.abort(f'{read_key} could not be read, setpoint {key} is {self.setpoints[key]}')
+                    else:
+                        self.abort(f'{read_key} reads {read}, setpoint {key} is {self.setpoints[key]}')
+                    return False
+            else:
+                self.violations[key] = 0
+        return True
+
+    def finished(self):
+        '''Removes the keys whose setpoint reached the target, returns True when none are left'''
+        with self.lock:
+            for key in list(self.targets):
+                if self.setpoints[key] == self.targets[key] and self.violations[key] == 0:
+                    del self.targets[key]
+            if self.targets:
+                return False
+            # Decided under the lock, a target set from now on gets a new thread from start()
+            self.running = False
+            self.status = 'done'
+            return True
+
+    def run(self):
+        schedule = FixedRate(self.period)
+        try:
+            while self.running:
+                schedule.wait()
+                changed = self.next_setpoints()
+                if changed:
+                    with self.io_lock:
+                        acked = self.client.set_values(changed)
+                    if acked < len(changed):
+                        print('Ramp: not every setpoint was acknowledged')
+                self.steps += 1
+                if not self.check_readbacks():
+                    break
+                if self.finished():
+                    break
+        finally:
+            with self.lock:
+                # A newer thread may already be ramping
+                if self.thread is threading.current_thread():
+                    self.running = False
@@ -0,0 +1,53 @@
+import csv
+import time
+from datetime import datetime
+
+# Columns of a recording, one row per value per snapshot: when it was polled, the key,
+# the server's timestamp of the value (which can be old for a key that rarely changes) and the value
+COLUMNS = ['time', 'key', 'stamp', 'value']
+
+class SnapshotRecorder:
+    '''Appends get_all snapshots to a CSV file, one row per (poll time, key, server timestamp, value).
+    Times are written as epoch seconds, the poll time is the same for every row of a snapshot so rows stay in time order.'''
+    def __init__(self, path, keys=None, flush_every=10) -> None:
+        '''keys limits the recorded keys, flush_every is the number of snapshots between flushes'''
+        self.path = path
+        self.keys = None if keys is None else set(keys)
+        self.flush_every = flush_every
+        self.count = 0
+        new_file = True
+        try:
+            with open(path, 'r', newline='') as existing:
+                header = existing.readline()
+            new_file = header == ''
+            if not new_file and next(csv.reader([header])) != COLUMNS:
+                raise ValueError(f'{path} was recorded with other columns ({header.strip()}), record to a new file')
+        except FileNotFoundError:
+            pass
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(COLUMNS)
+
+    def record(self, values, now=None):
+        '''Writes the `values` map (key -> (datetime, value)) to the file, polled at `now` (epoch seconds, the current time by default)'''
+        if now is None:
+            now = time.time()
+        polled = f'{now:.6f}'
+        rows = []
+        for key in values:
+            if self.keys is not None and key not in self.keys:
+                continue
+            timestamp, value = values[key]
+            if isinstance(timestamp, datetime):
+                timestamp = timestamp.timestamp()
+            rows.append((polled, key, f'{timestamp:.6f}', value))
+        self.writer.writerows(rows)
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,142 @@
+import threading
+import time
+import numpy as np
+
+class RasterScan:
+    '''Scans two setpoints over a grid and records readouts (e.g. Faraday cup currents) at every point.
+    Rows are scanned in alternating directions so the setpoints never jump across the grid.
+    Each point writes both setpoints in one batch, waits `settle` seconds from the write
+    and then reads all readouts in one batch, averaging `samples` reads.
+    Results go into `data`, a (len(y_values), len(x_values), len(readout_keys)) array, NaN until measured.
+    The setpoints are put back to where they were once the scan ends, however it ends, and the client
+    is closed then if `close` is true.'''
+    def __init__(self, client, x_key, y_key, x_values, y_values, readout_keys, settle=0.05, samples=1, close=False) -> None:
+        self.client = client
+        self.x_key = x_key
+        self.y_key = y_key
+        self.x_values = np.asarray(x_values, dtype=float)
+        self.y_values = np.asarray(y_values, dtype=float)
+        self.readout_keys = list(readout_keys)
+        self.settle = settle
+        self.samples = samples
+        self.close = close
+        self.data = np.full((len(self.y_values), len(self.x_values), len(self.readout_keys)), np.nan)
+        self.points = 0
+        self.running = False
+        self.thread = None
+        self.started = None
+        self.finished = None
+        # Setpoints before the scan, restored when it ends
+        self.original = {}
+
+    def order(self):
+        '''Grid indices (iy, ix) in the order they are visited'''
+        for iy in range(len(self.y_values)):
+            columns = range(len(self.x_values))
+            if iy % 2:
+                columns = reversed(columns)
+            for ix in columns:
+                yield iy, ix
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(1.0)
+        self.thread = None
+
+    def measure(self):
+        '''Reads the readouts `samples` times, returns their means (NaN if never read)'''
+        sums = np.zeros(len(self.readout_keys))
+        counts = np.zeros(len(self.readout_keys))
+        for _ in range(self.samples):
+            values = self.client.get_values(self.readout_keys)
+            for i, key in enumerate(self.readout_keys):
+                if key in values:
+                    sums[i] += float(values[key][1])
+                    counts[i] += 1
+        with np.errstate(invalid='ignore'):
+            return sums / counts
+
+    def restore(self):
+        '''Writes back the setpoints read before the scan'''
+        if self.original and self.client.set_values(self.original) < len(self.original):
+            print(f'Scan: could not restore {", ".join(self.original)}, please check them')
+
+    def run(self):
+        self.started = time.monotonic()
+        values = self.client.get_values([self.x_key, self.y_key])
+        self.original = {key: float(values[key][1]) for key in (self.x_key, self.y_key) if key in values}
+        if len(self.original) < 2:
+            # Scanning a setpoint that can't be put back would leave it at the edge of the grid
+            print(f'Scan: could not read {self.x_key} and {self.y_key}, not scanning')
+            self.running = False
+        try:
+            for iy, ix in self.order():
+                if not self.running:
+                    break
+                written = time.monotonic()
+                self.client.set_values({self.x_key: float(self.x_values[ix]), self.y_key: float(self.y_values[iy])})
+                remaining = written + self.settle - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.data[iy, ix] = self.measure()
+                self.points += 1
+        finally:
+            self.restore()
+            if self.close:
+                self.client.close()
+            self.finished = time.monotonic()
+            self.running = False
+
+    def rate(self):
+        '''Points measured per second so far'''
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.monotonic()
+        return self.points / (end - self.started) if end > self.started else 0.0
+
+    def image(self, readout=0):
+        '''2-D (y, x) array of one readout'''
+        return self.data[:, :, readout]
+
+    def centre(self, readout=0):
+        '''Fits the beam centre of one readout, returns (x, y, sigma x, sigma y) or None.
+        Uses a 2-D Gaussian fit, falling back to the intensity weighted centroid.'''
+        return fit_centre(self.x_values, self.y_values, self.image(readout))
+
+def _gaussian(coords, amplitude, x0, y0, sx, sy, offset):
+    x, y = coords
+    return offset + amplitude*np.exp(-(x - x0)**2/(2*sx**2) - (y - y0)**2/(2*sy**2))
+
+def fit_centre(x_values, y_values, image):
+    '''Returns (x, y, sigma x, sigma y) of the peak in `image`, or None if nothing was measured'''
+    xx, yy = np.meshgrid(x_values, y_values)
+    mask = ~np.isnan(image)
+    if mask.sum() == 0:
+        return None
+    x, y, z = xx[mask], yy[mask], image[mask]
+    weights = z - z.min()
+    if weights.sum() <= 0:
+        return None
+    # Centroid is the starting point of the fit and the fallback
+    cx = np.sum(weights*x)/weights.sum()
+    cy = np.sum(weights*y)/weights.sum()
+    sx = np.sqrt(np.sum(weights*(x - cx)**2)/weights.sum()) or 1.0
+    sy = np.sqrt(np.sum(weights*(y - cy)**2)/weights.sum()) or 1.0
+    if mask.sum() < 7:
+        return cx, cy, sx, sy
+    try:
+        from scipy.optimize import curve_fit
+        guess = (z.max() - z.min(), cx, cy, sx, sy, z.min())
+        popt, _ = curve_fit(_gaussian, (x, y), z, p0=guess, maxfev=2000)
+        return popt[1], popt[2], abs(popt[3]), abs(popt[4])
+    except Exception:
+        return cx, cy, sx, sy
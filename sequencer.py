@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+
+from data_client import PreparedSet
+from timing import describe
+
+# How long before a send is due to stop sleeping and spin on the clock instead
+SPIN = 0.002
+
+class TrapSequencer:
+    '''Runs repeated trap cycles, e.g. ion breeding then extraction.
+    `phases` is a list of (name, duration in s, {key: value}), the setpoints of a phase
+    are sent at its start on a time.monotonic() schedule that does not drift from cycle to cycle.
+    The messages are encoded before the sequence starts, so sending only fills in a timestamp.
+    The client's heartbeat runs while waiting for a phase, never just before its sends.'''
+    def __init__(self, client, phases, cycles=None, history=10000) -> None:
+        self.client = client
+        self.phases = [(name, duration, [PreparedSet(key, values[key]) for key in values])
+                       for name, duration, values in phases]
+        self.period = sum(duration for _, duration, _ in self.phases)
+        self.cycles = cycles
+        self.cycle = 0
+        self.running = False
+        self.thread = None
+        # (cycle, phase name, due time, first send time, last send time, setpoints acknowledged)
+        self.records = deque(maxlen=history)
+        self.missed_acks = 0
+        # Time keep_alive may take at worst: every miss tried as hello and as get
+        self.ping_time = (2*getattr(client, 'misses', 0) + 1)*getattr(client, 'timeout', 0.0)
+
+    def start(self):
+        '''Starts the sequence in a daemon thread'''
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1.0)
+            self.thread = None
+
+    def wait_until(self, due):
+        '''Sleeps until shortly before `due`, then spins to hit it closely.
+        Returns False if stopped while waiting.'''
+        while self.running:
+            remaining = due - time.monotonic()
+            if remaining <= 0:
+                return True
+            if remaining > self.ping_time + SPIN:
+                # Pings the server if it has been quiet, there is time for it before the sends
+                self.client.keep_alive()
+                remaining = due - time.monotonic()
+            if remaining > SPIN:
+                # Sleep in slices so stop() doesn't have to wait out a long phase
+                time.sleep(min(remaining - SPIN, 0.05))
+        return False
+
+    def run(self):
+        # Start on the next whole period after a short lead time
+        start = time.monotonic() + 0.05
+        self.cycle = 0
+        try:
+            while self.running and (self.cycles is None or self.cycle < self.cycles):
+                offset = 0.0
+                cycle_start = start + self.cycle*self.period
+                for name, duration, prepared in self.phases:
+                    due = cycle_start + offset
+                    offset += duration
+                    if not self.wait_until(due):
+                        break
+                    if not getattr(self.client, 'online', True):
+                        # keep_alive lost the server, the sends would only wait out the timeout
+                        self.missed_acks += len(prepared)
+                        continue
+                    sent, acked = self.client.send_prepared(prepared)
+                    if acked < len(prepared):
+                        self.missed_acks += len(prepared) - acked
+                    if sent:
+                        self.records.append((self.cycle, name, due, sent[0], sent[-1], acked))
+                self.cycle += 1
+                # If a cycle overran, restart the schedule rather than firing late phases back to back
+                if time.monotonic() > start + self.cycle*self.period:
+                    start = time.monotonic() - self.cycle*self.period
+        finally:
+            self.running = False
+
+    def stats(self):
+        '''Returns the send timing statistics in ms: jitter is how late the first setpoint of
+        a phase was sent, spread is the time between its first and last setpoint'''
+        records = list(self.records)
+        return {
+            'cycles': self.cycle,
+            'phases': len(records),
+            'missed_acks': self.missed_acks,
+            'jitter': describe([sent - due for _, _, due, sent, _, _ in records], 1e3),
+            'spread': describe([last - first for _, _, _, first, last, _ in records], 1e3),
+        }
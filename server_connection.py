@@ -16,22 +16,164 @@ except:
 if DEBUG:
     ADDR = ("130.127.188.254", 20002)
 
+#Import General Tools
+import argparse
+import time
+
+from timing import FixedRate, CycleStats
+
 
 class server_client():
-    def __init__(self):
-        #Establishes connection to Server
+    def __init__(self, addr=ADDR, raw_time=False, federate=None):
+        #Establishes connection to Server, and to the servers in `federate` (prefix -> address) if given
         try:
-            self.client = BaseDataClient(ADDR)
+            if federate:
+                from federation import FederatedClient
+                self.client = FederatedClient({'': addr, **federate}, raw_time=raw_time)
+            else:
+                self.client = BaseDataClient(addr, raw_time=raw_time)
             self.client.select()
         except:
             print('Error: Could not establish connection to server')
 
-server = server_client()
 
-values = server.client.get_all()
+class LossStats:
+    '''Counts values missing from get_all responses, compared to every key seen so far'''
+    def __init__(self) -> None:
+        self.known = set()
+        self.expected = 0
+        self.received = 0
+        self.empty = 0
+
+    def add(self, values):
+        self.known.update(values)
+        self.expected += len(self.known)
+        self.received += len(values)
+        if not values:
+            self.empty += 1
+
+    def summary(self):
+        lost = self.expected - self.received
+        rate = lost / self.expected if self.expected else 0.0
+        return {'keys': len(self.known), 'lost': lost, 'loss_rate': rate, 'empty_polls': self.empty}
+
+
+class PollingDaemon:
+    '''Polls get_all at a fixed rate and hands each snapshot to the configured outputs'''
+    def __init__(self, client, rate=10.0, bus=None, recorder=None, report=10.0) -> None:
+        self.client = client
+        self.period = 1.0 / rate
+        self.bus = bus
+        self.recorder = recorder
+        self.report_period = report
+        self.cycle_stats = CycleStats(self.period)
+        self.loss_stats = LossStats()
+        self.running = False
+
+    def poll_once(self):
+        values = self.client.get_all()
+        self.loss_stats.add(values)
+        if self.bus is not None:
+            self.bus.publish(values)
+        if self.recorder is not None:
+            self.recorder.record(values)
+        return values
+
+    def report(self, schedule):
+        timing = self.cycle_stats.summary()
+        loss = self.loss_stats.summary()
+        jitter = timing['jitter']
+        duration = timing['duration']
+        print(f"cycles {timing['cycles']} overruns {timing['overruns']} skipped {schedule.skipped} | "
+              f"jitter mean {jitter['mean']:.2f} p99 {jitter['p99']:.2f} max {jitter['max']:.2f} ms | "
+              f"cycle mean {duration['mean']:.2f} max {duration['max']:.2f} ms | "
+              f"keys {loss['keys']} lost {loss['lost']} ({100*loss['loss_rate']:.2f}%) empty {loss['empty_polls']}",
+              flush=True)
+
+    def run(self, cycles=None):
+        '''Polls until stopped, or for `cycles` polls if given'''
+        self.running = True
+        schedule = FixedRate(self.period)
+        next_report = time.monotonic() + self.report_period
+        n = 0
+        try:
+            while self.running and (cycles is None or n < cycles):
+                late = schedule.wait()
+                start = time.monotonic()
+                self.poll_once()
+                self.cycle_stats.add(late, time.monotonic() - start)
+                n += 1
+                if self.report_period > 0 and time.monotonic() >= next_report:
+                    self.report(schedule)
+                    next_report += self.report_period
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+        self.report(schedule)
+
+    def stop(self):
+        self.running = False
+
+
+def parse_addr(text):
+    '''Parses host:port into an address tuple'''
+    host, port = text.rsplit(':', 1)
+    return (host, int(port))
+
+
+def parse_federate(text):
+    '''Parses PREFIX=host:port into (prefix, address)'''
+    prefix, addr = text.split('=', 1)
+    return prefix, parse_addr(addr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless CUEBIT data server poller')
+    parser.add_argument('--addr', type=parse_addr, default=ADDR, help='server address as host:port')
+    parser.add_argument('--rate', type=float, default=10.0, help='polls per second')
+    parser.add_argument('--cycles', type=int, default=None, help='stop after this many polls')
+    parser.add_argument('--publish', nargs='?', const='cuebit_snapshot', default=None, metavar='NAME',
+                        help='publish snapshots to the shared memory bus NAME')
+    parser.add_argument('--record', default=None, metavar='FILE', help='append snapshots to the CSV file FILE')
+    parser.add_argument('--report', type=float, default=10.0, help='seconds between statistics reports, 0 for only at exit')
+    parser.add_argument('--once', action='store_true', help='print a single get_all and exit')
+    parser.add_argument('--federate', type=parse_federate, action='append', default=[], metavar='PREFIX=HOST:PORT',
+                        help='also poll the server at HOST:PORT, its keys prefixed with PREFIX (repeatable)')
+    args = parser.parse_args(argv)
+
+    # The bus and recorder store epoch seconds, so skip making datetimes
+    server = server_client(args.addr, raw_time=not args.once, federate=dict(args.federate))
+
+    if args.once:
+        print(server.client.get_all())
+        return
+
+    # The shared memory layout is fixed, so take the keys from an initial poll
+    bus = None
+    if args.publish is not None:
+        from snapshot_bus import STALE_AFTER, SnapshotWriter
+        keys = set()
+        for _ in range(5):
+            keys.update(server.client.get_all())
+        # A bus still being published to at our own rate belongs to another poller
+        bus = SnapshotWriter(sorted(keys), name=args.publish, stale_after=max(STALE_AFTER, 3.0/args.rate))
+
+    recorder = None
+    if args.record is not None:
+        from recorder import SnapshotRecorder
+        recorder = SnapshotRecorder(args.record)
 
-print(values)
+    daemon = PollingDaemon(server.client, args.rate, bus, recorder, args.report)
+    try:
+        daemon.run(args.cycles)
+    finally:
+        if bus is not None:
+            bus.close()
+        if recorder is not None:
+            recorder.close()
+        server.client.close()
 
-U_cat = values['Cathode_Voltage_Read'][1]
 
-#print(U_cat)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import struct
+import time
+from datetime import datetime
+from multiprocessing import shared_memory
+
+# Default name of the shared memory block
+BUS_NAME = 'cuebit_snapshot'
+
+# Header is the sequence counter, number of keys and length of the key names block
+HEADER = struct.Struct("<QII")
+# Each key gets a slot of type id, timestamp and value, all as doubles
+SLOT = struct.Struct("<ddd")
+
+# Seconds a left over block's sequence counter has to stand still before it is taken as abandoned
+STALE_AFTER = 2.0
+
+# Type ids stored in a slot, matching the ids used by data_client value types
+EMPTY = 0
+DOUBLE = 1
+INTEGER = 2
+BOOLEAN = 3
+
+def _pad(size):
+    '''Rounds size up to a multiple of 8 so the slots stay aligned'''
+    return (size + 7) & ~7
+
+def _encode(value):
+    '''Returns the type id and float form of value, or EMPTY if it can't be stored'''
+    if isinstance(value, bool):
+        return BOOLEAN, float(value)
+    if isinstance(value, int):
+        return INTEGER, float(value)
+    if isinstance(value, float):
+        return DOUBLE, value
+    return EMPTY, 0.0
+
+def _decode(id, value):
+    '''Inverse of _encode'''
+    if id == BOOLEAN:
+        return bool(value)
+    if id == INTEGER:
+        return int(value)
+    return value
+
+def _is_stale(buf, wait):
+    '''Watches the sequence counter in buf for `wait` seconds, returns True if no snapshot was published meanwhile'''
+    seq = struct.unpack_from("<Q", buf, 0)[0]
+    end = time.monotonic() + wait
+    while time.monotonic() < end:
+        time.sleep(0.05)
+        if struct.unpack_from("<Q", buf, 0)[0] != seq:
+            return False
+    return True
+
+class SnapshotWriter:
+    '''Publishes get_all snapshots into shared memory for readers in other processes.
+    The key layout is fixed on creation, values for other keys are ignored.
+    Only numeric and boolean values are stored, strings are left out.
+    A block left over under the same name is only replaced if nothing was published to it for `stale_after` seconds,
+    otherwise another poller is still using it and FileExistsError is raised.'''
+    def __init__(self, keys, name=BUS_NAME, stale_after=STALE_AFTER) -> None:
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        names = '\n'.join(self.keys).encode('utf-8')
+        self.data_offset = HEADER.size + _pad(len(names))
+        size = self.data_offset + SLOT.size * len(self.keys)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            old = shared_memory.SharedMemory(name=name)
+            if not _is_stale(old.buf, stale_after):
+                try:
+                    # Not ours, keep the resource tracker from unlinking it when this process exits
+                    from multiprocessing import resource_tracker
+                    resource_tracker.unregister(old._name, 'shared_memory')
+                except Exception:
+                    pass
+                old.close()
+                raise FileExistsError(f"Snapshot bus '{name}' is in use, another poller is publishing to it") from None
+            # Left over from a poller that did not exit cleanly, replace it
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.buf = self.shm.buf
+        self.seq = 0
+        HEADER.pack_into(self.buf, 0, self.seq, len(self.keys), len(names))
+        self.buf[HEADER.size:HEADER.size + len(names)] = names
+
+    def publish(self, values):
+        '''Writes the `values` map (key -> (datetime, value)) as the latest snapshot'''
+        # Odd sequence tells readers a write is in progress
+        self.seq += 1
+        struct.pack_into("<Q", self.buf, 0, self.seq)
+        for key in values:
+            i = self.index.get(key)
+            if i is None:
+                continue
+            timestamp, value = values[key]
+            id, number = _encode(value)
+            if isinstance(timestamp, datetime):
+                timestamp = timestamp.timestamp()
+            SLOT.pack_into(self.buf, self.data_offset + i * SLOT.size, id, timestamp, number)
+        self.seq += 1
+        struct.pack_into("<Q", self.buf, 0, self.seq)
+        return self.seq
+
+    def close(self, unlink=True):
+        '''Detaches from the shared memory, and removes it if unlink is true'''
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class SnapshotReader:
+    '''Lock-free reader for the snapshots published by a SnapshotWriter'''
+    def __init__(self, name=BUS_NAME) -> None:
+        self.shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Readers don't own the block, so stop the resource tracker
+            # from unlinking it when this process exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        except Exception:
+            pass
+        self.buf = self.shm.buf
+        _, n, names_len = HEADER.unpack_from(self.buf, 0)
+        names = bytes(self.buf[HEADER.size:HEADER.size + names_len]).decode('utf-8')
+        self.keys = names.split('\n') if n else []
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.data_offset = HEADER.size + _pad(names_len)
+        self.data_end = self.data_offset + SLOT.size * n
+        self.values = memoryview(self.buf)[self.data_offset:self.data_end].cast('d')
+
+    def version(self):
+        '''Returns the current sequence number, it changes every time a snapshot is published'''
+        return struct.unpack_from("<Q", self.buf, 0)[0]
+
+    def view(self):
+        '''Zero-copy view of the slots as doubles (id, timestamp, value per key).
+        Values may change while being read, use read() for a consistent snapshot.'''
+        return self.values
+
+    def read_raw(self, retries=1000):
+        '''Copies the slots out consistently, returns (sequence, bytes), or (None, None) if the writer stayed busy'''
+        for _ in range(retries):
+            seq = self.version()
+            if seq & 1:
+                # Writer is in the middle of publishing
+                time.sleep(0)
+                continue
+            data = bytes(self.buf[self.data_offset:self.data_end])
+            if self.version() == seq:
+                return seq, data
+        return None, None
+
+    def read(self, retries=1000):
+        '''Returns (sequence, values) where values matches the get_all format of key -> (datetime, value)'''
+        seq, data = self.read_raw(retries)
+        if data is None:
+            return None, {}
+        values = {}
+        for i, (id, timestamp, value) in enumerate(SLOT.iter_unpack(data)):
+            if id == EMPTY:
+                continue
+            values[self.keys[i]] = (datetime.fromtimestamp(timestamp), _decode(id, value))
+        return seq, values
+
+    def get(self, key, retries=1000):
+        '''Reads a single value consistently, returns None if not published'''
+        i = self.index.get(key)
+        if i is None:
+            return None
+        offset = self.data_offset + i * SLOT.size
+        for _ in range(retries):
+            seq = self.version()
+            if seq & 1:
+                time.sleep(0)
+                continue
+            id, timestamp, value = SLOT.unpack_from(self.buf, offset)
+            if self.version() == seq:
+                if id == EMPTY:
+                    return None
+                return datetime.fromtimestamp(timestamp), _decode(id, value)
+        return None
+
+    def close(self):
+        '''Detaches from the shared memory'''
+        self.values.release()
+        self.values = None
+        self.buf = None
+        self.shm.close()
@@ -0,0 +1,130 @@
+import threading
+import time
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+class Trace:
+    '''Ring buffer of (time, value) samples of one key'''
+    def __init__(self, size) -> None:
+        self.times = np.full(size, np.nan)
+        self.values = np.full(size, np.nan)
+        self.next = 0
+
+    def add(self, t, value):
+        i = self.next % len(self.times)
+        self.times[i] = t
+        self.values[i] = value
+        self.next += 1
+
+    def ordered(self):
+        '''Returns (times, values) oldest first'''
+        if self.next <= len(self.times):
+            return self.times[:self.next].copy(), self.values[:self.next].copy()
+        i = self.next % len(self.times)
+        return np.roll(self.times, -i), np.roll(self.values, -i)
+
+class StripChart:
+    '''Live plot of any number of keys as stacked traces on one canvas, sharing a time axis of
+    seconds before now. The axes only change when a trace leaves its y range, so they are
+    drawn once into cached backgrounds and each refresh only blits the traces over them.
+    `channels` is a list of (key, label, options), options may hold 'log' (log y scale),
+    'ylim' (fixed limits) and 'reference' (function giving a value drawn as a horizontal line).'''
+    def __init__(self, parent, channels, span=60.0, period=500, size=2048, figsize=(9.5, 6.8)) -> None:
+        self.parent = parent
+        self.channels = channels
+        self.span = span
+        self.period = period
+        self.lock = threading.Lock()
+        self.traces = {key: Trace(size) for key, label, options in channels}
+
+        self.fig = Figure(figsize=figsize)
+        self.fig.patch.set_facecolor('#E5E5E5')
+        self.axes = self.fig.subplots(len(channels), 1, sharex=True, squeeze=False)[:, 0]
+        self.lines = []
+        self.references = []
+        for ax, (key, label, options) in zip(self.axes, channels):
+            ax.set_facecolor('#E5E5E5')
+            ax.set_ylabel(label, fontsize=9)
+            ax.tick_params(labelsize=8)
+            ax.set_xlim(-span, 0)
+            if options.get('log'):
+                ax.set_yscale('log')
+            if 'ylim' in options:
+                ax.set_ylim(*options['ylim'])
+            line, = ax.plot([], [], animated=True)
+            self.lines.append(line)
+            reference = None
+            if 'reference' in options:
+                reference = ax.axhline(np.nan, color='red', animated=True)
+            self.references.append(reference)
+        self.axes[-1].set_xlabel('Time (s)', fontsize=9)
+        self.fig.tight_layout()
+
+        self.canvas = FigureCanvasTkAgg(self.fig, parent)
+        self.widget = self.canvas.get_tk_widget()
+        self.backgrounds = None
+        # Any full redraw (first show, resize, rescale) invalidates the cached backgrounds
+        self.canvas.mpl_connect('draw_event', lambda event: self.cache_backgrounds())
+        self.widget.after(self.period, self.tick)
+
+    def add(self, key, t, value):
+        '''Adds a sample of `key` at epoch time `t`, can be called from any thread'''
+        trace = self.traces.get(key)
+        if trace is None:
+            return
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        with self.lock:
+            trace.add(t, value)
+
+    def cache_backgrounds(self):
+        self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+
+    def rescale(self, ax, options, values):
+        '''Widens the y range when a trace leaves it, returns True if the axes changed'''
+        if 'ylim' in options:
+            return False
+        values = values[np.isfinite(values)]
+        if options.get('log'):
+            values = values[values > 0]
+        if len(values) == 0:
+            return False
+        low, high = ax.get_ylim()
+        v_min, v_max = values.min(), values.max()
+        if options.get('log'):
+            target = (v_min/2, v_max*2)
+        else:
+            margin = 0.1*(v_max - v_min) or 0.1*abs(v_max) or 1.0
+            target = (v_min - margin, v_max + margin)
+        if v_min >= low and v_max <= high:
+            # Shrink too once the data only uses a small part of the range, so it doesn't stay zoomed out
+            if options.get('log') or (high - low) <= 4*(target[1] - target[0]):
+                return False
+        ax.set_ylim(*target)
+        return True
+
+    def tick(self):
+        now = time.time()
+        data = []
+        with self.lock:
+            for key, label, options in self.channels:
+                data.append(self.traces[key].ordered())
+        changed = False
+        for ax, (key, label, options), (times, values) in zip(self.axes, self.channels, data):
+            recent = values[times > now - self.span]
+            changed |= self.rescale(ax, options, recent)
+        if changed or self.backgrounds is None:
+            # Redraws the axes and, through draw_event, the cached backgrounds
+            self.canvas.draw()
+        for i, (ax, (key, label, options), (times, values)) in enumerate(zip(self.axes, self.channels, data)):
+            self.canvas.restore_region(self.backgrounds[i])
+            self.lines[i].set_data(times - now, values)
+            ax.draw_artist(self.lines[i])
+            if self.references[i] is not None:
+                self.references[i].set_ydata([options['reference'](), options['reference']()])
+                ax.draw_artist(self.references[i])
+            self.canvas.blit(ax.bbox)
+        self.widget.after(self.period, self.tick)
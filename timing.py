@@ -0,0 +1,161 @@
+import time
+import math
+import heapq
+from collections import deque
+
+class FixedRate:
+    '''Drift-free fixed period schedule, tick n is due at start + n * period
+    regardless of how long earlier cycles took.'''
+    def __init__(self, period, start=None) -> None:
+        self.period = period
+        self.start = time.monotonic() if start is None else start
+        self.tick = 0
+        # Ticks that were dropped because a cycle overran by more than a period
+        self.skipped = 0
+
+    def due(self):
+        '''Monotonic time the next tick is due at'''
+        return self.start + self.tick * self.period
+
+    def wait(self):
+        '''Sleeps until the next tick is due, returns how late (seconds) it was started'''
+        due = self.due()
+        now = time.monotonic()
+        if now < due:
+            time.sleep(due - now)
+            now = time.monotonic()
+        late = now - due
+        self.tick += 1
+        # If we fell more than a whole period behind, skip the missed ticks
+        # rather than running them back to back
+        if late >= self.period:
+            missed = int(late // self.period)
+            self.tick += missed
+            self.skipped += missed
+        return late
+
+    def set_period(self, period):
+        '''Changes the period, keeping the schedule anchored on the next tick'''
+        self.start = self.due()
+        self.tick = 0
+        self.period = period
+
+class PollScheduler:
+    '''Keeps track of when each key is next due for polling.
+    Keys are added in groups sharing a refresh period and a priority,
+    when more keys are due than can be fetched at once the higher priorities go first.'''
+    def __init__(self) -> None:
+        self.period = {}
+        self.priority = {}
+        self.next_due = {}
+        # Heap of (due time, key), entries no longer matching next_due are skipped
+        self.heap = []
+        # Keys handed out by due() that have not been marked as read yet
+        self.in_flight = set()
+
+    def add_group(self, keys, period, priority=0):
+        '''Polls every key in `keys` once per `period` seconds, they are due straight away'''
+        now = time.monotonic()
+        for key in keys:
+            self.period[key] = period
+            self.priority[key] = priority
+            self.next_due[key] = now
+            heapq.heappush(self.heap, (now, key))
+
+    def keys(self):
+        return list(self.period)
+
+    def due(self, now=None, limit=None):
+        '''Returns the keys due at `now`, highest priority first, at most `limit` of them'''
+        if now is None:
+            now = time.monotonic()
+        # Keys that were not read last time are still due
+        for key in self.in_flight:
+            heapq.heappush(self.heap, (self.next_due[key], key))
+        self.in_flight = set()
+
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            when, key = heapq.heappop(self.heap)
+            if self.next_due.get(key) != when or key in self.in_flight:
+                continue
+            due.append(key)
+            self.in_flight.add(key)
+        due.sort(key=lambda key: (-self.priority[key], self.next_due[key]))
+        if limit is not None and len(due) > limit:
+            for key in due[limit:]:
+                self.in_flight.discard(key)
+                heapq.heappush(self.heap, (self.next_due[key], key))
+            due = due[:limit]
+        return due
+
+    def mark(self, keys, now=None):
+        '''Schedules the next poll of each of `keys`, which have just been read'''
+        if now is None:
+            now = time.monotonic()
+        for key in keys:
+            period = self.period.get(key)
+            if period is None:
+                continue
+            self.in_flight.discard(key)
+            # Stay on the key's own grid unless it fell a whole period behind
+            when = self.next_due[key] + period
+            if when <= now:
+                when = now + period
+            self.next_due[key] = when
+            heapq.heappush(self.heap, (when, key))
+
+class CycleStats:
+    '''Keeps running statistics of the cycle timing of a periodic loop'''
+    def __init__(self, period, history=1000) -> None:
+        self.period = period
+        self.history = history
+        self.cycles = 0
+        self.overruns = 0
+        self.jitter = deque(maxlen=history)
+        self.durations = deque(maxlen=history)
+        # Optional breakdown of each cycle into named phases
+        self.phases = {}
+
+    def add(self, late, duration, phases=None):
+        '''Records a cycle which started `late` seconds after due and took `duration` seconds,
+        phases optionally maps phase names to the seconds spent in them.
+        Returns True if the cycle overran its period.'''
+        self.cycles += 1
+        self.jitter.append(late)
+        self.durations.append(duration)
+        if phases is not None:
+            for name in phases:
+                if name not in self.phases:
+                    self.phases[name] = deque(maxlen=self.history)
+                self.phases[name].append(phases[name])
+        if duration > self.period:
+            self.overruns += 1
+            return True
+        return False
+
+    def summary(self):
+        '''Returns a map of the statistics over the kept history, times in ms'''
+        return {
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'jitter': describe(self.jitter, 1e3),
+            'duration': describe(self.durations, 1e3),
+            'phases': {name: describe(self.phases[name], 1e3) for name in self.phases},
+        }
+
+def describe(samples, scale=1.0):
+    '''Returns mean, standard deviation, 99th percentile and max of samples'''
+    n = len(samples)
+    if n == 0:
+        return {'mean': 0.0, 'std': 0.0, 'p99': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+    mean = sum(ordered) / n
+    std = math.sqrt(sum((x - mean)**2 for x in ordered) / n)
+    p99 = ordered[min(n - 1, int(math.ceil(0.99 * n)) - 1)]
+    return {
+        'mean': mean * scale,
+        'std': std * scale,
+        'p99': p99 * scale,
+        'max': ordered[-1] * scale,
+    }
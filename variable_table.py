@@ -0,0 +1,175 @@
+import threading
+from datetime import datetime
+from tkinter import *
+from tkinter import ttk
+
+# Columns of the table: (id, heading, width)
+COLUMNS = [('key', 'Key', 360), ('value', 'Value', 180), ('time', 'Updated', 140)]
+
+def format_value(value):
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        return '%.6g' % value
+    return str(value)
+
+def format_time(timestamp):
+    if isinstance(timestamp, float):
+        timestamp = datetime.fromtimestamp(timestamp)
+    try:
+        return timestamp.strftime('%H:%M:%S.%f')[:-3]
+    except AttributeError:
+        return str(timestamp)
+
+def sort_key(column):
+    '''Returns the function that sorts entries (key, (time, value)) by `column`.
+    Numbers sort before text so mixed value columns still have an order.'''
+    if column == 'key':
+        return lambda entry: entry[0].lower()
+    if column == 'time':
+        return lambda entry: (str(type(entry[1][0])), entry[1][0])
+    def value(entry):
+        v = entry[1][1]
+        if isinstance(v, (int, float)):
+            return (0, float(v), '')
+        return (1, 0.0, str(v))
+    return value
+
+class VariableTable:
+    '''Table of every server value, filtered by a substring of the key and sorted by clicking a column heading.
+    Only the rows on screen exist in the Treeview, they are reused as the view scrolls,
+    so the table stays quick with thousands of keys. update() can be called from any thread,
+    tick() redraws from the main thread and only touches rows whose text changed.'''
+    def __init__(self, parent, rows=40, period=500) -> None:
+        self.parent = parent
+        self.rows = rows
+        self.period = period
+
+        # key -> (datetime, value), everything that has been read
+        self.values = {}
+        # Keys that changed since the last refresh
+        self.changed = set()
+        self.new_keys = False
+        self.lock = threading.Lock()
+
+        # Keys passing the filter, in sort order, and the first one on screen
+        self.view = []
+        self.offset = 0
+        self.sort_column = 'key'
+        self.sort_reverse = False
+        # Text currently shown in each row, so unchanged rows are left alone
+        self.shown = [None]*rows
+
+        self.frame = Frame(parent, bg='white')
+        self.frame.pack(expand=1, fill='both')
+
+        top = Frame(self.frame, bg='white')
+        top.pack(side=TOP, fill=X)
+        Label(top, text='Filter', font=('Helvetica', 12), bg='white').pack(side=LEFT, padx=5, pady=5)
+        self.filter_var = StringVar()
+        self.filter_var.trace_add('write', lambda *args: self.rebuild())
+        Entry(top, textvariable=self.filter_var, font=('Helvetica', 12), width=40).pack(side=LEFT, pady=5)
+        self.count_label = Label(top, text='', font=('Helvetica', 12), bg='white')
+        self.count_label.pack(side=LEFT, padx=10)
+
+        self.tree = ttk.Treeview(self.frame, columns=[c[0] for c in COLUMNS], show='headings', height=rows, selectmode='browse')
+        for column, heading, width in COLUMNS:
+            self.tree.heading(column, text=heading, command=lambda c=column: self.sort_by(c))
+            self.tree.column(column, width=width, anchor=W)
+        for i in range(rows):
+            self.tree.insert('', END, iid=f'row{i}', values=('', '', ''))
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=VERTICAL, command=self.scroll)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.tree.pack(side=LEFT, expand=1, fill='both')
+
+        self.tree.bind('<MouseWheel>', lambda event: self.move(-1 if event.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.move(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.move(1, 'units'))
+
+        self.parent.after(self.period, self.tick)
+
+    def update(self, values):
+        '''Merges a get_all style map of key -> (datetime, value) into the table'''
+        with self.lock:
+            for key in values:
+                if key not in self.values:
+                    self.new_keys = True
+                self.values[key] = values[key]
+                self.changed.add(key)
+
+    def rebuild(self):
+        '''Filters and sorts every key again, used when keys appear, the filter or the sort changes'''
+        text = self.filter_var.get().lower()
+        with self.lock:
+            entries = [(key, self.values[key]) for key in self.values if text in key.lower()]
+            self.new_keys = False
+        try:
+            entries.sort(key=sort_key(self.sort_column), reverse=self.sort_reverse)
+        except TypeError:
+            entries.sort(key=sort_key('key'), reverse=self.sort_reverse)
+        self.view = [entry[0] for entry in entries]
+        self.offset = max(0, min(self.offset, len(self.view) - self.rows))
+        self.count_label.config(text=f'{len(self.view)} of {len(self.values)} keys')
+        self.redraw()
+
+    def sort_by(self, column):
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+        for c, heading, width in COLUMNS:
+            arrow = (' ▼' if self.sort_reverse else ' ▲') if c == column else ''
+            self.tree.heading(c, text=heading + arrow)
+        self.rebuild()
+
+    def redraw(self):
+        '''Writes the visible part of the view into the reused rows'''
+        for i in range(self.rows):
+            j = self.offset + i
+            if j < len(self.view):
+                key = self.view[j]
+                timestamp, value = self.values[key]
+                text = (key, format_value(value), format_time(timestamp))
+            else:
+                text = ('', '', '')
+            if text != self.shown[i]:
+                self.tree.item(f'row{i}', values=text)
+                self.shown[i] = text
+        n = len(self.view)
+        if n > self.rows:
+            self.scrollbar.set(self.offset/n, (self.offset + self.rows)/n)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def move(self, n, what):
+        step = self.rows if what == 'pages' else 1
+        self.set_offset(self.offset + n*step)
+
+    def set_offset(self, offset):
+        offset = max(0, min(int(offset), len(self.view) - self.rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.redraw()
+
+    def scroll(self, *args):
+        '''Scrollbar command, ('moveto', fraction) or ('scroll', n, 'units'/'pages')'''
+        if args[0] == 'moveto':
+            self.set_offset(float(args[1])*len(self.view))
+        elif args[0] == 'scroll':
+            self.move(int(args[1]), args[2])
+
+    def tick(self):
+        with self.lock:
+            new_keys = self.new_keys
+            changed = self.changed
+            self.changed = set()
+        if new_keys:
+            self.rebuild()
+        elif changed:
+            # Values changing in place keep their position until the next sort,
+            # so rows don't jump around while being read
+            visible = self.view[self.offset:self.offset + self.rows]
+            if any(key in changed for key in visible):
+                self.redraw()
+        self.parent.after(self.period, self.tick)